@@ -0,0 +1,128 @@
+import re
+
+from Instrumentation import CHARS_PER_TOKEN, approx_tokens
+
+
+class ContextBuilder:
+    """
+    Сборка контекста для запроса к LLaMA из результатов поиска в векторной БД.
+    Вместо строкового представления списка найденных записей (с идентификаторами,
+    расстояниями и повторами) в промпт попадают только уникальные строки метрик,
+    сгруппированные по типу отчета и периоду, в порядке релевантности и в пределах бюджета токенов.
+    """
+    _SPACES = re.compile(r"\s+")
+    _DIGIT_GROUPS = re.compile(r"(?<=\d)[\s ](?=\d{3}(?!\d))")
+    _PUNCTUATION = re.compile(r"[^\w\s.,%-]")
+
+    def __init__(self, token_budget: int = 2000, chars_per_token: float = CHARS_PER_TOKEN):
+        """
+        Инициализация сборщика
+        :param token_budget: Максимальный размер контекста в токенах
+        :param chars_per_token: Среднее число символов на токен для оценки размера текста
+        """
+        self.token_budget = token_budget
+        self.chars_per_token = chars_per_token
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Оценка числа токенов текста (та же, что в метриках токенов запросов к модели)
+        :param text: Текст
+        :return: Приблизительное число токенов
+        """
+        return approx_tokens(text, self.chars_per_token)
+
+    @classmethod
+    def normalize(cls, text: str) -> str:
+        """
+        Нормализация строки метрики для поиска повторов: регистр, пробелы,
+        разделители разрядов ("99 340 114" и "99340114") и лишняя пунктуация
+        :param text: Строка метрики
+        :return: Нормализованная строка
+        """
+        text = cls._DIGIT_GROUPS.sub("", text.lower().replace("ё", "е"))
+        text = cls._PUNCTUATION.sub(" ", text)
+        return cls._SPACES.sub(" ", text).strip(" .,")
+
+    @staticmethod
+    def _flatten(hits: list) -> list[dict]:
+        """
+        Приведение результатов поиска к плоскому списку записей
+        :param hits: Результат MilvusService.search (список списков по запросам) или плоский список
+        :return: Записи вида {"score": ..., "text": ..., "doc_type": ..., "period": ...}
+        """
+        records = []
+        for hit in hits:
+            if isinstance(hit, list):
+                records.extend(ContextBuilder._flatten(hit))
+                continue
+            entity = hit.get("entity", hit)
+            records.append({
+                "score": hit.get("score", hit.get("distance", 0.0)),
+                "text": entity.get("text", ""),
+                "doc_type": entity.get("doc_type", ""),
+                "period": entity.get("period", ""),
+                "source": entity.get("source", "")
+            })
+        return records
+
+    def build(self, hits: list) -> tuple[str, dict]:
+        """
+        Сборка контекста
+        :param hits: Результат поиска (чем больше score/distance, тем релевантнее запись)
+        :return: Текст контекста и статистика: число записей, повторов, отброшенных по бюджету,
+                 размер контекста и сэкономленные по сравнению с str(hits) токены
+        """
+        records = sorted(self._flatten(hits), key=lambda record: -record["score"])
+
+        # Повторы (одна и та же метрика из разных страниц и отчетов за один период) оставляем один раз -
+        # с лучшим score. Период входит в ключ: одинаковое значение за разные периоды - разные данные
+        seen, unique = set(), []
+        for record in records:
+            doc_type = record["doc_type"]
+            line = record["text"]
+            if doc_type and line.startswith(doc_type + ": "):
+                line = line[len(doc_type) + 2:]
+            line = self._SPACES.sub(" ", line).strip()
+            key = (record["period"], self.normalize(line))
+            if not key[1] or key in seen:
+                continue
+            seen.add(key)
+            unique.append({**record, "line": line})
+
+        # Жадная упаковка в порядке релевантности; заголовок группы учитывается при ее первом появлении
+        groups, used_tokens, dropped = {}, 0, 0
+        for record in unique:
+            group = (record["doc_type"], record["period"])
+            cost = self.count_tokens(f"- {record['line']}\n")
+            if group not in groups:
+                cost += self.count_tokens(self._header(*group) + "\n")
+            if used_tokens + cost > self.token_budget:
+                dropped += 1
+                continue
+            groups.setdefault(group, []).append(record["line"])
+            used_tokens += cost
+
+        # Группы выводятся в порядке лучшей записи, строки внутри группы - по релевантности
+        blocks = [self._header(*group) + "\n" + "\n".join(f"- {line}" for line in lines)
+                  for group, lines in groups.items()]
+        context = "\n\n".join(blocks)
+
+        raw_tokens = self.count_tokens(str(hits))
+        context_tokens = self.count_tokens(context)
+        stats = {
+            "hits": len(records),
+            "duplicates": len(records) - len(unique),
+            "used": sum(len(lines) for lines in groups.values()),
+            "dropped_by_budget": dropped,
+            "groups": len(groups),
+            "context_tokens": context_tokens,
+            "raw_tokens": raw_tokens,
+            "tokens_saved": max(0, raw_tokens - context_tokens)
+        }
+        return context, stats
+
+    @staticmethod
+    def _header(doc_type: str, period: str) -> str:
+        """Заголовок группы метрик"""
+        title = doc_type or "Прочие данные"
+        return f"{title} [{period}]:" if period else f"{title}:"
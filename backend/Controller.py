@@ -1,95 +1,491 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from EmbedderService import EmbedderService
-from MilvusService import MilvusService
-from MetricExtractor import MetricsExtractor
-import requests
-
 # Controller.py
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from EmbedderService import EmbedderService
 from MilvusService import MilvusService
+from MmapVectorStore import MmapVectorStore
 from MetricExtractor import MetricsExtractor
-import requests
+from DiskCache import DiskCache
+from PdfToTextParser import PdfToTextParser, PARSER_VERSION
+from IngestManifest import IngestManifest
+from IngestCheckpoint import IngestCheckpoint
+from IngestionJobs import IngestionJob, JobManager
+from fastapi.concurrency import run_in_threadpool
+from LlamaClient import LlamaClient
+from IngestionPipeline import IngestionPipeline
+from pathlib import Path
+from fastapi import Request, Query, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from ContextBuilder import ContextBuilder
+from HybridRetriever import HybridRetriever
+from MetricStore import MetricStore
+from PageTriage import PageTriage
+from ReportCache import ReportCache
+from Instrumentation import REGISTRY, RECENT_TRACES, finish_trace, span, start_trace
+from contextlib import asynccontextmanager
+import json
+import os
+import time
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Жизненный цикл приложения: при остановке закрываются соединения асинхронных клиентов LLaMA и эмбеддера"""
+    yield
+    await llama_client.aclose()
+    await embedder_service.aclose()
 
 # Инициализация FastAPI приложения
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+HTTP_SECONDS = REGISTRY.histogram("aidoc_http_request_seconds", "Длительность обработки HTTP запросов",
+                                  ("method", "path", "status"))
+
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    """
+    Учет длительности HTTP запросов и трассировка по запросу клиента.
+    При заголовке "X-Trace: 1" или параметре trace=1 спаны запроса (эмбеддинг, поиск, вызов LLaMA и т.д.)
+    возвращаются в заголовке Server-Timing, а трассировка доступна по /traces/{X-Trace-Id}.
+    Для потоковых ответов спаны генерации добавляются в трассировку уже после отправки заголовков
+    """
+    traced = request.headers.get("x-trace", "") not in ("", "0") or request.query_params.get("trace") == "1"
+    trace, token = start_trace(f"{request.method} {request.url.path}") if traced else (None, None)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        # Путь берем из шаблона маршрута, чтобы идентификаторы не плодили временные ряды
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        HTTP_SECONDS.observe(time.perf_counter() - started, method=request.method, path=path, status=status)
+        if trace is not None:
+            finish_trace(trace, token)
+    if trace is not None:
+        response.headers["X-Trace-Id"] = trace.id
+        response.headers["Server-Timing"] = trace.server_timing()
+    return response
 
 # Инициализация сервисов
 # EmbedderService отвечает за получение векторных представлений текста
+# (объединяет тексты в пакеты и кэширует готовые эмбеддинги на диске); URL - переменная окружения EMBEDDER_URL
 embedder_service = EmbedderService(
-    api_url='https://mts-aidocprocessing-case-embedder.olymp.innopolis.university/embed'
+    api_url=os.environ.get("EMBEDDER_URL", 'https://mts-aidocprocessing-case-embedder.olymp.innopolis.university/embed'),
+    cache=DiskCache("cache/embeddings", max_bytes=1024 ** 3)
 )
-# MilvusService отвечает за хранение и поиск векторных представлений
-milvus_service = MilvusService(
-    db_path="db/innohack.db",
-    collection_name="metrics_collection"
+# Хранилище векторных представлений выбирается переменной окружения VECTOR_STORE:
+# milvus - Milvus Lite (по умолчанию), mmap - встроенный точный поиск по отображаемому в память файлу,
+# который разделяют все воркеры (VECTOR_QUANTIZE=int8 - векторы в int8)
+if os.environ.get("VECTOR_STORE", "milvus") == "mmap":
+    vector_store = MmapVectorStore(
+        path="db/vectors",
+        quantize=os.environ.get("VECTOR_QUANTIZE", "") == "int8"
+    )
+else:
+    vector_store = MilvusService(
+        db_path="db/innohack.db",
+        collection_name="metrics_collection"
+    )
+# Гибридный поиск (векторы + BM25) поверх векторной БД; через него же идут вставка и удаление,
+# чтобы лексический индекс оставался согласованным с БД
+retriever = HybridRetriever(vector_store)
+# Таблица числовых метрик для временных рядов и агрегатов без обращения к LLaMA
+metric_store = MetricStore("db/metrics.sqlite")
+
+# Парсер PDF с дисковым кэшем распознанных страниц (OCR не повторяется для неизмененных файлов)
+pdf_parser = PdfToTextParser(
+    cache=DiskCache("cache/pages", max_bytes=2 * 1024 ** 3)
+)
+# Кэш разобранных ответов LLaMA при извлечении метрик и метаданных
+llm_cache = DiskCache("cache/llm", max_bytes=512 * 1024 ** 2, ttl=30 * 24 * 3600)
+
+# URL эндпоинта LLaMA модели для генерации ответов (переменная окружения LLAMA_ENDPOINT - например, для локальных заглушек)
+llama_endpoint = os.environ.get("LLAMA_ENDPOINT", "https://mts-aidocprocessing-case.olymp.innopolis.university/generate")
+# Общий клиент LLaMA: пул соединений, ограничение одновременных запросов и повторы при перегрузке
+llama_client = LlamaClient(llama_endpoint, max_in_flight=8)
+
+# Сборщик контекста для генерации отчетов: найденные метрики без повторов в пределах бюджета токенов
+context_builder = ContextBuilder(token_budget=2000)
+# Количество кандидатов, запрашиваемых из векторной БД (лишние отбрасываются по бюджету контекста)
+REPORT_SEARCH_LIMIT = 50
+# Кэш готовых отчетов: повторные и близкие по смыслу промпты (косинусная близость не ниже
+# REPORT_CACHE_THRESHOLD) получают сохраненный ответ; кэш сбрасывается загрузкой, изменившей индекс
+report_cache = ReportCache(
+    "cache/reports",
+    threshold=float(os.environ.get("REPORT_CACHE_THRESHOLD", "0.97")),
+    store_version=vector_store.published_version
 )
 
-# URL эндпоинта LLaMA модели для генерации ответов
-llama_endpoint = "https://mts-aidocprocessing-case.olymp.innopolis.university/generate"
+# Версии обработки документов: при их изменении документы загружаются заново
+processing_versions = {"parser": PARSER_VERSION, "prompt": MetricsExtractor.PROMPT_VERSION}
 
 # Модель данных для входящих запросов
 class PromptRequest(BaseModel):
     milvus_prompt: str  # Промпт для поиска релевантных данных в векторной БД
     prompt: str        # Основной промпт для генерации ответа
+    stream: bool = False  # Отдавать ответ по мере генерации (Server-Sent Events)
+    bypass_cache: bool = False  # Сгенерировать отчет заново, не используя кэш отчетов
+
+# Запрос для поиска в векторной БД, если пользователь не передал свой
+DEFAULT_MILVUS_PROMPT = "Дай все данные компании МТС c начала ПЕРВОГО квартала 2020 (Q1 2020) года по конец ТРЕТЬЕГО квартала 2022 (Q3 2022)"
+
+def sse_event(data: dict, event: str | None = None) -> str:
+    """
+    Форматирование события Server-Sent Events
+    :param data: Данные события
+    :param event: Тип события (None - сообщение по умолчанию)
+    :return: Строка события
+    """
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def parse_generation(response) -> str:
+    """
+    Текст ответа LLaMA модели (сервер возвращает JSON строку)
+    :param response: Ответ модели
+    :return: Сгенерированный текст
+    """
+    try:
+        data = response.json()
+    except ValueError:
+        return response.text
+    return data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
 
 @app.post("/report")
-async def report(request: PromptRequest):
+async def report(request: PromptRequest, http_request: Request, response: Response):
     """
     Эндпоинт для генерации отчетов на основе запросов пользователя
-    1. Получает векторное представление запроса
-    2. Ищет релевантные данные в векторной БД
-    3. Генерирует ответ с помощью LLaMA модели
+    1. Ищет готовый отчет в кэше: по точному совпадению промптов или по их близости
+       (эмбеддинги поискового и основного промптов); при попадании сразу возвращает его
+    2. Получает векторное представление запроса (повторные запросы берутся из кэша)
+    3. Ищет релевантные данные гибридным поиском (векторы + BM25, фильтр по периоду
+       и типу отчета из запроса) и собирает из них компактный контекст
+    4. Генерирует ответ с помощью LLaMA модели и сохраняет его в кэше отчетов
+    Все обращения к внешним сервисам асинхронные и не блокируют другие запросы.
+    При stream=true или заголовке "Accept: text/event-stream" ответ отдается
+    событиями Server-Sent Events по мере генерации.
+    Заголовок X-Report-Cache ответа: hit, miss или bypass
     """
-    # Получаем векторное представление фиксированного запроса для поиска релевантных данных
-    vector_request = embedder_service.get_embeddings(["Дай все данные компании МТС c начала ПЕРВОГО квартала 2020 (Q1 2020) года по конец ТРЕТЬЕГО квартала 2022 (Q3 2022)"])
-    # Ищем релевантные данные в векторной БД
-    milvus_response = milvus_service.search(vector_request)
+    search_prompt = request.milvus_prompt or DEFAULT_MILVUS_PROMPT
+    streaming = request.stream or "text/event-stream" in http_request.headers.get("accept", "")
+
+    cached, prompt_vectors, fingerprint = None, None, None
+    if request.bypass_cache:
+        report_cache.count_bypass()
+    else:
+        with span("report.cache") as attributes:
+            # Отпечаток БД фиксируем до поиска данных: если ее изменит загрузка, ответ не попадет в кэш
+            fingerprint = report_cache.fingerprint_snapshot()
+            cached = report_cache.get(search_prompt, request.prompt)
+            if cached is None:
+                # Эмбеддинги обоих промптов одним запросом; эмбеддинг поискового нужен и для поиска данных
+                with span("report.embed"):
+                    prompt_vectors = await embedder_service.aget_embeddings([search_prompt, request.prompt])
+                cached, attributes["similarity"] = report_cache.find(prompt_vectors, search_prompt, request.prompt)
+            attributes["hit"] = cached is not None
+    cache_header = {"X-Report-Cache": "bypass" if request.bypass_cache else "hit" if cached else "miss"}
+
+    if cached is not None:
+        if streaming:
+            async def cached_events():
+                yield sse_event(cached["context"], event="context")
+                yield sse_event({"token": cached["reply"]})
+                yield sse_event({"done": True}, event="done")
+
+            return StreamingResponse(cached_events(), media_type="text/event-stream",
+                                     headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **cache_header})
+        response.headers.update(cache_header)
+        return {"reply": cached["reply"], "context": cached["context"]}
+
+    # Получаем векторное представление запроса для поиска релевантных данных
+    if prompt_vectors is not None:
+        vector_request = prompt_vectors[:1]
+    else:
+        with span("report.embed"):
+            vector_request = await embedder_service.aget_embeddings([search_prompt])
+    # Ищем релевантные данные (клиент Milvus синхронный - выполняем в пуле потоков)
+    with span("report.search", limit=REPORT_SEARCH_LIMIT):
+        milvus_response = await run_in_threadpool(retriever.search, search_prompt, vector_request, REPORT_SEARCH_LIMIT)
+    with span("report.context") as attributes:
+        context, context_stats = context_builder.build(milvus_response)
+        attributes["context_tokens"] = context_stats["context_tokens"]
 
     # Формируем запрос к LLaMA модели
     request_payload = {
-        "prompt": request.prompt + str(milvus_response),  # Объединяем пользовательский запрос с найденными данными
+        "prompt": request.prompt + "\n" + context,  # Объединяем пользовательский запрос с найденными данными
         "frequency_penalty": 0.5,  # Параметр для снижения повторений в тексте
         "temperature": 0.1,       # Параметр, влияющий на случайность генерации
         "max_tokens": 5000        # Максимальная длина генерируемого ответа
     }
 
-    # Отправляем запрос к LLaMA модели
-    response = requests.post(
+    def remember(reply: str):
+        """Сохранение ответа в кэше отчетов (если кэш использовался для этого запроса)"""
+        if prompt_vectors is not None and reply:
+            report_cache.put(search_prompt, request.prompt, prompt_vectors, reply, context_stats, fingerprint)
+
+    if streaming:
+        async def events():
+            yield sse_event(context_stats, event="context")
+            tokens = []
+            try:
+                async for token in llama_client.astream(request_payload):
+                    if token:
+                        tokens.append(token)
+                        yield sse_event({"token": token})
+            except Exception as e:
+                yield sse_event({"error": str(e)}, event="error")
+                return
+            # В кэш попадает только полностью сгенерированный ответ
+            remember("".join(tokens))
+            yield sse_event({"done": True}, event="done")
+
+        return StreamingResponse(events(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **cache_header})
+
+    # Отправляем запрос к LLaMA модели и ждем полный ответ
+    llama_response = await llama_client.apost(request_payload)
+    if llama_response.status_code != 200:
+        raise HTTPException(status_code=502, detail=f"Ошибка LLaMA: {llama_response.status_code}")
+
+    reply = parse_generation(llama_response)
+    remember(reply)
+    response.headers.update(cache_header)
+    return {"reply": reply, "context": context_stats}
+
+@app.get("/report/cache")
+async def report_cache_stats():
+    """
+    Эндпоинт для получения статистики кэша отчетов
+    :return: Количество записей, попаданий и промахов, доля попаданий
+    """
+    return report_cache.stats()
+
+def create_metric_extractor(bypass_llm_cache: bool = False, triage: bool = True) -> MetricsExtractor:
+    """
+    Создание экстрактора метрик с общими парсером, кэшем и клиентом LLaMA
+    :param bypass_llm_cache: Запросить модель заново, не используя сохраненные ответы
+    :param triage: Отбирать страницы перед извлечением (пропуск страниц без данных, объединение коротких)
+    :return: Экстрактор метрик
+    """
+    return MetricsExtractor(
         llama_endpoint,
-        json=request_payload,
-        headers={"Content-Type": "application/json"}
+        parser=pdf_parser,
+        llm_cache=llm_cache,
+        bypass_llm_cache=bypass_llm_cache,
+        client=llama_client,
+        triage=PageTriage() if triage else None
     )
 
-    return response.json
+def plan_load(samples_path: str, incremental: bool) -> tuple[IngestManifest, dict]:
+    """
+    Сравнение файлов корпуса с манифестом уже загруженных
+    :param samples_path: Каталог с PDF файлами
+    :param incremental: Инкрементальная загрузка (иначе все файлы считаются новыми)
+    :return: Манифест и план работ (added, changed, unchanged, removed)
+    """
+    manifest = IngestManifest("db/manifest.json", versions=processing_versions)
+    pdf_files = sorted(Path(samples_path).glob("*.pdf"))
+    if incremental:
+        return manifest, manifest.plan(pdf_files)
+    return manifest, {"added": pdf_files, "changed": [], "unchanged": [], "removed": []}
 
-@app.post("/load")
-async def load():
+def run_load_job(job: IngestionJob) -> dict:
     """
-    Эндпоинт для загрузки данных из документов в векторную БД
-    1. Извлекает метрики из документов
+    Выполнение задания загрузки данных из документов в векторную БД.
+    Страницы проходят через потоковый конвейер, стадии которого работают одновременно:
+    1. Извлекает текст и метрики из документов
     2. Получает их векторные представления
     3. Сохраняет в векторную БД
+    :param job: Задание загрузки
+    :return: Список документов с ошибками, статистика стадий конвейера и отбора страниц
+    """
+    metric_extractor = create_metric_extractor(job.params["bypass_llm_cache"], job.params.get("triage", True))
+    manifest, plan = plan_load(metric_extractor.samples_path, job.params["incremental"])
+    to_process = plan["added"] + plan["changed"]
+    index_changed = not job.params["incremental"] or bool(to_process or plan["removed"])
+    if index_changed:
+        # Отчеты, сгенерированные во время загрузки, не должны пережить ее (Milvus меняется сразу при вставке)
+        report_cache.invalidate()
+    if not job.params["incremental"]:
+        # Полная перезагрузка: очищаем коллекцию и сразу сохраняем пустой манифест,
+        # чтобы продолжение после сбоя не сочло файлы загруженными
+        retriever.drop()
+        metric_store.drop()
+        # Контрольные точки прерванных заданий относятся к удаленным записям - иначе конвейер
+        # пропустил бы отмеченные в них страницы и они не попали бы в БД заново
+        ingest_checkpoint.clear_all()
+        manifest.entries = {}
+        manifest.save()
+
+    job.plan = {name: [Path(item).name for item in items] for name, items in plan.items()}
+    job.pages_total = sum(pdf_parser.page_count(str(file_path)) for file_path in to_process)
+
+    # Удаляем векторы файлов, которых больше нет в корпусе
+    for name in plan["removed"]:
+        retriever.delete_by_source(name)
+        metric_store.delete_by_source(name)
+        manifest.forget(name)
+    manifest.save()
+
+    # Таблица метрик появилась позже векторной БД - заполняем ее по уже загруженным записям
+    if metric_store.count() == 0 and plan["unchanged"]:
+        metric_store.upsert_rows(list(vector_store.iter_rows()))
+
+    # Прогоняем новые и измененные документы через конвейер: разбор -> метрики -> эмбеддинги -> вставка.
+    # Векторы каждого документа заменяются целиком, остальные записи коллекции не затрагиваются;
+    # уже сохраненные страницы прерванной загрузки пропускаются по контрольным точкам
+    pipeline = IngestionPipeline(pdf_parser, metric_extractor, embedder_service, retriever,
+                                 checkpoint=ingest_checkpoint, metric_store=metric_store)
+    job.pipeline = pipeline
+    stats = pipeline.run(to_process)
+    # Публикуем изменения хранилища (в том числе удаление файлов, если новых документов не было)
+    retriever.flush()
+    if index_changed:
+        # Сохраненные отчеты построены по прежнему содержимому БД
+        report_cache.invalidate()
+
+    # В манифест попадают только документы, обработанные без ошибок; их контрольные точки больше не нужны
+    for file_path in to_process:
+        if file_path.name not in pipeline.failed_sources:
+            manifest.record(file_path)
+            if file_path.name in pipeline.documents:
+                ingest_checkpoint.clear(pipeline.documents[file_path.name])
+    manifest.save()
+
+    result = {"failed": sorted(pipeline.failed_sources), "stages": stats}
+    if metric_extractor.triage is not None:
+        # Сколько запросов к модели удалось не делать благодаря отбору страниц
+        result["triage"] = metric_extractor.triage.stats()
+    return result
+
+# Контрольные точки страниц и очередь фоновых заданий загрузки
+ingest_checkpoint = IngestCheckpoint("db/checkpoints", versions=processing_versions)
+job_manager = JobManager("db/jobs", runner=run_load_job)
+
+@app.post("/load")
+async def load(bypass_llm_cache: bool = False, incremental: bool = True, dry_run: bool = False, triage: bool = True):
+    """
+    Эндпоинт для загрузки данных из документов в векторную БД.
+    Загрузка выполняется фоновым заданием; ответ содержит его идентификатор,
+    а прогресс доступен через /jobs/{job_id}
+    :param bypass_llm_cache: Запросить модель заново, не используя сохраненные ответы
+    :param incremental: Обработать только добавленные и измененные файлы (иначе - полная перезагрузка)
+    :param dry_run: Только вернуть план работ и оценку числа вызовов OCR и LLM, не создавая задание
+    :param triage: Отбирать страницы перед извлечением метрик (иначе каждая страница - отдельный запрос к модели)
+    :return: Идентификатор задания или план работ
+    """
+    if dry_run:
+        def dry_run_plan():
+            _, plan = plan_load(create_metric_extractor().samples_path, incremental)
+            summary = {name: [Path(item).name for item in items] for name, items in plan.items()}
+            return {"plan": summary, "estimate": IngestManifest.estimate(plan["added"] + plan["changed"], pdf_parser,
+                                                                         PageTriage() if triage else None)}
+        return await run_in_threadpool(dry_run_plan)
+
+    job = job_manager.submit({"bypass_llm_cache": bypass_llm_cache, "incremental": incremental, "triage": triage})
+    return {"job_id": job.id, "status": job.status}
+
+@app.get("/jobs")
+async def jobs():
+    """
+    Список заданий загрузки (без подробной статистики стадий)
+    """
+    return [{"job_id": job.id, "status": job.status, "created": job.created, "finished": job.finished}
+            for job in job_manager.list()]
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """
+    Статус и прогресс задания загрузки: страницы по стадиям, ошибки, оценка оставшегося времени
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return job.to_dict()
+
+@app.post("/jobs/{job_id}/resume")
+async def resume_job(job_id: str):
+    """
+    Продолжение прерванного или завершившегося с ошибками задания с последней контрольной точки
+    """
+    job = job_manager.resume(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return {"job_id": job.id, "status": job.status}
+
+@app.get("/llm/stats")
+async def llm_stats():
+    """
+    Метрики клиента LLaMA: число запросов, повторов, отказов и перцентили задержки
+    """
+    return llama_client.stats()
+
+@app.get("/metrics")
+def metrics():
+    """
+    Метрики всех этапов обработки в текстовом формате Prometheus: OCR и текстовый слой по страницам,
+    вызовы LLaMA (попытки, повторы, кэш, токены), пакеты эмбеддингов, операции векторной БД,
+    стадии конвейера загрузки и HTTP запросы
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/traces")
+async def traces(limit: int = 20):
+    """
+    Последние трассировки запросов (запросы с заголовком "X-Trace: 1" или параметром trace=1)
+    :param limit: Максимальное количество трассировок
+    """
+    return [trace.to_dict() for trace in list(RECENT_TRACES)[-limit:][::-1]]
+
+@app.get("/traces/{trace_id}")
+async def trace_details(trace_id: str):
+    """
+    Трассировка запроса по идентификатору из заголовка X-Trace-Id
+    """
+    for trace in RECENT_TRACES:
+        if trace.id == trace_id:
+            return trace.to_dict()
+    raise HTTPException(status_code=404, detail="Трассировка не найдена")
+
+@app.get("/data/names")
+def data_names(query: str = "", limit: int = 50):
+    """
+    Названия метрик в таблице метрик с количеством значений
+    :param query: Подстрока названия
+    :param limit: Максимальное количество названий
+    """
+    return metric_store.names(query, limit)
+
+@app.get("/data/series")
+def data_series(name: str, exact: bool = False, currency: str | None = None,
+                periods: list[str] | None = Query(None)):
+    """
+    Временной ряд метрики напрямую из таблицы метрик (без векторного поиска и LLaMA)
+    :param name: Название метрики, например "Выручка"
+    :param exact: Точное совпадение названия (иначе - вхождение)
+    :param currency: Валюта (RUB, USD, EUR)
+    :param periods: Отчетные периоды, например periods=2022-Q2&periods=2022-H1
+    """
+    return {"name": name, "points": metric_store.series(name, exact, currency, periods)}
+
+@app.get("/data/aggregate")
+def data_aggregate(name: str, function: str = "sum", by: str = "period", exact: bool = False,
+                   currency: str | None = None, periods: list[str] | None = Query(None)):
+    """
+    Агрегация значений метрики по периодам, годам или документам
+    :param name: Название метрики
+    :param function: Функция агрегации (sum, avg, min, max, count)
+    :param by: Группировка (period, year, source)
+    :param exact: Точное совпадение названия (иначе - вхождение)
+    :param currency: Валюта (RUB, USD, EUR)
+    :param periods: Отчетные периоды
     """
-    # Создаем экземпляр экстрактора метрик
-    metric_extractor = MetricsExtractor(llama_endpoint)
-    # Извлекаем данные из всех документов
-    knowledge_base = metric_extractor.extract_knowledge_base()
-    # Очищаем существующую коллекцию в векторной БД
-    milvus_service.drop()
-
-    # Обрабатываем каждый файл и страницу
-    for file in knowledge_base["files"]:
-        for page in file["pages"]:
-            # Формируем текстовые представления метрик с типом документа
-            page_metrics = [page["doc_type"] + ": " + metric["value"] for metric in page["metrics"]]
-            # Получаем векторные представления метрик
-            vectors = embedder_service.get_embeddings(page_metrics)
-            print(page_metrics)
-            # Сохраняем векторы и тексты в БД
-            milvus_service.insert_data(vectors, page_metrics)
+    try:
+        groups = metric_store.aggregate(name, function, by, exact, currency, periods)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"name": name, "function": function, "by": by, "groups": groups}
 
 # Конфигурация для запуска сервера
 if __name__ == "__main__":
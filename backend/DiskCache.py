@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+
+class DiskCache:
+    """
+    Файловый кэш "ключ - значение" с ограничением размера и вытеснением LRU.
+    Каждая запись хранится в отдельном файле, запись выполняется атомарно
+    (временный файл + os.replace), поэтому один каталог кэша могут безопасно
+    использовать несколько процессов одновременно.
+    Время модификации файла - момент записи (для TTL), время доступа - последнее чтение (для LRU).
+    """
+    def __init__(self, cache_dir: str, max_bytes: int = 1024 ** 3, ttl: float | None = None):
+        """
+        Инициализация кэша
+        :param cache_dir: Каталог для хранения записей
+        :param max_bytes: Максимальный суммарный размер записей в байтах
+        :param ttl: Время жизни записи в секундах (None - без ограничения)
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+        # Приблизительный размер кэша; точный пересчитывается при вытеснении
+        self._size = sum(entry[1] for entry in self._entries())
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """
+        Построение ключа кэша из произвольных JSON-сериализуемых частей
+        :param parts: Составные части ключа
+        :return: Хеш SHA-256 в шестнадцатеричном виде
+        """
+        raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        """Путь к файлу записи (записи разложены по подкаталогам для больших кэшей)"""
+        return self.cache_dir / key[:2] / key
+
+    def _entries(self):
+        """Перечисление записей кэша: (путь, размер, время последнего доступа, время записи)"""
+        for path in self.cache_dir.glob("*/*"):
+            if path.name.startswith("."):
+                continue  # Незавершенные временные файлы
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # Запись удалена другим процессом
+            yield path, stat.st_size, stat.st_atime, stat.st_mtime
+
+    def get(self, key: str) -> bytes | None:
+        """
+        Чтение записи из кэша
+        :param key: Ключ записи
+        :return: Значение или None, если записи нет
+        """
+        path = self._path(key)
+        try:
+            written_at = path.stat().st_mtime
+            now = time.time()
+            if self.ttl is not None and now - written_at > self.ttl:
+                # Запись устарела - удаляем ее
+                path.unlink()
+                with self._lock:
+                    self.expired += 1
+                    self.misses += 1
+                return None
+            value = path.read_bytes()
+            # Обновляем время доступа для LRU, сохраняя время записи для TTL
+            os.utime(path, (now, written_at))
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def contains(self, key: str) -> bool:
+        """
+        Проверка наличия актуальной записи без чтения и без учета в статистике
+        :param key: Ключ записи
+        :return: True, если запись есть и не устарела
+        """
+        try:
+            written_at = self._path(key).stat().st_mtime
+        except FileNotFoundError:
+            return False
+        return self.ttl is None or time.time() - written_at <= self.ttl
+
+    def set(self, key: str, value: bytes):
+        """
+        Атомарная запись значения в кэш
+        :param key: Ключ записи
+        :param value: Значение
+        """
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+
+        # Пишем во временный файл в том же каталоге и атомарно переименовываем
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(value)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self.writes += 1
+            self._size += len(value)
+            need_eviction = self._size > self.max_bytes
+
+        if need_eviction:
+            self._evict()
+
+    def _evict(self):
+        """Удаление устаревших и давно не использованных записей до 90% от лимита размера"""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(entry[1] for entry in entries)
+        target = self.max_bytes * 0.9
+        expired_before = time.time() - self.ttl if self.ttl is not None else None
+        evicted = 0
+
+        for path, size, _, written_at in entries:
+            is_expired = expired_before is not None and written_at < expired_before
+            if total <= target and not is_expired:
+                continue
+            try:
+                path.unlink()
+                evicted += 1
+            except FileNotFoundError:
+                pass  # Уже удалена другим процессом
+            total -= size
+
+        with self._lock:
+            self._size = total
+            self.evictions += evicted
+
+    def stats(self) -> dict:
+        """
+        Статистика использования кэша
+        :return: Словарь со счетчиками попаданий, промахов, записей, вытеснений и устаревших записей
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "expired": self.expired,
+                "size_bytes": self._size
+            }
@@ -1,27 +1,326 @@
+import asyncio
+import httpx
 import requests
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from DiskCache import DiskCache
+from Instrumentation import REGISTRY, SIZE_BUCKETS, span
+
+EMBED_BATCH_SIZE = REGISTRY.histogram("aidoc_embedder_batch_size", "Количество текстов в запросе к API эмбеддингов",
+                                      ("mode",), buckets=SIZE_BUCKETS)
+EMBED_REQUEST_SECONDS = REGISTRY.histogram("aidoc_embedder_request_seconds", "Длительность запроса к API эмбеддингов",
+                                           ("mode",))
+EMBED_TEXTS = REGISTRY.counter("aidoc_embedder_texts_total", "Запрошенные тексты по месту получения эмбеддинга",
+                               ("result",))
 
 # EmbedderService.py
 class EmbedderService:
     """
-    Сервис для получения векторных представлений текста через API
+    Сервис для получения векторных представлений текста через API.
+    Тексты от разных вызывающих потоков объединяются в пакеты (по размеру или по таймауту),
+    повторяющиеся тексты запрашиваются один раз, а готовые эмбеддинги хранятся в дисковом кэше.
     """
-    def __init__(self, api_url: str):
+    def __init__(self, api_url: str, model: str | None = None, batch_size: int = 64,
+                 max_delay: float = 0.02, max_concurrent_batches: int = 2,
+                 cache: DiskCache | None = None, timeout: float = 60.0, memo_size: int = 1024,
+                 result_timeout: float = 600.0):
         """
         Инициализация сервиса
         :param api_url: URL API для получения эмбеддингов
+        :param model: Идентификатор модели для ключа кэша (по умолчанию - URL API)
+        :param batch_size: Максимальный размер пакета текстов в одном запросе
+        :param max_delay: Максимальное время ожидания заполнения пакета в секундах
+        :param max_concurrent_batches: Количество одновременно отправляемых пакетов
+        :param cache: Дисковый кэш эмбеддингов (None - без кэширования)
+        :param timeout: Таймаут запроса к API в секундах
+        :param memo_size: Количество эмбеддингов запросов, хранимых в памяти (для aget_embeddings)
+        :param result_timeout: Максимальное время ожидания эмбеддинга текста в очереди пакетов в секундах
         """
         self.api_url = api_url
+        self.model = model or api_url
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.cache = cache
+        self.timeout = timeout
+        self.result_timeout = result_timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrent_batches)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # Очередь текстов на отправку и тексты, уже ожидающие ответа API
+        self._pending = []
+        self._pending_since = None
+        self._in_flight = {}
+        self._condition = threading.Condition()
+        self._senders = ThreadPoolExecutor(max_workers=max_concurrent_batches, thread_name_prefix="embedder")
+        self._flusher = None
 
-    def get_embeddings(self, texts: list[str]) -> list[list[float]]:
+        # Асинхронные клиенты для запросов из обработчиков FastAPI (по циклам событий) и кэш эмбеддингов запросов в памяти
+        self._async_clients = {}
+        self._memo = OrderedDict()
+        self.memo_size = memo_size
+
+        # Метрики
+        self.requests = 0
+        self.texts_requested = 0
+        self.texts_sent = 0
+        self.cache_hits = 0
+
+    def _request(self, texts: list[str]) -> np.ndarray:
         """
-        Получение эмбеддингов для списка текстов
-        :param texts: Список текстов для преобразования
-        :return: Список векторных представлений
+        Запрос эмбеддингов одного пакета к API
+        :param texts: Тексты пакета
+        :return: Матрица эмбеддингов float32
         """
         data = {"inputs": texts}
-        response = requests.post(self.api_url, json=data)
+        EMBED_BATCH_SIZE.observe(len(texts), mode="batch")
+        with EMBED_REQUEST_SECONDS.time(mode="batch"):
+            response = self.session.post(self.api_url, json=data, timeout=self.timeout)
 
         if response.status_code == 200:
-            return response.json()
+            return self._parse_vectors(response.json(), len(texts))
         else:
             raise Exception(f"Ошибка API: {response.status_code} - {response.text}")
+
+    @staticmethod
+    def _parse_vectors(data, count: int) -> np.ndarray:
+        """
+        Матрица эмбеддингов из ответа API с проверкой числа строк
+        :param data: Тело ответа API
+        :param count: Количество отправленных текстов
+        :return: Матрица эмбеддингов float32
+        """
+        vectors = np.asarray(data, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != count:
+            raise Exception(f"Ошибка API: получено эмбеддингов {len(vectors)} вместо {count}")
+        return vectors
+
+    def _cache_key(self, text: str) -> str:
+        """Ключ дискового кэша для текста"""
+        return DiskCache.make_key("embedding", self.model, text)
+
+    def _send_batch(self, batch: list[tuple[str, Future]]):
+        """
+        Отправка пакета и раздача результатов ожидающим вызовам
+        :param batch: Пары (текст, future с результатом)
+        """
+        texts = [text for text, _ in batch]
+        try:
+            vectors = self._request(texts)
+            for index, (text, future) in enumerate(batch):
+                if self.cache is not None:
+                    self.cache.set(self._cache_key(text), vectors[index].tobytes())
+                future.set_result(vectors[index])
+        except Exception as e:
+            # Ошибка запроса или записи в кэш: ожидающие вызовы не должны зависнуть
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            # Результаты уже в кэше - новые запросы этих текстов больше не нужно склеивать с пакетом
+            with self._condition:
+                self.requests += 1
+                self.texts_sent += len(texts)
+                for text, _ in batch:
+                    self._in_flight.pop(text, None)
+
+    def _flush_loop(self):
+        """Фоновый поток: формирует пакеты по размеру или по истечении max_delay"""
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                # Ждем заполнения пакета, но не дольше max_delay с момента первого текста
+                while len(self._pending) < self.batch_size:
+                    remaining = self._pending_since + self.max_delay - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._pending[:self.batch_size]
+                self._pending = self._pending[self.batch_size:]
+                self._pending_since = time.monotonic() if self._pending else None
+            self._senders.submit(self._send_batch, batch)
+
+    def _submit(self, text: str) -> Future:
+        """
+        Постановка текста в очередь; повторный запрос уже ожидающего текста переиспользует его future
+        :param text: Текст
+        :return: Future с эмбеддингом
+        """
+        with self._condition:
+            future = self._in_flight.get(text)
+            if future is not None:
+                return future
+
+            future = Future()
+            self._in_flight[text] = future
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            self._pending.append((text, future))
+
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="embedder-flusher", daemon=True)
+                self._flusher.start()
+            self._condition.notify()
+            return future
+
+    def get_embeddings(self, texts: list[str]) -> np.ndarray:
+        """
+        Получение эмбеддингов для списка текстов
+        :param texts: Список текстов для преобразования
+        :return: Матрица векторных представлений float32 (по строке на текст)
+        """
+        # Каждый уникальный текст обрабатывается один раз
+        unique = {}
+        for text in texts:
+            if text in unique:
+                continue
+            cached = self.cache.get(self._cache_key(text)) if self.cache is not None else None
+            if cached is not None:
+                unique[text] = np.frombuffer(cached, dtype=np.float32)
+            else:
+                unique[text] = self._submit(text)
+
+        hits = sum(1 for value in unique.values() if isinstance(value, np.ndarray))
+        with self._condition:
+            self.texts_requested += len(texts)
+            self.cache_hits += hits
+        EMBED_TEXTS.inc(hits, result="disk_cache")
+        EMBED_TEXTS.inc(len(unique) - hits, result="api")
+        EMBED_TEXTS.inc(len(texts) - len(unique), result="duplicate")
+
+        vectors = {text: value if isinstance(value, np.ndarray) else value.result(timeout=self.result_timeout)
+                   for text, value in unique.items()}
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack([vectors[text] for text in texts])
+
+    def _remember(self, text: str, vector: np.ndarray):
+        """Сохранение эмбеддинга в кэше памяти с вытеснением самых старых записей"""
+        with self._condition:
+            self._memo[text] = vector
+            self._memo.move_to_end(text)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+
+    def _read_cache(self, texts: list[str]) -> dict[str, np.ndarray]:
+        """
+        Чтение эмбеддингов из дискового кэша
+        :param texts: Тексты
+        :return: Найденные эмбеддинги по текстам
+        """
+        if self.cache is None:
+            return {}
+        found = {}
+        for text in texts:
+            cached = self.cache.get(self._cache_key(text))
+            if cached is not None:
+                found[text] = np.frombuffer(cached, dtype=np.float32)
+        return found
+
+    def _write_cache(self, texts: list[str], vectors: np.ndarray):
+        """
+        Сохранение эмбеддингов в дисковом кэше
+        :param texts: Тексты
+        :param vectors: Соответствующие эмбеддинги
+        """
+        for text, vector in zip(texts, vectors):
+            self.cache.set(self._cache_key(text), vector.tobytes())
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """Асинхронный HTTP клиент, привязанный к текущему циклу событий"""
+        loop = asyncio.get_running_loop()
+        with self._condition:
+            client = self._async_clients.get(loop)
+            if client is None:
+                # Клиенты завершенных циклов (без вызова aclose) закрыть уже нельзя - только забыть
+                for other in [other for other in self._async_clients if other.is_closed()]:
+                    del self._async_clients[other]
+                client = self._async_clients[loop] = httpx.AsyncClient(timeout=self.timeout)
+            return client
+
+    async def aclose(self):
+        """
+        Закрытие асинхронных клиентов и их соединений (при остановке приложения).
+        Клиент текущего цикла закрывается сразу, клиенты других работающих циклов - в своих циклах
+        """
+        loop = asyncio.get_running_loop()
+        with self._condition:
+            clients, self._async_clients = self._async_clients, {}
+        for client_loop, client in clients.items():
+            if client_loop is loop:
+                await client.aclose()
+            elif client_loop.is_running():
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(client.aclose(), client_loop))
+
+    async def aget_embeddings(self, texts: list[str]) -> np.ndarray:
+        """
+        Асинхронное получение эмбеддингов (для запросов пользователя): без блокировки цикла событий,
+        с проверкой кэша в памяти, затем дискового кэша
+        :param texts: Список текстов для преобразования
+        :return: Матрица векторных представлений float32 (по строке на текст)
+        """
+        vectors, missing = {}, []
+        with self._condition:
+            self.texts_requested += len(texts)
+            for text in texts:
+                if text in self._memo:
+                    self._memo.move_to_end(text)
+                    vectors[text] = self._memo[text]
+        memo_hits = len(vectors)
+        EMBED_TEXTS.inc(memo_hits, result="memo")
+        candidates = [text for text in dict.fromkeys(texts) if text not in vectors]
+        # Чтение дискового кэша - файловые операции, выполняем вне цикла событий
+        cached = await asyncio.to_thread(self._read_cache, candidates) if candidates else {}
+        for text in candidates:
+            if text in cached:
+                vectors[text] = cached[text]
+                self._remember(text, vectors[text])
+            else:
+                missing.append(text)
+
+        with self._condition:
+            self.cache_hits += sum(1 for text in texts if text in vectors)
+        EMBED_TEXTS.inc(len(vectors) - memo_hits, result="disk_cache")
+        EMBED_TEXTS.inc(len(missing), result="api")
+
+        if missing:
+            client = self._get_async_client()
+            EMBED_BATCH_SIZE.observe(len(missing), mode="async")
+            with span("embedder.request", texts=len(missing)), EMBED_REQUEST_SECONDS.time(mode="async"):
+                response = await client.post(self.api_url, json={"inputs": missing})
+            if response.status_code != 200:
+                raise Exception(f"Ошибка API: {response.status_code} - {response.text}")
+            result = self._parse_vectors(response.json(), len(missing))
+            with self._condition:
+                self.requests += 1
+                self.texts_sent += len(missing)
+            for index, text in enumerate(missing):
+                vectors[text] = result[index]
+                self._remember(text, result[index])
+            if self.cache is not None:
+                await asyncio.to_thread(self._write_cache, missing, result)
+
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack([vectors[text] for text in texts])
+
+    def stats(self) -> dict:
+        """
+        Метрики сервиса
+        :return: Словарь с числом запросов к API, запрошенных и отправленных текстов, попаданий в кэш
+        """
+        with self._condition:
+            return {
+                "requests": self.requests,
+                "texts_requested": self.texts_requested,
+                "texts_sent": self.texts_sent,
+                "cache_hits": self.cache_hits,
+                "avg_batch_size": round(self.texts_sent / self.requests, 2) if self.requests else 0.0
+            }
@@ -0,0 +1,274 @@
+import math
+import re
+import threading
+from collections import Counter
+
+import numpy as np
+
+from MilvusService import MilvusService
+from MmapVectorStore import MmapVectorStore
+from Periods import query_periods
+
+# Виды отчетности: одни и те же выражения распознают вид в типе отчета и в запросе пользователя
+REPORT_KINDS = {
+    "balance": re.compile(r"баланс", re.I),
+    "income": re.compile(r"финансов\w*\s+результат|(?<!\w)офр(?!\w)|отч\w*\s+о\s+прибыл", re.I),
+    "cashflow": re.compile(r"движени\w*\s+денежн|(?<!\w)ддс(?!\w)|денежн\w*\s+поток", re.I),
+    "equity": re.compile(r"изменени\w*\s+(?:собственного\s+)?капитал", re.I)
+}
+
+
+def report_kinds(text: str) -> set[str]:
+    """
+    Виды отчетности, упомянутые в тексте
+    :param text: Тип отчета или запрос пользователя
+    :return: Множество видов, например {"balance"}
+    """
+    return {kind for kind, pattern in REPORT_KINDS.items() if pattern.search(text)}
+
+
+class HybridRetriever:
+    """
+    Гибридный поиск по метрикам: векторный поиск в БД и лексический поиск BM25
+    по инвертированному индексу в памяти, объединенные методом reciprocal rank fusion.
+    Период и вид отчета из запроса превращаются в фильтр по скалярным полям,
+    поэтому оба поиска просматривают только подходящие записи.
+    Индекс строится по записям БД при первом поиске и поддерживается при вставке
+    и удалении через методы upsert_rows и delete_by_source этого класса.
+    Если хранилище публикует записи снимками (MmapVectorStore), индекс отражает опубликованный
+    снимок и перестраивается при смене снимка - в том числе опубликованного другим процессом.
+    """
+    _TOKEN = re.compile(r"\w+")
+
+    def __init__(self, vector_store: MilvusService | MmapVectorStore, k1: float = 1.5, b: float = 0.75, rrf_k: int = 60,
+                 candidates: int = 50, stem_length: int = 6):
+        """
+        Инициализация поиска
+        :param vector_store: Векторная БД с записями метрик
+        :param k1: Параметр насыщения частоты термина BM25
+        :param b: Параметр нормализации по длине текста BM25
+        :param rrf_k: Сглаживающая константа reciprocal rank fusion
+        :param candidates: Количество кандидатов от каждого поиска перед объединением
+        :param stem_length: Длина основы слова (грубый стемминг для русской морфологии)
+        """
+        self.vector_store = vector_store
+        self.k1 = k1
+        self.b = b
+        self.rrf_k = rrf_k
+        self.candidates = candidates
+        self.stem_length = stem_length
+
+        self._rows = {}        # id -> скалярные поля записи
+        self._lengths = {}     # id -> число терминов текста
+        self._postings = {}    # термин -> {id: частота}
+        self._by_source = {}   # документ -> множество id
+        self._groups = Counter()  # (тип отчета, период) -> число записей
+        self._total_length = 0
+        self._built = False
+        self._version = None   # снимок хранилища, по которому построен индекс
+        self._lock = threading.RLock()
+
+    def tokenize(self, text: str) -> list[str]:
+        """
+        Разбиение текста на термины: нижний регистр, числа без разделителей разрядов, основы слов
+        :param text: Текст
+        :return: Список терминов
+        """
+        text = re.sub(r"(?<=\d)[\s ](?=\d{3}(?!\d))", "", text.lower().replace("ё", "е"))
+        return [token if token.isdigit() else token[:self.stem_length] for token in self._TOKEN.findall(text)]
+
+    def _add(self, row: dict):
+        """Добавление записи в индекс (запись с тем же id заменяется)"""
+        row_id = row["id"]
+        if row_id in self._rows:
+            self._remove(row_id)
+        fields = {field: row.get(field, "") for field in MilvusService.SCALAR_FIELDS}
+        terms = Counter(self.tokenize(fields["text"]))
+        self._rows[row_id] = fields
+        self._lengths[row_id] = sum(terms.values())
+        self._total_length += self._lengths[row_id]
+        for term, frequency in terms.items():
+            self._postings.setdefault(term, {})[row_id] = frequency
+        self._by_source.setdefault(fields["source"], set()).add(row_id)
+        self._groups[fields["doc_type"], fields["period"]] += 1
+
+    def _remove(self, row_id: int):
+        """Удаление записи из индекса"""
+        fields = self._rows.pop(row_id)
+        self._total_length -= self._lengths.pop(row_id)
+        for term in set(self.tokenize(fields["text"])):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(row_id, None)
+                if not postings:
+                    del self._postings[term]
+        ids = self._by_source.get(fields["source"])
+        if ids is not None:
+            ids.discard(row_id)
+            if not ids:
+                del self._by_source[fields["source"]]
+        group = (fields["doc_type"], fields["period"])
+        self._groups[group] -= 1
+        if not self._groups[group]:
+            del self._groups[group]
+
+    def rebuild(self):
+        """Построение индекса заново по всем записям векторной БД"""
+        with self._lock:
+            self._rows, self._lengths, self._postings, self._by_source = {}, {}, {}, {}
+            self._groups = Counter()
+            self._total_length = 0
+            self._version = self._published_version()
+            for row in self.vector_store.iter_rows():
+                self._add(row)
+            self._built = True
+
+    def _staged(self) -> bool:
+        """Записи хранилища становятся видны поиску только после публикации (flush)"""
+        return getattr(self.vector_store, "STAGED_WRITES", False)
+
+    def _published_version(self) -> str | None:
+        """Опубликованный снимок хранилища (None - хранилище без снимков)"""
+        return self.vector_store.published_version() if self._staged() else None
+
+    def _ensure_built(self):
+        """Построение индекса при первом обращении и после публикации нового снимка"""
+        with self._lock:
+            if not self._built or self._published_version() != self._version:
+                self.rebuild()
+
+    def upsert_rows(self, rows: list[dict]) -> int:
+        """
+        Вставка записей в векторную БД и в лексический индекс
+        :param rows: Записи, сформированные make_rows
+        :return: Количество записанных записей
+        """
+        count = self.vector_store.upsert_rows(rows)
+        if self._staged():
+            return count
+        with self._lock:
+            if self._built:
+                for row in rows:
+                    self._add(row)
+        return count
+
+    def delete_by_source(self, source: str):
+        """
+        Удаление записей документа из векторной БД и из лексического индекса
+        :param source: Исходный документ
+        """
+        result = self.vector_store.delete_by_source(source)
+        if self._staged():
+            return result
+        with self._lock:
+            for row_id in list(self._by_source.get(source, ())):
+                self._remove(row_id)
+        return result
+
+    def drop(self):
+        """Удаление коллекции векторной БД и очистка лексического индекса"""
+        with self._lock:
+            result = self.vector_store.drop()
+            if self._staged():
+                return result
+            self._rows, self._lengths, self._postings, self._by_source = {}, {}, {}, {}
+            self._groups = Counter()
+            self._total_length = 0
+            self._built = True
+        return result
+
+    def flush(self):
+        """Публикация записанных данных векторной БД (индекс перестроится при следующем поиске)"""
+        return self.vector_store.flush()
+
+    def make_rows(self, *args, **kwargs) -> list[dict]:
+        """Формирование записей для вставки (см. MilvusService.make_rows)"""
+        return self.vector_store.make_rows(*args, **kwargs)
+
+    def query_filters(self, query: str) -> dict:
+        """
+        Фильтр по скалярным полям из текста запроса: периоды и типы отчетов, которые есть в индексе.
+        Условие, которому не соответствует ни одна запись, не применяется
+        :param query: Запрос пользователя
+        :return: Фильтр вида {"period": [...], "doc_type": [...]}
+        """
+        self._ensure_built()
+        with self._lock:
+            groups = list(self._groups)
+        filters = {}
+
+        periods = set(query_periods(query))
+        if periods:
+            known = sorted({period for _, period in groups} & periods)
+            if known:
+                filters["period"] = known
+
+        kinds = report_kinds(query)
+        if kinds:
+            doc_types = sorted({doc_type for doc_type, period in groups
+                                if doc_type and report_kinds(doc_type) & kinds
+                                and period in filters.get("period", [period])})
+            if doc_types:
+                filters["doc_type"] = doc_types
+        return filters
+
+    def lexical_search(self, query: str, limit: int, filters: dict | None = None) -> list[tuple[int, float]]:
+        """
+        Поиск BM25 по инвертированному индексу
+        :param query: Текст запроса
+        :param limit: Максимальное количество результатов
+        :param filters: Фильтр по скалярным полям (список значений означает "одно из")
+        :return: Пары (id, оценка) по убыванию оценки
+        """
+        self._ensure_built()
+        allowed = {field: set(value) if isinstance(value, (list, tuple, set)) else {value}
+                   for field, value in (filters or {}).items()}
+        scores = Counter()
+        with self._lock:
+            count = len(self._rows)
+            if not count:
+                return []
+            average_length = self._total_length / count
+            for term in set(self.tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for row_id, frequency in postings.items():
+                    row = self._rows[row_id]
+                    if any(row[field] not in values for field, values in allowed.items()):
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[row_id] / average_length)
+                    scores[row_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return scores.most_common(limit)
+
+    def search(self, query: str, query_vector: np.ndarray | list[list[float]], limit: int = 10,
+               filters: dict | None = None) -> list[list[dict]]:
+        """
+        Гибридный поиск
+        :param query: Текст запроса (для BM25 и определения фильтров)
+        :param query_vector: Векторное представление запроса
+        :param limit: Максимальное количество результатов
+        :param filters: Явный фильтр по скалярным полям (None - определить по тексту запроса)
+        :return: Результат в формате MilvusService.search; distance содержит оценку RRF
+        """
+        if filters is None:
+            filters = self.query_filters(query)
+        candidates = max(limit, self.candidates)
+
+        vector_hits = self.vector_store.search(query_vector, limit=candidates, filters=filters)[0]
+        lexical_hits = self.lexical_search(query, candidates, filters)
+
+        # Reciprocal rank fusion: оценка записи - сумма 1 / (k + позиция) по всем спискам
+        fused, entities = Counter(), {}
+        for rank, hit in enumerate(vector_hits):
+            fused[hit["id"]] += 1 / (self.rrf_k + rank + 1)
+            entities[hit["id"]] = hit["entity"]
+        with self._lock:
+            for rank, (row_id, _) in enumerate(lexical_hits):
+                fused[row_id] += 1 / (self.rrf_k + rank + 1)
+                if row_id not in entities and row_id in self._rows:
+                    entities[row_id] = dict(self._rows[row_id])
+
+        return [[{"id": row_id, "distance": score, "entity": entities[row_id]}
+                 for row_id, score in fused.most_common(limit) if row_id in entities]]
@@ -0,0 +1,81 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+from DiskCache import DiskCache
+
+
+class IngestCheckpoint:
+    """
+    Контрольные точки загрузки: для каждого документа в JSONL файл дописываются
+    страницы, результаты которых уже сохранены в векторной БД. Прерванная загрузка
+    при повторном запуске пропускает эти страницы и не удаляет их векторы.
+    Файл привязан к хешу содержимого документа и версиям обработки, поэтому
+    измененный документ всегда обрабатывается заново.
+    """
+    def __init__(self, directory: str, versions: dict[str, str]):
+        """
+        Инициализация хранилища контрольных точек
+        :param directory: Каталог для файлов контрольных точек
+        :param versions: Текущие версии обработки (парсер, промпты)
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.versions = versions
+        self._lock = threading.Lock()
+
+    def _path(self, content_hash: str) -> Path:
+        """Путь к файлу контрольных точек документа"""
+        return self.directory / f"{DiskCache.make_key(content_hash, self.versions)}.jsonl"
+
+    def load(self, content_hash: str) -> dict[int, dict]:
+        """
+        Чтение сохраненных страниц документа
+        :param content_hash: Хеш содержимого документа
+        :return: Словарь "номер страницы - запись"
+        """
+        path = self._path(content_hash)
+        if not path.exists():
+            return {}
+
+        pages = {}
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Недописанная строка после аварийного завершения
+                pages[record["page"]] = record
+        return pages
+
+    def append(self, content_hash: str, records: list[dict]):
+        """
+        Добавление сохраненных страниц документа
+        :param content_hash: Хеш содержимого документа
+        :param records: Записи вида {"page": 3, "doc_type": "...", "metrics": 12}
+        """
+        lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        with self._lock, open(self._path(content_hash), "a", encoding="utf-8") as file:
+            file.write(lines)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def clear(self, content_hash: str):
+        """
+        Удаление контрольных точек полностью загруженного документа
+        :param content_hash: Хеш содержимого документа
+        """
+        try:
+            self._path(content_hash).unlink()
+        except FileNotFoundError:
+            pass
+
+    def clear_all(self):
+        """
+        Удаление контрольных точек всех документов (полная перезагрузка: векторы страниц,
+        отмеченных в контрольных точках прерванных заданий, уже удалены вместе с коллекцией)
+        """
+        with self._lock:
+            for path in self.directory.glob("*.jsonl"):
+                path.unlink(missing_ok=True)
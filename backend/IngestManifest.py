@@ -0,0 +1,130 @@
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+from PageTriage import PageTriage
+from PdfToTextParser import PdfToTextParser
+
+
+class IngestManifest:
+    """
+    Манифест загруженных в векторную БД файлов: хеш содержимого, размер, время
+    изменения и версии парсера и промптов, с которыми файл был обработан.
+    Позволяет при повторной загрузке обработать только добавленные и измененные файлы
+    и удалить векторы удаленных.
+    """
+    def __init__(self, path: str, versions: dict[str, str]):
+        """
+        Инициализация манифеста
+        :param path: Путь к JSON файлу манифеста
+        :param versions: Текущие версии обработки, например {"parser": "2", "prompt": "1"};
+                         файл, обработанный с другими версиями, считается измененным
+        """
+        self.path = Path(path)
+        self.versions = versions
+        self._lock = threading.Lock()
+        self.entries = self._load()
+
+    def _load(self) -> dict[str, dict]:
+        """Чтение манифеста с диска"""
+        if not self.path.exists():
+            return {}
+        with open(self.path, encoding="utf-8") as file:
+            return json.load(file)
+
+    def save(self):
+        """Атомарная запись манифеста на диск"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            data = json.dumps(self.entries, ensure_ascii=False, indent=2)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=".manifest")
+        with os.fdopen(fd, "w", encoding="utf-8") as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, self.path)
+
+    def describe(self, file_path: Path) -> dict:
+        """
+        Описание файла для манифеста. Хеш пересчитывается, только если изменились размер или время изменения
+        :param file_path: Путь к файлу
+        :return: Словарь с хешем, размером, временем изменения и версиями обработки
+        """
+        stat = file_path.stat()
+        known = self.entries.get(file_path.name)
+        if known and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+            content_hash = known["sha256"]
+        else:
+            content_hash = PdfToTextParser.file_hash(str(file_path))
+        return {"sha256": content_hash, "size": stat.st_size, "mtime": stat.st_mtime, **self.versions}
+
+    def plan(self, pdf_files: list[Path]) -> dict[str, list]:
+        """
+        Сравнение текущего набора файлов с манифестом
+        :param pdf_files: Пути к PDF файлам корпуса
+        :return: Словарь со списками added, changed, unchanged (пути) и removed (имена файлов)
+        """
+        plan = {"added": [], "changed": [], "unchanged": [], "removed": []}
+        names = set()
+        for file_path in pdf_files:
+            names.add(file_path.name)
+            known = self.entries.get(file_path.name)
+            if known is None:
+                plan["added"].append(file_path)
+                continue
+            current = self.describe(file_path)
+            same = known["sha256"] == current["sha256"] and \
+                all(known.get(name) == version for name, version in self.versions.items())
+            plan["unchanged" if same else "changed"].append(file_path)
+
+        plan["removed"] = sorted(name for name in self.entries if name not in names)
+        return plan
+
+    @staticmethod
+    def estimate(pdf_files: list[Path], parser: PdfToTextParser, triage: PageTriage | None = None) -> dict:
+        """
+        Оценка объема работы по списку файлов без обращения к моделям
+        :param pdf_files: Пути к PDF файлам, которые будут обработаны
+        :param parser: Парсер PDF (с тем же кэшем страниц, что и при загрузке)
+        :param triage: Отбор страниц, с которым пройдет загрузка (None - каждая страница отдельным запросом)
+        :return: Число страниц, OCR и вызовов LLM без учета кэша ответов: llm_calls - с учетом отбора
+                 страниц (еще не распознанные страницы считаются отдельными запросами),
+                 llm_calls_max - верхняя граница без отбора
+        """
+        estimate = {"files": len(pdf_files), "pages": 0, "text_pages": 0, "ocr_pages": 0,
+                    "cached_ocr_pages": 0, "llm_calls": 0, "llm_calls_max": 0}
+        for file_path in pdf_files:
+            work = parser.estimate_work(str(file_path))
+            for name, value in work.items():
+                estimate[name] += value
+            # Один запрос метаданных на документ и по запросу на каждую страницу
+            estimate["llm_calls_max"] += work["pages"] + 1
+            if triage is None:
+                estimate["llm_calls"] += work["pages"] + 1
+                continue
+            # Отбор по страницам, текст которых известен без OCR; остальные - по запросу на страницу
+            known, unknown = [], 0
+            for page, text in parser.iter_known_pages(str(file_path)):
+                if text is None:
+                    unknown += 1
+                else:
+                    known.append((page, text))
+            estimate["llm_calls"] += triage.count_requests(known) + unknown + 1
+        return estimate
+
+    def record(self, file_path: Path):
+        """
+        Отметка файла как загруженного с текущими версиями обработки
+        :param file_path: Путь к файлу
+        """
+        entry = self.describe(file_path)
+        with self._lock:
+            self.entries[file_path.name] = entry
+
+    def forget(self, name: str):
+        """
+        Удаление файла из манифеста
+        :param name: Имя файла
+        """
+        with self._lock:
+            self.entries.pop(name, None)
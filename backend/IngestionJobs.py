@@ -0,0 +1,220 @@
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from pathlib import Path
+from typing import Callable
+
+from IngestionPipeline import IngestionPipeline
+
+
+class IngestionJob:
+    """
+    Фоновое задание загрузки документов: параметры, статус, план работ и прогресс
+    """
+    def __init__(self, job_id: str, params: dict, jobs_dir: Path):
+        """
+        Инициализация задания
+        :param job_id: Идентификатор задания
+        :param params: Параметры загрузки (как у эндпоинта /load)
+        :param jobs_dir: Каталог для сохранения состояния заданий
+        """
+        self.id = job_id
+        self.params = params
+        self.jobs_dir = jobs_dir
+        self.status = "queued"  # queued, running, completed, completed_with_errors, failed, interrupted
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.plan = None
+        self.result = None
+        self.pages_total = 0
+        self.pipeline: IngestionPipeline | None = None
+        # Последний сохраненный прогресс (для заданий, восстановленных с диска)
+        self._saved_progress = None
+
+    def progress(self) -> dict:
+        """
+        Прогресс задания: страницы по стадиям, ошибки и оценка оставшегося времени
+        :return: Словарь с прогрессом
+        """
+        if self.pipeline is None:
+            return self._saved_progress or {"pages_total": self.pages_total}
+
+        # Счетчики конвейера меняются его потоками - читаем согласованный снимок
+        snapshot = self.pipeline.snapshot()
+        stages = snapshot["stages"]
+        skipped = snapshot["skipped_pages"]
+        # Все страницы проходят стадию извлечения (группами после отбора); дальше идут только страницы с метриками
+        extracted = snapshot["extracted_pages"]
+        pages_done = extracted + skipped
+        progress = {
+            "pages_total": self.pages_total,
+            "pages_done": pages_done,
+            "pages_resumed": skipped,
+            "pages_by_stage": {**{name: stage["items_in"] for name, stage in stages.items()}, "extract": extracted},
+            "errors": sum(stage["errors"] for stage in stages.values()),
+            "failed_sources": snapshot["failed_sources"],
+            "eta_seconds": None,
+            "stages": stages
+        }
+        if self.pipeline.extractor.triage is not None:
+            progress["triage"] = self.pipeline.extractor.triage.stats()
+
+        elapsed = stages["extract"]["elapsed_seconds"]
+        processed = extracted
+        if processed and elapsed and self.status == "running":
+            rate = processed / elapsed
+            progress["eta_seconds"] = round(max(0, self.pages_total - pages_done) / rate, 1)
+        return progress
+
+    def to_dict(self) -> dict:
+        """
+        Состояние задания для API и сохранения на диск
+        :return: Словарь с состоянием
+        """
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "params": self.params,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "error": self.error,
+            "plan": self.plan,
+            "progress": self.progress(),
+            "result": self.result
+        }
+
+    def save(self):
+        """Атомарное сохранение состояния задания на диск"""
+        data = json.dumps(self.to_dict(), ensure_ascii=False, indent=2, default=str)
+        fd, tmp_path = tempfile.mkstemp(dir=self.jobs_dir, prefix=".job")
+        with os.fdopen(fd, "w", encoding="utf-8") as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, self.jobs_dir / f"{self.id}.json")
+
+    @classmethod
+    def from_file(cls, path: Path) -> "IngestionJob":
+        """
+        Восстановление задания из сохраненного состояния
+        :param path: Путь к JSON файлу задания
+        :return: Задание (без живого конвейера)
+        """
+        with open(path, encoding="utf-8") as file:
+            data = json.load(file)
+        job = cls(data["job_id"], data["params"], path.parent)
+        job.status = data["status"]
+        job.created = data["created"]
+        job.started = data["started"]
+        job.finished = data["finished"]
+        job.error = data["error"]
+        job.plan = data["plan"]
+        job.result = data["result"]
+        job.pages_total = data["progress"].get("pages_total", 0)
+        job._saved_progress = data["progress"]
+        return job
+
+
+class JobManager:
+    """
+    Очередь фоновых заданий загрузки. Задания выполняются по одному в отдельном потоке,
+    поэтому HTTP запрос /load завершается сразу, а сервер продолжает обслуживать /report.
+    Состояние заданий сохраняется на диск; задания, прерванные перезапуском сервера,
+    получают статус interrupted и могут быть продолжены.
+    """
+    def __init__(self, jobs_dir: str, runner: Callable[[IngestionJob], dict], save_interval: float = 5.0):
+        """
+        Инициализация менеджера
+        :param jobs_dir: Каталог для сохранения состояния заданий
+        :param runner: Функция выполнения задания, возвращающая результат загрузки
+        :param save_interval: Период сохранения прогресса выполняющегося задания в секундах
+        """
+        self.jobs_dir = Path(jobs_dir)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.runner = runner
+        self.save_interval = save_interval
+        self.jobs = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+
+        # Восстанавливаем задания предыдущего запуска сервера
+        for path in self.jobs_dir.glob("*.json"):
+            job = IngestionJob.from_file(path)
+            if job.status in ("queued", "running"):
+                job.status = "interrupted"
+                job.save()
+            self.jobs[job.id] = job
+
+        self._worker = threading.Thread(target=self._work, name="ingestion-jobs", daemon=True)
+        self._worker.start()
+
+    def submit(self, params: dict) -> IngestionJob:
+        """
+        Постановка задания в очередь
+        :param params: Параметры загрузки
+        :return: Созданное задание
+        """
+        job = IngestionJob(uuid.uuid4().hex, params, self.jobs_dir)
+        with self._lock:
+            self.jobs[job.id] = job
+        job.save()
+        self._queue.put(job)
+        return job
+
+    def resume(self, job_id: str) -> IngestionJob | None:
+        """
+        Продолжение прерванного или завершившегося ошибкой задания. Новое задание
+        выполняется инкрементально, а уже сохраненные страницы пропускаются по контрольным точкам
+        :param job_id: Идентификатор исходного задания
+        :return: Новое задание или None, если исходное не найдено
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        return self.submit({**job.params, "incremental": True, "resumed_from": job.id})
+
+    def get(self, job_id: str) -> IngestionJob | None:
+        """Задание по идентификатору"""
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list(self) -> list[IngestionJob]:
+        """Все задания, начиная с последнего"""
+        with self._lock:
+            return sorted(self.jobs.values(), key=lambda job: job.created, reverse=True)
+
+    def _work(self):
+        """Фоновый поток выполнения заданий"""
+        while True:
+            job = self._queue.get()
+            job.status = "running"
+            job.started = time.time()
+            job.save()
+
+            # Периодически сохраняем прогресс, чтобы он был виден и после перезапуска
+            stop_saving = threading.Event()
+
+            def save_progress():
+                while not stop_saving.wait(self.save_interval):
+                    job.save()
+
+            saver = threading.Thread(target=save_progress, daemon=True)
+            saver.start()
+            try:
+                job.result = self.runner(job)
+                failed = job.pipeline is not None and job.pipeline.failed_sources
+                job.status = "completed_with_errors" if failed else "completed"
+            except Exception as e:
+                job.status = "failed"
+                job.error = f"{e}\n{traceback.format_exc()}"
+            finally:
+                stop_saving.set()
+                saver.join()
+                job.finished = time.time()
+                job.save()
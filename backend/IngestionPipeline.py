@@ -0,0 +1,410 @@
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterable
+
+from PdfToTextParser import PdfToTextParser
+from MetricExtractor import MetricsExtractor
+from EmbedderService import EmbedderService
+from MilvusService import MilvusService
+from MmapVectorStore import MmapVectorStore
+from HybridRetriever import HybridRetriever
+from Periods import parse_period
+from IngestCheckpoint import IngestCheckpoint
+from MetricStore import MetricStore
+from Instrumentation import REGISTRY
+from PageTriage import SINGLE, SKIP
+
+PIPELINE_ITEM_SECONDS = REGISTRY.histogram("aidoc_pipeline_item_seconds",
+                                           "Время обработки одного элемента стадией конвейера (без ожидания очереди)",
+                                           ("stage",))
+PIPELINE_BLOCKED_SECONDS = REGISTRY.counter("aidoc_pipeline_blocked_seconds_total",
+                                            "Время ожидания места в очереди следующей стадии", ("stage",))
+PIPELINE_ERRORS = REGISTRY.counter("aidoc_pipeline_errors_total", "Ошибки обработки элементов по стадиям", ("stage",))
+
+
+# Маркер завершения потока данных между стадиями
+_DONE = object()
+
+
+class _Document:
+    """
+    Состояние обрабатываемого документа: метаданные извлекаются один раз
+    по первой странице и разделяются всеми воркерами стадии извлечения
+    """
+    def __init__(self, path: Path, content_hash: str):
+        self.path = path
+        self.content_hash = content_hash
+        self.first_page = None
+        self._metadata = None
+        self._lock = threading.Lock()
+
+    def metadata(self, extractor: MetricsExtractor) -> dict:
+        """
+        Метаданные документа (вычисляются при первом обращении)
+        :param extractor: Экстрактор метрик
+        :return: Словарь с типом отчета
+        """
+        with self._lock:
+            if self._metadata is None:
+                self._metadata = extractor.extract_metadata(self.first_page)
+            return self._metadata
+
+    def set_metadata(self, metadata: dict):
+        """
+        Установка уже известных метаданных (например, из контрольных точек)
+        :param metadata: Словарь с типом отчета
+        """
+        with self._lock:
+            self._metadata = metadata
+
+
+class StageStats:
+    """
+    Счетчики стадии конвейера
+    """
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.items_in = 0
+        self.items_out = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def record(self, busy_seconds: float, blocked_seconds: float, items_out: int, failed: bool):
+        """Учет одного обработанного элемента"""
+        with self._lock:
+            self.items_in += 1
+            self.items_out += items_out
+            self.busy_seconds += busy_seconds
+            self.blocked_seconds += blocked_seconds
+            self.errors += int(failed)
+        PIPELINE_ITEM_SECONDS.observe(busy_seconds, stage=self.name)
+        PIPELINE_BLOCKED_SECONDS.inc(blocked_seconds, stage=self.name)
+        if failed:
+            PIPELINE_ERRORS.inc(stage=self.name)
+
+    def as_dict(self) -> dict:
+        """
+        Снимок счетчиков стадии
+        :return: Словарь со счетчиками, загрузкой воркеров и пропускной способностью
+        """
+        with self._lock:
+            end = self.finished or time.monotonic()
+            elapsed = end - self.started if self.started else 0.0
+            return {
+                "workers": self.workers,
+                "items_in": self.items_in,
+                "items_out": self.items_out,
+                "errors": self.errors,
+                "busy_seconds": round(self.busy_seconds, 3),
+                # Время ожидания места в очереди следующей стадии (обратное давление)
+                "blocked_seconds": round(self.blocked_seconds, 3),
+                "elapsed_seconds": round(elapsed, 3),
+                # Доля времени, когда воркеры стадии были заняты работой
+                "utilization": round(self.busy_seconds / (elapsed * self.workers), 3) if elapsed else 0.0,
+                "items_per_second": round(self.items_in / elapsed, 3) if elapsed else 0.0,
+                "done": self.finished is not None
+            }
+
+
+class IngestionPipeline:
+    """
+    Потоковый конвейер загрузки документов в векторную БД:
+    разбор PDF -> извлечение метаданных и метрик -> эмбеддинги -> вставка в БД.
+    Страницы передаются между стадиями через ограниченные очереди, у каждой стадии
+    свой пул потоков, поэтому OCR, запросы к LLaMA, эмбеддеру и вставка в БД
+    выполняются одновременно, а в памяти находятся только страницы в очередях.
+    """
+    # Количество потоков по умолчанию для каждой стадии
+    DEFAULT_WORKERS = {"parse": 1, "extract": 8, "embed": 4, "insert": 1}
+
+    def __init__(self, parser: PdfToTextParser, extractor: MetricsExtractor,
+                 embedder: EmbedderService, vector_store: MilvusService | MmapVectorStore | HybridRetriever,
+                 workers: dict[str, int] | None = None, queue_size: int = 32,
+                 insert_batch_size: int = 1000, checkpoint: IngestCheckpoint | None = None,
+                 metric_store: MetricStore | None = None):
+        """
+        Инициализация конвейера
+        :param parser: Парсер PDF документов
+        :param extractor: Экстрактор метаданных и метрик
+        :param embedder: Сервис эмбеддингов
+        :param vector_store: Векторная БД (или гибридный поиск поверх нее, чтобы обновлять лексический индекс)
+        :param workers: Количество потоков по стадиям (parse, extract, embed, insert)
+        :param queue_size: Емкость очереди между стадиями (ограничивает объем данных в памяти)
+        :param insert_batch_size: Количество записей, накапливаемых перед вставкой в БД
+        :param checkpoint: Контрольные точки для продолжения прерванной загрузки (None - без них)
+        :param metric_store: Таблица числовых метрик, заполняемая вместе с векторной БД (None - не заполнять)
+        """
+        self.parser = parser
+        self.extractor = extractor
+        self.embedder = embedder  # Запросы нескольких потоков embed объединяются сервисом в пакеты
+        self.vector_store = vector_store
+        # По умолчанию потоков извлечения столько же, сколько одновременных запросов допускает клиент LLaMA
+        self.workers = {**self.DEFAULT_WORKERS, "extract": extractor.client.max_in_flight, **(workers or {})}
+        self.queue_size = queue_size
+        self.insert_batch_size = insert_batch_size
+        self.checkpoint = checkpoint
+        self.metric_store = metric_store
+        # Накопленные записи и страницы, к которым они относятся
+        self._insert_buffer = []
+        self._insert_pages = []
+        self._insert_lock = threading.Lock()
+        # Документы, обработанные с ошибками (их не следует отмечать как загруженные)
+        self.failed_sources = set()
+        # Хеши содержимого обработанных документов по имени файла
+        self.documents = {}
+        # Страницы, пропущенные благодаря контрольным точкам, и страницы, прошедшие стадию извлечения
+        self.skipped_pages = 0
+        self.extracted_pages = 0
+        # Защищает счетчики страниц и failed_sources (их читает прогресс задания из других потоков)
+        self._lock = threading.Lock()
+        self.logger = extractor.logger
+        self.stages = {name: StageStats(name, count) for name, count in self.workers.items()}
+
+    def _parse(self, path: Path) -> Iterable[tuple]:
+        """
+        Стадия разбора: поток страниц документа
+        :param path: Путь к PDF файлу
+        :return: Генератор (документ, решение отбора, страницы группы [(номер страницы, текст)]).
+                 Без отбора страниц в экстракторе каждая страница - отдельная группа
+        """
+        document = _Document(path, self.parser.file_hash(str(path)))
+        self.documents[path.name] = document.content_hash
+
+        done_pages = self.checkpoint.load(document.content_hash) if self.checkpoint is not None else {}
+        if done_pages:
+            # Продолжение прерванной загрузки: сохраненные страницы пропускаются, их векторы остаются в БД
+            self.logger.info(f"{path.name}: продолжение загрузки, готово страниц - {len(done_pages)}")
+            document.set_metadata({"report_type": next(iter(done_pages.values()))["doc_type"]})
+        else:
+            # Прежние векторы документа заменяются новыми
+            self.vector_store.delete_by_source(path.name)
+            if self.metric_store is not None:
+                self.metric_store.delete_by_source(path.name)
+
+        def pending_pages():
+            for page_num, page_text in enumerate(self.parser.iter_pages(str(path))):
+                if page_num == 0:
+                    document.first_page = page_text
+                if page_num + 1 in done_pages:
+                    with self._lock:
+                        self.skipped_pages += 1
+                    continue
+                yield page_num + 1, page_text
+
+        if self.extractor.triage is None:
+            for page in pending_pages():
+                yield document, SINGLE, [page]
+        else:
+            # Отбор страниц: пустые и служебные страницы пропускаются, короткие объединяются в один запрос
+            for decision, pages in self.extractor.triage.plan(pending_pages()):
+                yield document, decision, pages
+
+    def _extract(self, item: tuple) -> Iterable[tuple]:
+        """
+        Стадия извлечения метрик группы страниц
+        :param item: (документ, решение отбора, страницы группы [(номер страницы, текст)])
+        :return: (документ, номер страницы, тип документа, тексты метрик) для каждой страницы с метриками
+        """
+        document, decision, pages = item
+        with self._lock:
+            self.extracted_pages += len(pages)
+        doc_type = document.metadata(self.extractor).get("report_type", "")
+        if not doc_type:
+            # Тип отчета не определен - документ пропускается, как и раньше, и будет обработан повторно
+            self._mark_failed(document)
+            return
+
+        if decision == SKIP:
+            results = {page: {"metrics": []} for page, _ in pages}
+        else:
+            results = self.extractor.extract_metrics_from_pages(pages)
+
+        empty_pages = []
+        for page, page_metrics in results.items():
+            if page_metrics is None:
+                # Ошибка запроса к модели - страница будет обработана при следующей загрузке
+                self._mark_failed(document)
+            elif page_metrics.get("metrics", []):
+                texts = [doc_type + ": " + metric["value"] for metric in page_metrics["metrics"]]
+                yield document, page, doc_type, texts
+            else:
+                empty_pages.append(page)
+        if empty_pages and self.checkpoint is not None:
+            # Страницы без метрик (и пропущенные отбором) считаются обработанными сразу
+            self.checkpoint.append(document.content_hash,
+                                   [{"page": page, "doc_type": doc_type, "metrics": 0} for page in empty_pages])
+
+    def _embed(self, item: tuple) -> Iterable[tuple]:
+        """
+        Стадия получения эмбеддингов метрик страницы
+        :param item: (документ, номер страницы, тип документа, тексты метрик)
+        :return: Тот же элемент с добавленными векторами
+        """
+        vectors = self.embedder.get_embeddings(item[3])
+        yield *item, vectors
+
+    def _insert(self, item: tuple) -> Iterable[tuple]:
+        """
+        Стадия вставки векторов в БД: записи накапливаются и вставляются крупными пакетами
+        :param item: (документ, номер страницы, тип документа, тексты метрик, векторы)
+        """
+        document, page, doc_type, texts, vectors = item
+        rows = self.vector_store.make_rows(vectors, texts, source=document.path.name, page=page,
+                                           doc_type=doc_type, period=parse_period(doc_type))
+        with self._insert_lock:
+            self._insert_buffer.extend(rows)
+            self._insert_pages.append((document.content_hash, {"page": page, "doc_type": doc_type, "metrics": len(rows)}))
+            ready = len(self._insert_buffer) >= self.insert_batch_size
+        if ready:
+            self._flush_inserts()
+        self.logger.info(f"{document.path.name}, стр. {page}: подготовлено метрик - {len(texts)}")
+        return ()
+
+    def _flush_inserts(self):
+        """Вставка накопленных записей в БД и фиксация контрольных точек вставленных страниц"""
+        with self._insert_lock:
+            rows, self._insert_buffer = self._insert_buffer, []
+            pages, self._insert_pages = self._insert_pages, []
+        try:
+            if rows:
+                self.vector_store.upsert_rows(rows)
+                if self.metric_store is not None:
+                    self.metric_store.upsert_rows(rows)
+        except Exception:
+            # Пакет содержит записи нескольких документов: все они будут обработаны при следующей загрузке,
+            # а не только документ элемента, на котором произошла вставка
+            with self._lock:
+                self.failed_sources.update(row["source"] for row in rows)
+            raise
+        if self.checkpoint is not None:
+            by_document = {}
+            for content_hash, record in pages:
+                by_document.setdefault(content_hash, []).append(record)
+            for content_hash, records in by_document.items():
+                self.checkpoint.append(content_hash, records)
+
+    def _mark_failed(self, item):
+        """
+        Отметка документа, к которому относится элемент, как обработанного с ошибкой
+        :param item: Путь к файлу, документ или элемент очереди с документом
+        """
+        if isinstance(item, tuple):
+            item = item[0]
+        if isinstance(item, _Document):
+            item = item.path
+        with self._lock:
+            self.failed_sources.add(item.name)
+
+    def _run_stage(self, stats: StageStats, func: Callable, inbox: queue.Queue,
+                   outbox: queue.Queue | None, downstream_workers: int):
+        """
+        Запуск пула потоков одной стадии
+        :param stats: Счетчики стадии
+        :param func: Обработчик элемента, возвращающий элементы для следующей стадии
+        :param inbox: Входная очередь
+        :param outbox: Выходная очередь (None для последней стадии)
+        :param downstream_workers: Количество потоков следующей стадии
+        :return: Список запущенных потоков
+        """
+        remaining = [stats.workers]
+        remaining_lock = threading.Lock()
+
+        def worker():
+            while True:
+                item = inbox.get()
+                if item is _DONE:
+                    break
+
+                started = time.perf_counter()
+                produced, failed, blocked = 0, False, 0.0
+                try:
+                    for result in func(item):
+                        # put блокируется при заполненной очереди - так работает обратное давление
+                        put_started = time.perf_counter()
+                        outbox.put(result)
+                        blocked += time.perf_counter() - put_started
+                        produced += 1
+                except Exception as e:
+                    failed = True
+                    self._mark_failed(item)
+                    self.logger.error(f"Ошибка на стадии {stats.name}: {str(e)}")
+                stats.record(time.perf_counter() - started - blocked, blocked, produced, failed)
+
+            with remaining_lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                stats.finished = time.monotonic()
+                # Последний поток стадии завершает поток данных для следующей стадии
+                if outbox is not None:
+                    for _ in range(downstream_workers):
+                        outbox.put(_DONE)
+
+        stats.started = time.monotonic()
+        threads = [threading.Thread(target=worker, name=f"ingest-{stats.name}-{i}", daemon=True)
+                   for i in range(stats.workers)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def run(self, pdf_files: Iterable[Path]) -> dict:
+        """
+        Загрузка документов через конвейер (блокирует до завершения всех стадий)
+        :param pdf_files: Пути к PDF файлам
+        :return: Статистика по стадиям
+        """
+        order = [("parse", self._parse), ("extract", self._extract),
+                 ("embed", self._embed), ("insert", self._insert)]
+
+        files_queue = queue.Queue()
+        for path in pdf_files:
+            files_queue.put(Path(path))
+        for _ in range(self.workers["parse"]):
+            files_queue.put(_DONE)
+
+        threads = []
+        inbox = files_queue
+        for index, (name, func) in enumerate(order):
+            is_last = index == len(order) - 1
+            outbox = None if is_last else queue.Queue(maxsize=self.queue_size)
+            downstream = 0 if is_last else self.workers[order[index + 1][0]]
+            threads += self._run_stage(self.stages[name], func, inbox, outbox, downstream)
+            inbox = outbox
+
+        for thread in threads:
+            thread.join()
+        # Вставляем остаток неполного пакета и публикуем записанное (для хранилищ со снимками)
+        try:
+            self._flush_inserts()
+        except Exception as e:
+            self.logger.error(f"Ошибка на стадии insert: {str(e)}")
+        self.vector_store.flush()
+        return self.stats()
+
+    def stats(self) -> dict:
+        """
+        Текущая статистика конвейера
+        :return: Словарь со счетчиками и пропускной способностью каждой стадии
+        """
+        return {name: stage.as_dict() for name, stage in self.stages.items()}
+
+    def snapshot(self) -> dict:
+        """
+        Согласованный снимок прогресса для чтения из других потоков во время загрузки
+        :return: Статистика стадий, пропущенные и извлеченные страницы, документы с ошибками
+        """
+        stages = self.stats()
+        with self._lock:
+            return {
+                "stages": stages,
+                "skipped_pages": self.skipped_pages,
+                "extracted_pages": self.extracted_pages,
+                "failed_sources": sorted(self.failed_sources)
+            }
@@ -0,0 +1,293 @@
+import contextvars
+import math
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator
+
+# Границы корзин гистограмм длительности по умолчанию (в секундах): от миллисекунды до десяти минут
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Границы корзин для размеров (пакеты, количество записей)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+
+def _escape(value: str) -> str:
+    """Экранирование значения метки в текстовом формате Prometheus"""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    """Метки в текстовом формате Prometheus"""
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    """Значение в текстовом формате Prometheus"""
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    """
+    Основа метрики: значения хранятся по наборам меток
+    """
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        """
+        Инициализация метрики
+        :param name: Имя метрики Prometheus
+        :param documentation: Описание (строка HELP)
+        :param labels: Имена меток
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        """Значения меток в порядке их объявления"""
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def render(self) -> list[str]:
+        """Строки метрики в текстовом формате Prometheus"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key: tuple, value) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        """
+        Увеличение счетчика
+        :param amount: Величина увеличения
+        :param labels: Значения меток
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """Текущее значение счетчика"""
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Counter):
+    """Значение, которое может как расти, так и уменьшаться"""
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        """
+        Установка значения
+        :param value: Новое значение
+        :param labels: Значения меток
+        """
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1, **labels):
+        """Уменьшение значения"""
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Гистограмма наблюдений (длительностей, размеров) с накопительными корзинами"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        Инициализация гистограммы
+        :param buckets: Верхние границы корзин
+        """
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        """
+        Добавление наблюдения
+        :param value: Наблюдаемое значение
+        :param labels: Значения меток
+        """
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][index] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Измерение длительности блока кода"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_value(self, key: tuple, value) -> list[str]:
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets, value["counts"]):
+            cumulative += count
+            le = 'le="' + _format_value(bound) + '"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(value['sum'])}")
+        lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {value['count']}")
+        return lines
+
+
+class Registry:
+    """
+    Реестр метрик процесса. Повторная регистрация метрики с тем же именем возвращает
+    уже созданную, поэтому модули могут объявлять метрики независимо друг от друга
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name: str, documentation: str, labels: tuple[str, ...], **kwargs):
+        """Регистрация метрики или получение уже зарегистрированной"""
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labels, **kwargs)
+            return metric
+
+    def counter(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> Counter:
+        """Счетчик"""
+        return self._register(Counter, name, documentation, labels)
+
+    def gauge(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> Gauge:
+        """Изменяемое значение"""
+        return self._register(Gauge, name, documentation, labels)
+
+    def histogram(self, name: str, documentation: str, labels: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        """Гистограмма"""
+        return self._register(Histogram, name, documentation, labels, buckets=buckets)
+
+    def render(self) -> str:
+        """
+        Все метрики в текстовом формате Prometheus (для эндпоинта /metrics)
+        :return: Текст экспозиции
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+# Общий реестр метрик приложения
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram("aidoc_stage_seconds", "Длительность этапов обработки (спанов)", ("stage",))
+TOKENS = REGISTRY.counter("aidoc_llm_tokens_total", "Оценка числа токенов запросов и ответов LLaMA", ("direction",))
+
+
+# Среднее число символов на токен для оценки размера текста без токенизатора модели
+CHARS_PER_TOKEN = 3.0
+
+
+def approx_tokens(text: str, chars_per_token: float = CHARS_PER_TOKEN) -> int:
+    """
+    Оценка числа токенов текста без токенизатора модели
+    :param text: Текст
+    :param chars_per_token: Среднее число символов на токен
+    :return: Приблизительное число токенов
+    """
+    return int(len(text) / chars_per_token + 0.5) if text else 0
+
+
+class Trace:
+    """
+    Трассировка одного HTTP запроса: список спанов с относительным временем начала и длительностью
+    """
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started = time.time()
+        self._origin = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, started: float, duration: float, attributes: dict):
+        """Добавление завершенного спана"""
+        with self._lock:
+            self.spans.append({"name": name, "start_ms": round((started - self._origin) * 1000, 3),
+                               "duration_ms": round(duration * 1000, 3), **attributes})
+
+    def to_dict(self) -> dict:
+        """Трассировка для API"""
+        with self._lock:
+            return {"trace_id": self.id, "name": self.name, "started": self.started, "spans": list(self.spans)}
+
+    def server_timing(self) -> str:
+        """Значение заголовка Server-Timing с суммарной длительностью спанов по именам"""
+        totals = {}
+        with self._lock:
+            for span in self.spans:
+                totals[span["name"]] = totals.get(span["name"], 0) + span["duration_ms"]
+        return ", ".join(f"{name.replace('.', '_')};dur={duration:.1f}" for name, duration in totals.items())
+
+
+# Трассировка текущего запроса; контекст копируется в пул потоков FastAPI (run_in_threadpool)
+_current_trace: contextvars.ContextVar[Trace | None] = contextvars.ContextVar("aidoc_trace", default=None)
+# Последние трассировки для эндпоинта /traces
+RECENT_TRACES = deque(maxlen=100)
+
+
+def start_trace(name: str) -> tuple[Trace, contextvars.Token]:
+    """
+    Начало трассировки запроса в текущем контексте
+    :param name: Имя трассировки (метод и путь запроса)
+    :return: Трассировка и токен для finish_trace
+    """
+    trace = Trace(name)
+    return trace, _current_trace.set(trace)
+
+
+def finish_trace(trace: Trace, token: contextvars.Token):
+    """Завершение трассировки и сохранение ее в списке последних"""
+    _current_trace.reset(token)
+    RECENT_TRACES.append(trace)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[dict]:
+    """
+    Измерение этапа обработки: длительность попадает в гистограмму aidoc_stage_seconds,
+    а при активной трассировке запроса - еще и в список ее спанов
+    :param name: Имя этапа, например "ocr.page" или "milvus.search"
+    :param attributes: Атрибуты спана (размер пакета, страница и т.п.)
+    :return: Словарь атрибутов, который можно дополнить внутри блока
+    """
+    started = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        duration = time.perf_counter() - started
+        STAGE_SECONDS.observe(duration, stage=name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, started, duration, attributes)
@@ -0,0 +1,174 @@
+import numpy as np
+
+
+class LayoutEngine:
+    """
+    Восстановление текста страницы по координатам слов (результат pytesseract.image_to_data
+    или текстовый слой PDF, приведенный к тому же формату).
+    Все вычисления над словами выполняются векторно на массивах NumPy:
+    - строки - слова, перекрывающиеся по вертикали (сортировка по верхней границе и
+      накопленный максимум нижней границы), а не округление координаты Y;
+    - ячейки - по промежутку между словами с учетом их реальной ширины;
+    - колонки таблиц - объединение горизонтальных интервалов ячеек табличных строк;
+      ячейки выравниваются по колонкам, пропущенные колонки дают пустые ячейки.
+    Колонки в выходном тексте разделены табуляцией, строки - переводом строки.
+    """
+    def __init__(self, line_overlap: float = 0.5, gap_factor: float = 0.8, min_column_rows: int = 3,
+                 max_cell_width: float = 0.5):
+        """
+        Инициализация
+        :param line_overlap: Минимальное перекрытие слова со строкой по вертикали (доля высоты слова),
+                             при котором слово относится к этой строке
+        :param gap_factor: Промежуток между словами (в медианных высотах слова), начиная с которого
+                           слова относятся к разным ячейкам
+        :param min_column_rows: Минимальное количество строк, в которых встречается колонка таблицы
+        :param max_cell_width: Ячейки шире этой доли ширины текста (заголовки, абзацы) не участвуют
+                               в поиске колонок
+        """
+        self.line_overlap = line_overlap
+        self.gap_factor = gap_factor
+        self.min_column_rows = min_column_rows
+        self.max_cell_width = max_cell_width
+
+    @staticmethod
+    def _words(data: dict) -> tuple[np.ndarray, ...]:
+        """
+        Непустые слова и их координаты
+        :param data: Словарь с колонками text, left, top, width, height
+        :return: Массивы текстов, левых и верхних границ, ширин и высот
+        """
+        text = np.asarray(data["text"], dtype=object)
+        if not len(text):
+            empty = np.empty(0, dtype=np.int64)
+            return text, empty, empty, empty, empty
+        keep = np.char.str_len(np.char.strip(text.astype(str))) > 0
+        columns = [np.asarray(data[name], dtype=np.int64)[keep] for name in ("left", "top", "width", "height")]
+        return (text[keep], *columns)
+
+    def _lines(self, top: np.ndarray, height: np.ndarray) -> np.ndarray:
+        """
+        Разбиение слов на строки по перекрытию по вертикали
+        :param top: Верхние границы слов, отсортированных по top
+        :param height: Высоты слов
+        :return: Номер строки каждого слова (по возрастанию)
+        """
+        # Высоту берем не больше медианной, чтобы высокие слова (вертикальные линии рамок, символы)
+        # не растягивали строку на все строки ниже них
+        height = np.minimum(height, np.median(height))
+        # Нижняя граница уже собранных строк: накопленный максимум по предыдущим словам
+        reach = np.maximum.accumulate(top + height)
+        needed = self.line_overlap * height
+        new_line = np.ones(len(top), dtype=bool)
+        new_line[1:] = reach[:-1] - top[1:] < needed[1:]
+        return np.cumsum(new_line) - 1
+
+    @staticmethod
+    def _spans(left: np.ndarray, right: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Объединение пересекающихся горизонтальных интервалов
+        :param left: Левые границы интервалов
+        :param right: Правые границы интервалов
+        :return: Номер объединенного интервала для каждого исходного, левые и правые границы объединенных
+        """
+        order = np.argsort(left, kind="stable")
+        reach = np.concatenate(([np.iinfo(np.int64).min], np.maximum.accumulate(right[order])[:-1]))
+        sorted_ids = np.cumsum(left[order] > reach) - 1
+        ids = np.empty_like(sorted_ids)
+        ids[order] = sorted_ids
+        count = sorted_ids[-1] + 1
+        span_left = np.full(count, np.iinfo(np.int64).max)
+        span_right = np.full(count, np.iinfo(np.int64).min)
+        np.minimum.at(span_left, ids, left)
+        np.maximum.at(span_right, ids, right)
+        return ids, span_left, span_right
+
+    def _columns(self, cell_line: np.ndarray, cell_left: np.ndarray, cell_right: np.ndarray) -> np.ndarray:
+        """
+        Поиск колонок таблиц
+        :param cell_line: Номер строки каждой ячейки
+        :param cell_left: Левые границы ячеек
+        :param cell_right: Правые границы ячеек
+        :return: Номер колонки каждой ячейки (-1 - ячейка вне колонок)
+        """
+        columns = np.full(len(cell_line), -1)
+        # Табличные строки - строки из нескольких ячеек; широкие ячейки не учитываем
+        cells_per_line = np.bincount(cell_line)
+        text_width = max(int(cell_right.max() - cell_left.min()), 1)
+        candidate = (cells_per_line[cell_line] > 1) & (cell_right - cell_left <= self.max_cell_width * text_width)
+        if not candidate.any():
+            return columns
+
+        ids, span_left, span_right = self._spans(cell_left[candidate], cell_right[candidate])
+        # Колонка должна встречаться хотя бы в min_column_rows разных строках
+        lines_count = int(cell_line.max()) + 1
+        pairs = np.unique(ids * lines_count + cell_line[candidate])
+        rows_per_span = np.bincount(pairs // lines_count, minlength=len(span_left))
+        valid = rows_per_span >= self.min_column_rows
+        if valid.sum() < 2:
+            return columns
+
+        # Номер колонки каждой ячейки - по интервалу, в который попадает ее середина
+        span_left, span_right = span_left[valid], span_right[valid]
+        center = (cell_left + cell_right) // 2
+        index = np.clip(np.searchsorted(span_left, center, side="right") - 1, 0, len(span_left) - 1)
+        inside = (center >= span_left[index]) & (center <= span_right[index])
+        columns[inside] = index[inside]
+        return columns
+
+    def build_text(self, data: dict) -> str:
+        """
+        Восстановление текста страницы с сохранением структуры
+        :param data: Словарь с колонками text, left, top, width, height (формат pytesseract.Output.DICT)
+        :return: Текст страницы, колонки таблиц разделены табуляцией
+        """
+        text, left, top, width, height = self._words(data)
+        if not len(text):
+            return ""
+
+        # Строки: сортируем по верхней границе и группируем перекрывающиеся по вертикали слова
+        order = np.argsort(top, kind="stable")
+        line = np.empty(len(order), dtype=np.int64)
+        line[order] = self._lines(top[order], height[order])
+
+        # Внутри строки - порядок слева направо
+        order = np.lexsort((left, line))
+        text, left, right, line = text[order], left[order], (left + width)[order], line[order]
+
+        # Ячейки: новая ячейка в начале строки или после промежутка больше gap_factor высот слова
+        gap = np.empty(len(left), dtype=np.int64)
+        gap[0], gap[1:] = 0, left[1:] - right[:-1]
+        new_line = np.ones(len(line), dtype=bool)
+        new_line[1:] = line[1:] != line[:-1]
+        new_cell = new_line | (gap > self.gap_factor * np.median(height))
+        starts = np.flatnonzero(new_cell)
+        cell_line = line[starts]
+        cell_left = left[starts]
+        cell_right = np.maximum.reduceat(right, starts)
+        columns = self._columns(cell_line, cell_left, cell_right)
+
+        # Количество табуляций перед каждой ячейкой: в выровненных строках таблицы - разность номеров колонок
+        # (пропущенные колонки остаются пустыми), в остальных строках - одна табуляция между ячейками
+        line_start = np.ones(len(cell_line), dtype=bool)
+        line_start[1:] = cell_line[1:] != cell_line[:-1]
+        step = np.empty(len(columns), dtype=np.int64)
+        step[0], step[1:] = columns[0] + 1, columns[1:] - columns[:-1]
+        step[line_start] = columns[line_start] + 1
+        line_starts = np.flatnonzero(line_start)
+        aligned = np.logical_and.reduceat((columns >= 0) & (step > 0), line_starts)
+        aligned &= np.diff(np.append(line_starts, len(cell_line))) > 1
+        aligned = np.repeat(aligned, np.diff(np.append(line_starts, len(cell_line))))
+        tabs = np.where(aligned, step, 1)
+        tabs[line_start] = np.where(aligned[line_start], columns[line_start], 0)
+
+        # Сборка текста за один проход по ячейкам: слова ячейки объединяются через join
+        words = text.tolist()
+        bounds = np.append(starts, len(words)).tolist()
+        separators = ["\t" * count for count in range(int(tabs.max()) + 1)]
+        pieces = []
+        for first, last, count, new_line in zip(bounds, bounds[1:], tabs.tolist(), line_start.tolist()):
+            if new_line and pieces:
+                pieces.append("\n")
+            pieces.append(separators[count])
+            pieces.append(" ".join(words[first:last]))
+        pieces.append("\n")
+        return "".join(pieces)
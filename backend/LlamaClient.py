@@ -0,0 +1,501 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from Instrumentation import REGISTRY, TOKENS, approx_tokens, span
+
+LLM_ATTEMPT_SECONDS = REGISTRY.histogram("aidoc_llm_attempt_seconds", "Длительность одной попытки запроса к LLaMA", ("mode",))
+LLM_ATTEMPTS = REGISTRY.counter("aidoc_llm_attempts_total", "Попытки запросов к LLaMA по коду ответа", ("status",))
+LLM_RETRIES = REGISTRY.counter("aidoc_llm_retries_total", "Повторы запросов к LLaMA (разрешенные и отклоненные бюджетом)", ("outcome",))
+LLM_FAILURES = REGISTRY.counter("aidoc_llm_failures_total", "Запросы к LLaMA, для которых повторы исчерпаны")
+LLM_IN_FLIGHT = REGISTRY.gauge("aidoc_llm_in_flight", "Запросы к LLaMA, выполняющиеся в данный момент")
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов по алгоритму "token bucket"
+    """
+    def __init__(self, rate: float, capacity: float | None = None):
+        """
+        Инициализация ограничителя
+        :param rate: Скорость пополнения (запросов в секунду)
+        :param capacity: Емкость корзины - допустимый всплеск запросов (по умолчанию равна rate)
+        """
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """
+        Попытка получить токен
+        :return: 0, если токен получен, иначе время ожидания следующего токена в секундах
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """Блокирующее получение одного токена"""
+        while wait := self._take():
+            time.sleep(wait)
+
+    async def aacquire(self):
+        """Получение одного токена без блокировки цикла событий (общая корзина с синхронными запросами)"""
+        while wait := self._take():
+            await asyncio.sleep(wait)
+
+
+class InFlightLimit:
+    """
+    Общее ограничение числа одновременных запросов для потоков (with) и корутин (async with):
+    синхронная загрузка документов и асинхронная генерация отчетов делят одни и те же слоты.
+    Корутины ждут свободный слот без блокировки цикла событий; освобождение слота в любом
+    потоке будит одного ожидающего в потоке и одного в цикле событий (проигравший ждет снова)
+    """
+    def __init__(self, limit: int):
+        """
+        Инициализация ограничения
+        :param limit: Максимальное число одновременно занятых слотов
+        """
+        self.limit = limit
+        self.active = 0
+        self._condition = threading.Condition()
+        self._waiters = deque()  # (цикл событий, future) ожидающих корутин
+
+    def _try_acquire(self) -> bool:
+        """Занятие слота, если он свободен (вызывается под блокировкой)"""
+        if self.active < self.limit:
+            self.active += 1
+            return True
+        return False
+
+    def _wake_coroutine(self):
+        """Пробуждение одной ожидающей корутины (вызывается под блокировкой)"""
+        while self._waiters:
+            loop, future = self._waiters.popleft()
+            if loop.is_closed():
+                continue
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+            return
+
+    def acquire(self):
+        """Блокирующее занятие слота"""
+        with self._condition:
+            while not self._try_acquire():
+                self._condition.wait()
+
+    def release(self):
+        """Освобождение слота"""
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+            self._wake_coroutine()
+
+    async def aacquire(self):
+        """Занятие слота без блокировки цикла событий"""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self._try_acquire():
+                    return
+                waiter = (loop, loop.create_future())
+                self._waiters.append(waiter)
+            try:
+                await waiter[1]
+            except asyncio.CancelledError:
+                with self._condition:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+                    else:
+                        # Пробуждение уже досталось этой корутине - передаем его следующей
+                        self._wake_coroutine()
+                raise
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    async def __aenter__(self):
+        await self.aacquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+class LlamaClient:
+    """
+    Общий клиент LLaMA модели: пул keep-alive соединений, ограничение числа
+    одновременных запросов и их частоты, повторы с экспоненциальной задержкой
+    и случайным разбросом в рамках бюджета повторов, метрики задержек.
+    Синхронные методы используются при загрузке документов, асинхронные (apost, astream) -
+    в обработчиках FastAPI, чтобы не блокировать цикл событий.
+    """
+    # Коды ответа, при которых запрос имеет смысл повторить
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, endpoint: str, max_in_flight: int = 8, rate_limit: float | None = None,
+                 max_retries: int = 5, backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 retry_budget_ratio: float = 0.2, initial_retry_budget: float = 10.0,
+                 max_retry_budget: float = 100.0,
+                 timeout: tuple[float, float] = (10.0, 600.0),
+                 async_transport: httpx.AsyncBaseTransport | None = None):
+        """
+        Инициализация клиента
+        :param endpoint: URL эндпоинта LLaMA модели
+        :param max_in_flight: Максимальное число одновременных запросов к модели
+        :param rate_limit: Максимальная частота запросов в секунду (None - без ограничения)
+        :param max_retries: Максимальное число повторов одного запроса
+        :param backoff_base: Базовая задержка перед повтором в секундах
+        :param backoff_max: Максимальная задержка перед повтором в секундах
+        :param retry_budget_ratio: Пополнение бюджета повторов каждым новым запросом
+        :param initial_retry_budget: Начальный запас повторов
+        :param max_retry_budget: Максимальный накопленный запас повторов
+        :param timeout: Таймауты соединения и чтения ответа в секундах
+        :param async_transport: Транспорт асинхронного клиента httpx (None - сетевой; для заглушек)
+        """
+        self.endpoint = endpoint
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_budget_ratio = retry_budget_ratio
+        self.max_retry_budget = max_retry_budget
+        self.timeout = timeout
+        self.async_transport = async_transport
+
+        # Сессия с пулом keep-alive соединений по числу одновременных запросов
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+
+        # Общий для синхронных и асинхронных запросов предел одновременных запросов к модели
+        self._slots = InFlightLimit(max_in_flight)
+        # Асинхронные клиенты по циклам событий: соединения httpx привязаны к циклу, в котором созданы
+        self._async_clients = {}
+        self._rate_limiter = TokenBucket(rate_limit) if rate_limit else None
+        self._lock = threading.Lock()
+        self._retry_budget = initial_retry_budget
+
+        # Метрики
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.retries_denied = 0
+        self._latencies = deque(maxlen=10000)
+
+    def _take_retry(self) -> bool:
+        """
+        Списание одного повтора из бюджета
+        :return: True, если повтор разрешен
+        """
+        with self._lock:
+            allowed = self._retry_budget >= 1
+            if allowed:
+                self._retry_budget -= 1
+                self.retries += 1
+            else:
+                self.retries_denied += 1
+        LLM_RETRIES.inc(outcome="retried" if allowed else "denied")
+        return allowed
+
+    def _count_request(self, payload: dict):
+        """Учет нового запроса, его токенов и пополнение бюджета повторов"""
+        TOKENS.inc(approx_tokens(payload.get("system_prompt", "") + payload.get("prompt", "")), direction="in")
+        with self._lock:
+            self.requests += 1
+            # Каждый запрос пополняет бюджет повторов, поэтому при длительной перегрузке
+            # число повторов ограничено долей retry_budget_ratio от числа запросов
+            self._retry_budget = min(self._retry_budget + self.retry_budget_ratio, self.max_retry_budget)
+
+    def _give_up(self, attempt: int) -> bool:
+        """
+        Проверка, нужно ли прекратить повторы
+        :param attempt: Номер выполненного повтора (с 0)
+        :return: True, если повторы исчерпаны (запрос считается неудачным)
+        """
+        if attempt < self.max_retries and self._take_retry():
+            return False
+        with self._lock:
+            self.failures += 1
+        LLM_FAILURES.inc()
+        return True
+
+    def _record_latency(self, latency: float, mode: str, status: int | str):
+        """
+        Учет задержки одной попытки
+        :param latency: Длительность попытки в секундах
+        :param mode: Вид запроса (sync, async, stream)
+        :param status: Код ответа или "error", если ответ не получен (сетевая ошибка, отмена)
+        """
+        with self._lock:
+            self._latencies.append(latency)
+        LLM_ATTEMPT_SECONDS.observe(latency, mode=mode)
+        LLM_ATTEMPTS.inc(status=status)
+
+    def _backoff(self, attempt: int, response: requests.Response | httpx.Response | None) -> float:
+        """
+        Задержка перед повтором: экспоненциальная с полным случайным разбросом,
+        но не меньше значения заголовка Retry-After, если сервер его прислал
+        :param attempt: Номер повтора (с 0)
+        :param response: Ответ сервера или None при сетевой ошибке
+        :return: Задержка в секундах
+        """
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(self.backoff_max, float(retry_after)))
+        return delay
+
+    def post(self, payload: dict) -> requests.Response:
+        """
+        Отправка запроса к модели с повторами при перегрузке и сетевых ошибках
+        :param payload: Параметры запроса к модели
+        :return: Ответ модели (последний, если повторы исчерпаны)
+        """
+        with span("llm.call", mode="sync"):
+            return self._post(payload)
+
+    def _post(self, payload: dict) -> requests.Response:
+        """Синхронная отправка запроса с повторами (см. post)"""
+        self._count_request(payload)
+
+        attempt = 0
+        while True:
+            if self._rate_limiter is not None:
+                self._rate_limiter.acquire()
+
+            response, error = None, None
+            with self._slots:
+                LLM_IN_FLIGHT.inc()
+                started = time.perf_counter()
+                try:
+                    response = self.session.post(self.endpoint, json=payload, timeout=self.timeout)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = e
+                finally:
+                    LLM_IN_FLIGHT.dec()
+                    self._record_latency(time.perf_counter() - started, "sync",
+                                         "error" if response is None else response.status_code)
+
+            retryable = error is not None or response.status_code in self.RETRY_STATUSES
+            if not retryable:
+                if response.status_code == 200:
+                    TOKENS.inc(approx_tokens(response.text), direction="out")
+                return response
+
+            if self._give_up(attempt):
+                if error is not None:
+                    raise error
+                return response
+
+            time.sleep(self._backoff(attempt, response))
+            attempt += 1
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """Асинхронный HTTP клиент с пулом keep-alive соединений, привязанный к текущему циклу событий"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                # Клиенты завершенных циклов (без вызова aclose) закрыть уже нельзя - только забыть
+                for other in [other for other in self._async_clients if other.is_closed()]:
+                    del self._async_clients[other]
+                limits = httpx.Limits(max_connections=self.max_in_flight,
+                                      max_keepalive_connections=self.max_in_flight)
+                timeout = httpx.Timeout(self.timeout[1], connect=self.timeout[0])
+                client = self._async_clients[loop] = httpx.AsyncClient(
+                    limits=limits, timeout=timeout, transport=self.async_transport,
+                    headers={"Content-Type": "application/json"})
+            return client
+
+    async def aclose(self):
+        """
+        Закрытие асинхронных клиентов и их соединений (при остановке приложения).
+        Клиент текущего цикла закрывается сразу, клиенты других работающих циклов - в своих циклах
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients, self._async_clients = self._async_clients, {}
+        for client_loop, client in clients.items():
+            if client_loop is loop:
+                await client.aclose()
+            elif client_loop.is_running():
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(client.aclose(), client_loop))
+
+    async def apost(self, payload: dict) -> httpx.Response:
+        """
+        Асинхронная отправка запроса к модели с повторами при перегрузке и сетевых ошибках
+        :param payload: Параметры запроса к модели
+        :return: Ответ модели (последний, если повторы исчерпаны)
+        """
+        with span("llm.call", mode="async"):
+            return await self._apost(payload)
+
+    async def _apost(self, payload: dict) -> httpx.Response:
+        """Асинхронная отправка запроса с повторами (см. apost)"""
+        client = self._get_async_client()
+        self._count_request(payload)
+
+        attempt = 0
+        while True:
+            if self._rate_limiter is not None:
+                await self._rate_limiter.aacquire()
+
+            response, error = None, None
+            async with self._slots:
+                LLM_IN_FLIGHT.inc()
+                started = time.perf_counter()
+                try:
+                    response = await client.post(self.endpoint, json=payload)
+                except httpx.TransportError as e:
+                    error = e
+                finally:
+                    # Выполняется и при отмене запроса, иначе показатель запросов в работе остался бы завышенным
+                    LLM_IN_FLIGHT.dec()
+                    self._record_latency(time.perf_counter() - started, "async",
+                                         "error" if response is None else response.status_code)
+
+            retryable = error is not None or response.status_code in self.RETRY_STATUSES
+            if not retryable:
+                if response.status_code == 200:
+                    TOKENS.inc(approx_tokens(response.text), direction="out")
+                return response
+
+            if self._give_up(attempt):
+                if error is not None:
+                    raise error
+                return response
+
+            await asyncio.sleep(self._backoff(attempt, response))
+            attempt += 1
+
+    async def astream(self, payload: dict) -> AsyncIterator[str]:
+        """
+        Потоковая генерация: фрагменты текста отдаются по мере их получения от модели.
+        Повторы выполняются только до получения первого фрагмента ответа: после него сетевая ошибка
+        передается вызывающему коду, иначе повтор продублировал бы уже отданный текст.
+        Если сервер не поддерживает потоковый режим, весь ответ отдается одним фрагментом
+        :param payload: Параметры запроса к модели
+        :return: Асинхронный генератор фрагментов текста
+        """
+        client = self._get_async_client()
+        self._count_request(payload)
+
+        attempt = 0
+        yielded = False
+        while True:
+            if self._rate_limiter is not None:
+                await self._rate_limiter.aacquire()
+
+            response, error = None, None
+            async with self._slots:
+                LLM_IN_FLIGHT.inc()
+                started = time.perf_counter()
+                try:
+                    async with client.stream("POST", self.endpoint, json={**payload, "stream": True}) as response:
+                        if response.status_code not in self.RETRY_STATUSES:
+                            if response.status_code != 200:
+                                await response.aread()
+                                response.raise_for_status()
+                            with span("llm.stream") as attributes:
+                                attributes["time_to_first_byte_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                                async for chunk in self._iter_stream(response):
+                                    TOKENS.inc(approx_tokens(chunk), direction="out")
+                                    yielded = True
+                                    yield chunk
+                            return
+                        await response.aread()
+                except httpx.TransportError as e:
+                    response, error = None, e
+                    if yielded:
+                        # Обрыв посреди ответа: часть текста уже отдана, повторять запрос нельзя
+                        with self._lock:
+                            self.failures += 1
+                        LLM_FAILURES.inc()
+                        raise
+                finally:
+                    # Задержка попытки учитывается при любом исходе: ответ, ошибка, отмена или закрытие генератора
+                    LLM_IN_FLIGHT.dec()
+                    self._record_latency(time.perf_counter() - started, "stream",
+                                         "error" if response is None else response.status_code)
+
+            if self._give_up(attempt):
+                if error is not None:
+                    raise error
+                response.raise_for_status()
+
+            await asyncio.sleep(self._backoff(attempt, response))
+            attempt += 1
+
+    @staticmethod
+    async def _iter_stream(response: httpx.Response) -> AsyncIterator[str]:
+        """
+        Разбор потокового ответа модели
+        :param response: Ответ модели
+        :return: Асинхронный генератор фрагментов текста
+        """
+        content_type = response.headers.get("content-type", "")
+        if "text/event-stream" in content_type:
+            # Server-Sent Events: фрагменты в строках "data: ..."
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    return
+                try:
+                    event = json.loads(data)
+                except json.JSONDecodeError:
+                    yield data
+                    continue
+                if isinstance(event, dict):
+                    yield event.get("text") or event.get("token") or event.get("content") or ""
+                else:
+                    yield str(event)
+        elif "application/json" in content_type:
+            # Сервер ответил целиком - отдаем текст ответа одним фрагментом
+            body = json.loads(await response.aread())
+            yield body if isinstance(body, str) else json.dumps(body, ensure_ascii=False)
+        else:
+            async for chunk in response.aiter_text():
+                yield chunk
+
+    def stats(self) -> dict:
+        """
+        Метрики клиента
+        :return: Словарь со счетчиками запросов и повторов и перцентилями задержки (сек.)
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                "requests": self.requests,
+                "failures": self.failures,
+                "retries": self.retries,
+                "retries_denied": self.retries_denied,
+                "retry_budget": round(self._retry_budget, 2)
+            }
+
+        for name, quantile in (("latency_p50", 0.5), ("latency_p95", 0.95), ("latency_p99", 0.99)):
+            stats[name] = latencies[min(len(latencies) - 1, int(quantile * len(latencies)))] if latencies else None
+        return stats
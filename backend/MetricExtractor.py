@@ -1,11 +1,16 @@
-import requests
 import logging
 import json
 from typing import Dict, Any
 from concurrent.futures import ThreadPoolExecutor
-from PdfToTextParser import PdfToTextParser
+from PdfToTextParser import PdfToTextParser, SOURCE_OCR
+from DiskCache import DiskCache
+from LlamaClient import LlamaClient
+from Instrumentation import REGISTRY
+from PageTriage import PageTriage, SKIP
 from pathlib import Path
 
+LLM_CACHE_LOOKUPS = REGISTRY.counter("aidoc_llm_cache_total", "Обращения к кэшу ответов LLaMA", ("result",))
+
 
 
 class MetricsExtractor:
@@ -13,12 +18,89 @@ class MetricsExtractor:
     Класс для извлечения финансовых метрик из документов с использованием LLaMA модели.
     Обрабатывает PDF документы, извлекает из них метрики и структурирует данные.
     """
-    def __init__(self, endpoint):
+    # Версия промптов; при изменении промптов документы нужно переобработать
+    PROMPT_VERSION = "1"
+
+    # Базовый промпт с инструкциями для модели
+    METRICS_PROMPT = """
+        Извлеките все важные данные:
+        - финансовые показатели
+        - аналитика
+        - деятельность компании
+        - решения руководства
+        - политика компании
+        - приобретения
+        - движение денежных средств
+        - инвестиции.
+            
+        СТРОГО верните данные в формате JSON:
+        {
+            "metrics": [
+                {"value": "данные"}
+            ]
+        }
+            
+        Правила:
+        1. НИКАКИХ дополнительных текстов
+        2. Если это финансовая метрика, то оставлять ТОЧНОЕ название метрики и ее значение
+        3. ТОЛЬКО реальные числа из документа
+        4. ТОЧНЫЕ названия как в документе
+        5. Сохранять единицы измерения (тыс. руб., млн руб., тыс. дол.)
+        6. ТОЛЬКО важные аналитические данные
+        """
+
+    # Системный промпт, определяющий роль модели
+    METRICS_SYSTEM_PROMPT = """
+        Вы — эксперт по финансовой отчетности. Вы разговариваете на русском языке.
+        """
+
+    # Схема списка метрик в ответе модели
+    METRICS_ITEMS_SCHEMA = {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "value": {
+                    "type": "string"
+                }
+            },
+            "required": [
+                "value"
+            ]
+        }
+    }
+
+    # Инструкция для запроса по нескольким коротким страницам сразу
+    PAGES_PROMPT = """
+        Ниже несколько страниц документа, каждая начинается со строки "=== Страница N ===".
+        Для КАЖДОЙ страницы извлеките данные по тем же правилам отдельно от других страниц.
+
+        СТРОГО верните данные в формате JSON:
+        {
+            "pages": [
+                {"page": N, "metrics": [{"value": "данные"}]}
+            ]
+        }
+        """
+
+    def __init__(self, endpoint, parser: PdfToTextParser | None = None,
+                 llm_cache: DiskCache | None = None, bypass_llm_cache: bool = False,
+                 client: LlamaClient | None = None, triage: PageTriage | None = None):
         """
         Инициализация экстрактора метрик
         :param endpoint: URL эндпоинта LLaMA модели для обработки текста
+        :param parser: Парсер PDF документов (по умолчанию - без кэша страниц)
+        :param llm_cache: Кэш разобранных ответов модели (None - без кэширования)
+        :param bypass_llm_cache: Не читать ответы из кэша (свежие ответы все равно сохраняются)
+        :param client: Общий клиент LLaMA (по умолчанию создается собственный для endpoint)
+        :param triage: Предварительный отбор страниц (None - каждая страница отправляется в модель отдельно)
         """
         self.endpoint = endpoint
+        self.client = client or LlamaClient(endpoint)
+        self.parser = parser or PdfToTextParser()
+        self.llm_cache = llm_cache
+        self.bypass_llm_cache = bypass_llm_cache
+        self.triage = triage
         self.logger = self._setup_logger()
         self.samples_path = "samples"  # Путь к директории с PDF файлами
 
@@ -29,10 +111,12 @@ class MetricsExtractor:
         """
         logger = logging.getLogger('DocumentProcessor')
         logger.setLevel(logging.INFO)
-        handler = logging.StreamHandler()
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
+        # Логгер общий для всех экземпляров, обработчик добавляем только один раз
+        if not logger.handlers:
+            handler = logging.StreamHandler()
+            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+            handler.setFormatter(formatter)
+            logger.addHandler(handler)
         return logger
 
     def _extract_financial_data(self, response_text: str) -> Dict[str, Any] | None:
@@ -46,8 +130,35 @@ class MetricsExtractor:
             data = json.loads(json.loads(response_text))
             return data
         except Exception as e:
-            self.logger.error(f"Ошибка парсинга метрик: {str(e)}")
-            return {"metrics": []}
+            self.logger.error(f"Ошибка парсинга ответа модели: {str(e)}")
+            return None
+
+    def _request_llm(self, request_payload: dict) -> tuple[int, Dict[str, Any] | None]:
+        """
+        Запрос к LLaMA модели с кэшированием разобранных ответов.
+        Ключ кэша - хеш полного запроса и эндпоинта; в кэш попадают только
+        успешно разобранные ответы, поэтому 503 и ошибки парсинга не кэшируются
+        :param request_payload: Параметры запроса к модели
+        :return: Код ответа и разобранные данные (None, если ответ не удалось разобрать)
+        """
+        cache_key = None
+        if self.llm_cache is not None:
+            cache_key = DiskCache.make_key("llm", self.endpoint, request_payload)
+            if not self.bypass_llm_cache:
+                cached = self.llm_cache.get(cache_key)
+                if cached is not None:
+                    LLM_CACHE_LOOKUPS.inc(result="hit")
+                    return 200, json.loads(cached)
+            LLM_CACHE_LOOKUPS.inc(result="bypass" if self.bypass_llm_cache else "miss")
+
+        response = self.client.post(request_payload)
+        if response.status_code != 200:
+            return response.status_code, None
+
+        data = self._extract_financial_data(response.text)
+        if data is not None and cache_key is not None:
+            self.llm_cache.set(cache_key, json.dumps(data, ensure_ascii=False).encode("utf-8"))
+        return 200, data
 
     def extract_metrics_from_page(self, page_text: str) -> Dict[str, Any] | None:
         """
@@ -55,43 +166,10 @@ class MetricsExtractor:
         :param page_text: Текст страницы для анализа
         :return: Словарь с извлеченными метриками или None в случае ошибки
         """
-        # Базовый промпт с инструкциями для модели
-        base_prompt = """
-        Извлеките все важные данные:
-        - финансовые показатели
-        - аналитика
-        - деятельность компании
-        - решения руководства
-        - политика компании
-        - приобретения
-        - движение денежных средств
-        - инвестиции.
-            
-        СТРОГО верните данные в формате JSON:
-        {
-            "metrics": [
-                {"value": "данные"}
-            ]
-        }
-            
-        Правила:
-        1. НИКАКИХ дополнительных текстов
-        2. Если это финансовая метрика, то оставлять ТОЧНОЕ название метрики и ее значение
-        3. ТОЛЬКО реальные числа из документа
-        4. ТОЧНЫЕ названия как в документе
-        5. Сохранять единицы измерения (тыс. руб., млн руб., тыс. дол.)
-        6. ТОЛЬКО важные аналитические данные
-        """
-
-        # Системный промпт, определяющий роль модели
-        system_prompt = """
-        Вы — эксперт по финансовой отчетности. Вы разговариваете на русском языке.
-        """
-
         # Формируем параметры запроса к модели
         request_payload = {
-            "prompt": base_prompt + page_text,
-            "system_prompt": system_prompt,
+            "prompt": self.METRICS_PROMPT + page_text,
+            "system_prompt": self.METRICS_SYSTEM_PROMPT,
             "frequency_penalty": 1,  # Снижаем вероятность повторений
             "temperature": 0.2,      # Делаем генерацию более детерминированной
             "max_tokens": 10000,     # Максимальная длина ответа
@@ -99,49 +177,97 @@ class MetricsExtractor:
                 "title": "Generated schema for Root",
                 "type": "object",
                 "properties": {
-                    "metrics": {
+                    "metrics": self.METRICS_ITEMS_SCHEMA
+                },
+                "required": [
+                    "metrics"
+                ]
+            }
+        }
+
+        try:
+            # Отправляем запрос к LLaMA модели
+            status_code, extracted_data = self._request_llm(request_payload)
+
+            if status_code == 200:
+                # Успешный ответ - возвращаем метрики
+                return extracted_data if extracted_data is not None else {"metrics": []}
+            elif status_code == 503:
+                # Клиент уже исчерпал повторы - сервис перегружен, страницу пропускаем
+                self.logger.error("Модель недоступна (503) при обработке страницы, повторы исчерпаны")
+                return None
+            else:
+                self.logger.error(f"Ошибка API при обработке страницы, код {status_code}")
+                return None
+
+        except Exception as e:
+            self.logger.error(f"Ошибка обработки страницы: {str(e)}")
+            return None
+
+    def extract_metrics_from_pages(self, pages: list[tuple[int, str]]) -> dict[int, Dict[str, Any] | None]:
+        """
+        Извлечение метрик из нескольких коротких страниц одним запросом к модели.
+        Если ответ не удалось разобрать, страницы обрабатываются по одной
+        :param pages: Пары (номер страницы, текст страницы)
+        :return: Метрики по номерам страниц (None - ошибка запроса к модели)
+        """
+        if len(pages) == 1:
+            page, page_text = pages[0]
+            return {page: self.extract_metrics_from_page(page_text)}
+
+        pages_text = "".join(f"\n=== Страница {page} ===\n{page_text}" for page, page_text in pages)
+        request_payload = {
+            "prompt": self.METRICS_PROMPT + self.PAGES_PROMPT + pages_text,
+            "system_prompt": self.METRICS_SYSTEM_PROMPT,
+            "frequency_penalty": 1,
+            "temperature": 0.2,
+            "max_tokens": 10000,
+            "schema": {
+                "title": "Generated schema for Pages",
+                "type": "object",
+                "properties": {
+                    "pages": {
                         "type": "array",
                         "items": {
                             "type": "object",
                             "properties": {
-                                "value": {
-                                    "type": "string"
-                                }
+                                "page": {
+                                    "type": "integer"
+                                },
+                                "metrics": self.METRICS_ITEMS_SCHEMA
                             },
                             "required": [
-                                "value"
+                                "page",
+                                "metrics"
                             ]
                         }
                     }
                 },
                 "required": [
-                    "metrics"
+                    "pages"
                 ]
             }
         }
 
         try:
-            # Отправляем запрос к LLaMA модели
-            response = requests.post(
-                self.endpoint,
-                json=request_payload,
-                headers={"Content-Type": "application/json"}
-            )
-
-            if response.status_code == 200:
-                # Успешный ответ - извлекаем метрики
-                extracted_data = self._extract_financial_data(response.text)
-                return extracted_data
-            elif response.status_code == 503:
-                # Сервис временно недоступен - пробуем получить метаданные
-                return self.extract_metadata(page_text)
-            else:
-                self.logger.error(f"Ошибка API при обработке страницы, код {response.status_code}")
-                return None
-
+            status_code, extracted_data = self._request_llm(request_payload)
         except Exception as e:
-            self.logger.error(f"Ошибка обработки страницы: {str(e)}")
-            return None
+            self.logger.error(f"Ошибка обработки страниц {[page for page, _ in pages]}: {str(e)}")
+            return {page: None for page, _ in pages}
+
+        if status_code != 200:
+            self.logger.error(f"Ошибка API при обработке страниц {[page for page, _ in pages]}, код {status_code}")
+            return {page: None for page, _ in pages}
+        if not isinstance(extracted_data, dict) or not isinstance(extracted_data.get("pages"), list):
+            # Модель не справилась с форматом - повторяем постранично
+            return {page: self.extract_metrics_from_page(page_text) for page, page_text in pages}
+
+        # Страницы, не вошедшие в ответ, считаются страницами без метрик
+        results = {page: {"metrics": []} for page, _ in pages}
+        for item in extracted_data["pages"]:
+            if isinstance(item, dict) and item.get("page") in results:
+                results[item["page"]]["metrics"].extend(item.get("metrics") or [])
+        return results
 
     def extract_metadata(self, first_page: str) -> Dict[str, str]:
         """
@@ -187,20 +313,16 @@ class MetricsExtractor:
 
         try:
             # Отправляем запрос к модели
-            response = requests.post(
-                self.endpoint,
-                json=request_payload,
-                headers={"Content-Type": "application/json"}
-            )
-
-            if response.status_code == 200:
-                metadata = json.loads(json.loads(response.text))
-                return metadata
-            elif response.status_code == 503:
-                # При недоступности сервиса пробуем повторить запрос
-                return self.extract_metadata(first_page)
+            status_code, metadata = self._request_llm(request_payload)
+
+            if status_code == 200:
+                return metadata if metadata is not None else {"report_type": ""}
+            elif status_code == 503:
+                # Клиент уже исчерпал повторы с экспоненциальной задержкой
+                self.logger.error("Модель недоступна (503) при извлечении метаданных, повторы исчерпаны")
+                return {"report_type": ""}
             else:
-                self.logger.error(f"Ошибка API при извлечении метаданных, код {response.status_code}")
+                self.logger.error(f"Ошибка API при извлечении метаданных, код {status_code}")
                 return {"report_type": ""}
 
         except Exception as e:
@@ -220,31 +342,37 @@ class MetricsExtractor:
         # Извлекаем метаданные только из первой страницы
         metadata = self.extract_metadata(pages_text[0])
 
-        def process_page(page_num, page_text):
+        def process_group(pages):
             """
-            Обработка одной страницы документа
-            :param page_num: Номер страницы
-            :param page_text: Текст страницы
-            :return: Словарь с метриками страницы или None
+            Обработка группы страниц документа (одна страница или несколько коротких)
+            :param pages: Пары (номер страницы, текст страницы)
+            :return: Список словарей с метриками страниц
             """
-            print(f"Обработка страницы {page_num + 1} из {len(pages_text)}...")
-            page_metrics = self.extract_metrics_from_page(page_text)
-
-            if page_metrics and page_metrics.get("metrics", []):
-                return {
-                    "doc_type": metadata.get("report_type", ""),
-                    "page": page_num + 1,
-                    "metrics": page_metrics.get("metrics", [])
-                }
-            return None
+            self.logger.debug(f"Обработка страниц {[page for page, _ in pages]} из {len(pages_text)}...")
+            results = []
+            for page, page_metrics in self.extract_metrics_from_pages(pages).items():
+                if page_metrics and page_metrics.get("metrics", []):
+                    results.append({
+                        "doc_type": metadata.get("report_type", ""),
+                        "page": page,
+                        "metrics": page_metrics.get("metrics", [])
+                    })
+            return results
 
         if metadata.get("report_type", ""):
-            # Параллельная обработка страниц через ThreadPoolExecutor
-            with ThreadPoolExecutor() as executor:
-                results = list(executor.map(lambda args: process_page(*args), enumerate(pages_text)))
+            numbered = [(page_num + 1, page_text) for page_num, page_text in enumerate(pages_text)]
+            if self.triage is not None:
+                # Страницы без ценных данных пропускаются, короткие объединяются в общие запросы
+                groups = [pages for decision, pages in self.triage.plan(numbered) if decision != SKIP]
+            else:
+                groups = [[page] for page in numbered]
+
+            # Параллельная обработка страниц; число потоков равно лимиту одновременных запросов клиента
+            with ThreadPoolExecutor(max_workers=self.client.max_in_flight) as executor:
+                results = list(executor.map(process_group, groups))
 
-            # Фильтруем None результаты и добавляем успешные в общий список
-            all_metrics["pages"] = [result for result in results if result is not None]
+            # Собираем страницы с метриками в исходном порядке
+            all_metrics["pages"] = sorted((page for group in results for page in group), key=lambda page: page["page"])
 
         return all_metrics
 
@@ -253,7 +381,7 @@ class MetricsExtractor:
         Извлечение базы знаний из всех PDF файлов в указанной директории
         :return: Структурированная база знаний со всеми извлеченными метриками
         """
-        parser = PdfToTextParser()
+        parser = self.parser
         directory = Path(self.samples_path)
         pdf_files = list(directory.glob("*.pdf"))
 
@@ -264,6 +392,9 @@ class MetricsExtractor:
         # Обрабатываем каждый PDF файл
         for file in pdf_files:
             pages_text = parser.parse_pdf_to_text(f"{self.samples_path}/{file.name}")
+            ocr_pages = parser.page_sources.count(SOURCE_OCR)
+            self.logger.info(f"{file.name}: {len(pages_text)} стр., текстовый слой - "
+                             f"{len(pages_text) - ocr_pages}, OCR - {ocr_pages}")
             results = self.extract_metrics_from_all_pages(pages_text)
             knowledge_base["files"].append(results)
 
@@ -0,0 +1,246 @@
+import re
+import sqlite3
+import threading
+from pathlib import Path
+
+from Periods import period_sort_key
+
+# Множители единиц измерения ("тыс. руб.", "млн долл.", транслитерация из ответов модели)
+_SCALES = [
+    (re.compile(r"(?<![а-яa-z])(?:млрд|миллиард|mlrd|bln)", re.I), 1e9),
+    (re.compile(r"(?<![а-яa-z])(?:млн|миллион|mln)", re.I), 1e6),
+    (re.compile(r"(?<![а-яa-z])(?:тыс|тысяч|tys|thous)", re.I), 1e3)
+]
+_CURRENCIES = [
+    (re.compile(r"руб|rub|₽", re.I), "RUB"),
+    (re.compile(r"дол|usd|\$", re.I), "USD"),
+    (re.compile(r"евро|eur|€", re.I), "EUR")
+]
+# Число: с разделителями разрядов или с дробной частью; отрицательное значение записывается
+# минусом или в скобках. Запятая - разделитель разрядов, только если групп несколько ("1,234,567")
+# или за ней следует десятичная точка ("1,234.5"), иначе это десятичная запятая ("1,234" = 1.234)
+_NUMBER = re.compile(
+    r"(?P<sign>[-−–]\s*|\(\s*)?"
+    r"(?P<number>\d{1,3}(?:[ \u00a0]\d{3})+(?:[.,]\d+)?|\d{1,3}(?:,\d{3}){2,}(?:\.\d+)?(?![\d,])"
+    r"|\d{1,3}(?:,\d{3})+\.\d+|\d+(?:[.,]\d+)?)"
+)
+# Даты вида 31.12.2022 - не значения метрик
+_DATE = re.compile(r"(?<![\d.,])\d{1,2}\.\d{1,2}\.(?:\d{4}|\d{2})(?!\d)")
+_NAME_NOISE = re.compile(r"[^\w\s%]")
+_SPACES = re.compile(r"\s+")
+
+
+def metric_key(name: str) -> str:
+    """
+    Ключ названия метрики для поиска: нижний регистр, без пунктуации и лишних пробелов
+    :param name: Название метрики
+    :return: Нормализованное название
+    """
+    return _SPACES.sub(" ", _NAME_NOISE.sub(" ", name.lower().replace("ё", "е"))).strip()
+
+
+def parse_metric(text: str) -> dict | None:
+    """
+    Разбор строки метрики вида "Выручка: 99 340 114 тыс. руб." в типизированную запись
+    :param text: Строка метрики из ответа модели
+    :return: Словарь name, value (с учетом множителя единиц), currency, unit или None,
+             если в строке нет названия или числа
+    """
+    name, separator, value_text = text.rpartition(":")
+    name = name.strip(" \t\"'«»")
+    if not separator or not metric_key(name):
+        return None
+
+    # Даты заменяем пробелами той же длины, чтобы не сдвинуть позицию единиц измерения
+    value_text = _DATE.sub(lambda date: " " * len(date.group()), value_text)
+    match = _NUMBER.search(value_text)
+    if match is None:
+        return None
+    number = match.group("number").replace(" ", "").replace("\u00a0", "")
+    if "," in number and ("." in number or number.count(",") > 1):
+        number = number.replace(",", "")
+    value = float(number.replace(",", "."))
+    if match.group("sign"):
+        value = -value
+
+    # Единицы ищем в значении, а если их там нет - в названии ("Выручка, тыс. руб.")
+    unit_text = value_text[match.end():]
+    scale = next((factor for pattern, factor in _SCALES if pattern.search(unit_text)), None)
+    if scale is None:
+        scale = next((factor for pattern, factor in _SCALES if pattern.search(name)), 1.0)
+    currency = next((code for pattern, code in _CURRENCIES if pattern.search(unit_text)), None)
+    if currency is None:
+        currency = next((code for pattern, code in _CURRENCIES if pattern.search(name)), "")
+
+    return {"name": name, "value": value * scale, "currency": currency, "unit": _SPACES.sub(" ", unit_text).strip(" )")}
+
+
+class MetricStore:
+    """
+    Таблица числовых метрик в SQLite: название, значение в единицах валюты, валюта,
+    отчетный период и страница источника. Используется для графиков и временных рядов
+    без обращения к векторной БД и LLaMA модели.
+    Записи имеют те же идентификаторы, что и в векторной БД, поэтому повторная загрузка
+    документа заменяет их, а не дублирует.
+    """
+    AGGREGATES = {"sum": "SUM", "avg": "AVG", "min": "MIN", "max": "MAX", "count": "COUNT"}
+
+    def __init__(self, db_path: str):
+        """
+        Инициализация хранилища
+        :param db_path: Путь к файлу БД SQLite
+        """
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS metrics (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    name_key TEXT NOT NULL,
+                    value REAL NOT NULL,
+                    currency TEXT NOT NULL,
+                    unit TEXT NOT NULL,
+                    period TEXT NOT NULL,
+                    doc_type TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    page INTEGER NOT NULL
+                )""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS metrics_name_period ON metrics (name_key, period)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS metrics_source ON metrics (source)")
+
+    @staticmethod
+    def make_records(rows: list[dict]) -> list[dict]:
+        """
+        Разбор записей векторной БД в записи таблицы метрик
+        :param rows: Записи, сформированные MilvusService.make_rows (текст начинается с типа отчета)
+        :return: Записи с числовыми значениями (строки без названия или числа пропускаются)
+        """
+        records = []
+        for row in rows:
+            text, doc_type = row["text"], row.get("doc_type", "")
+            if doc_type and text.startswith(doc_type + ": "):
+                text = text[len(doc_type) + 2:]
+            metric = parse_metric(text)
+            if metric is None:
+                continue
+            records.append({**metric, "id": row["id"], "name_key": metric_key(metric["name"]),
+                            "period": row.get("period", ""), "doc_type": doc_type,
+                            "source": row.get("source", ""), "page": row.get("page", 0)})
+        return records
+
+    def upsert_rows(self, rows: list[dict]) -> int:
+        """
+        Сохранение метрик из записей векторной БД
+        :param rows: Записи, сформированные MilvusService.make_rows
+        :return: Количество сохраненных метрик
+        """
+        records = self.make_records(rows)
+        with self._lock, self.connection:
+            self.connection.executemany("""
+                INSERT OR REPLACE INTO metrics (id, name, name_key, value, currency, unit, period, doc_type, source, page)
+                VALUES (:id, :name, :name_key, :value, :currency, :unit, :period, :doc_type, :source, :page)
+            """, records)
+        return len(records)
+
+    def delete_by_source(self, source: str):
+        """
+        Удаление метрик документа
+        :param source: Исходный документ
+        """
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM metrics WHERE source = ?", (source,))
+
+    def drop(self):
+        """Удаление всех метрик"""
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM metrics")
+
+    def count(self) -> int:
+        """Количество метрик в таблице"""
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM metrics").fetchone()[0]
+
+    @staticmethod
+    def _conditions(name: str, exact: bool, currency: str | None, periods: list[str] | None) -> tuple[str, list]:
+        """
+        Условия выборки метрик
+        :param name: Название метрики
+        :param exact: Точное совпадение названия (иначе - вхождение)
+        :param currency: Валюта (None - любая)
+        :param periods: Отчетные периоды (None - все)
+        :return: Выражение WHERE и его параметры
+        """
+        key = metric_key(name)
+        conditions, params = (["name_key = ?"], [key]) if exact else (["name_key LIKE ?"], [f"%{key}%"])
+        if currency:
+            conditions.append("currency = ?")
+            params.append(currency)
+        if periods:
+            conditions.append(f"period IN ({', '.join('?' * len(periods))})")
+            params.extend(periods)
+        return " AND ".join(conditions), params
+
+    def names(self, query: str = "", limit: int = 50) -> list[dict]:
+        """
+        Названия метрик с количеством значений
+        :param query: Подстрока названия
+        :param limit: Максимальное количество названий
+        :return: Список {"name": ..., "count": ...} по убыванию количества
+        """
+        with self._lock:
+            rows = self.connection.execute("""
+                SELECT MIN(name) AS name, COUNT(*) AS count FROM metrics
+                WHERE name_key LIKE ? GROUP BY name_key ORDER BY count DESC LIMIT ?
+            """, (f"%{metric_key(query)}%", limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def series(self, name: str, exact: bool = False, currency: str | None = None,
+               periods: list[str] | None = None) -> list[dict]:
+        """
+        Временной ряд метрики
+        :param name: Название метрики
+        :param exact: Точное совпадение названия (иначе - вхождение)
+        :param currency: Валюта (None - любая)
+        :param periods: Отчетные периоды (None - все)
+        :return: Значения в хронологическом порядке периодов
+        """
+        where, params = self._conditions(name, exact, currency, periods)
+        with self._lock:
+            rows = self.connection.execute(f"""
+                SELECT name, value, currency, unit, period, doc_type, source, page FROM metrics
+                WHERE {where} ORDER BY source, page
+            """, params).fetchall()
+        return sorted((dict(row) for row in rows), key=lambda row: period_sort_key(row["period"]))
+
+    def aggregate(self, name: str, function: str = "sum", by: str = "period", exact: bool = False,
+                  currency: str | None = None, periods: list[str] | None = None) -> list[dict]:
+        """
+        Агрегация значений метрики по периодам, годам или документам
+        :param name: Название метрики
+        :param function: Функция агрегации (sum, avg, min, max, count)
+        :param by: Группировка (period, year, source)
+        :param exact: Точное совпадение названия (иначе - вхождение)
+        :param currency: Валюта (None - любая)
+        :param periods: Отчетные периоды (None - все)
+        :return: Список {"group": ..., "value": ..., "count": ...}
+        """
+        if function not in self.AGGREGATES:
+            raise ValueError(f"Неизвестная функция агрегации: {function}")
+        group = {"period": "period", "year": "substr(period, 1, 4)", "source": "source"}.get(by)
+        if group is None:
+            raise ValueError(f"Неизвестная группировка: {by}")
+
+        where, params = self._conditions(name, exact, currency, periods)
+        with self._lock:
+            rows = self.connection.execute(f"""
+                SELECT {group} AS "group", {self.AGGREGATES[function]}(value) AS value, COUNT(*) AS count
+                FROM metrics WHERE {where} GROUP BY "group"
+            """, params).fetchall()
+        rows = [dict(row) for row in rows]
+        if by == "source":
+            return sorted(rows, key=lambda row: row["group"])
+        return sorted(rows, key=lambda row: period_sort_key(row["group"]))
@@ -1,62 +1,207 @@
-from pymilvus import MilvusClient
-import requests
+from pymilvus import MilvusClient, DataType
+import hashlib
+import json
+import numpy as np
+
+from Instrumentation import REGISTRY, span
+
+MILVUS_ROWS = REGISTRY.counter("aidoc_milvus_rows_total", "Записи, переданные в векторную БД", ("operation",))
 
 
 class MilvusService():
     """
-    Сервис для работы с векторной базой данных Milvus
+    Сервис для работы с векторной базой данных Milvus.
+    Коллекция создается один раз; записи добавляются через upsert со стабильными
+    идентификаторами (хеш источника, страницы и текста), поэтому повторная загрузка
+    документа не создает дубликатов, а новый отчет добавляет только свои векторы.
     """
-    def __init__(self, db_path: str, collection_name: str, dimension: int = 1024):
+    # Скалярные поля записи, доступные для фильтрации
+    SCALAR_FIELDS = ("text", "source", "page", "doc_type", "period")
+
+    def __init__(self, db_path: str, collection_name: str, dimension: int = 1024, batch_size: int = 1000):
         """
         Инициализация сервиса
         :param db_path: Путь к БД
         :param collection_name: Имя коллекции
         :param dimension: Размерность векторов
+        :param batch_size: Максимальное количество записей в одном запросе вставки
         """
         self.client = MilvusClient(db_path)
         self.collection_name = collection_name
         self.dimension = dimension
+        self.batch_size = batch_size
+        self._collection_ready = False
 
-    def insert_data(self, vectors: list[list[float]], texts: list[str]):
-        """
-        Вставка данных в коллекцию
-        :param vectors: Список векторов
-        :param texts: Список соответствующих текстов
-        """
-        # Проверяем существование коллекции и удаляем её при необходимости
-        has_collection = self.client.has_collection(self.collection_name)
-        if has_collection:
+    def _ensure_collection(self):
+        """Создание коллекции со схемой скалярных полей, если ее еще нет"""
+        if self._collection_ready:
+            return
+
+        if self.client.has_collection(self.collection_name):
+            fields = {field["name"] for field in self.client.describe_collection(self.collection_name)["fields"]}
+            if set(self.SCALAR_FIELDS) <= fields:
+                # После перезапуска сервиса коллекция не загружена в память - поиск без load() недоступен
+                self.client.load_collection(self.collection_name)
+                self._collection_ready = True
+                return
+            # Коллекция старого формата (id, vector, text) - пересоздаем
             self.client.drop_collection(self.collection_name)
 
-        # Создаем новую коллекцию
+        schema = self.client.create_schema(auto_id=False, enable_dynamic_field=False)
+        schema.add_field("id", DataType.INT64, is_primary=True)
+        schema.add_field("vector", DataType.FLOAT_VECTOR, dim=self.dimension)
+        schema.add_field("text", DataType.VARCHAR, max_length=8192)
+        schema.add_field("source", DataType.VARCHAR, max_length=512)
+        schema.add_field("page", DataType.INT64)
+        schema.add_field("doc_type", DataType.VARCHAR, max_length=1024)
+        schema.add_field("period", DataType.VARCHAR, max_length=32)
+
+        index_params = self.client.prepare_index_params()
+        index_params.add_index(field_name="vector", index_type="AUTOINDEX", metric_type="COSINE")
+
         self.client.create_collection(
             collection_name=self.collection_name,
-            dimension=self.dimension
+            schema=schema,
+            index_params=index_params
         )
+        self._collection_ready = True
 
-        # Формируем данные для вставки
-        data = [{"id": i, "vector": vectors[i], "text": texts[i]}
+    @staticmethod
+    def make_id(source: str, page: int, text: str) -> int:
+        """
+        Стабильный идентификатор записи по ее содержимому
+        :param source: Исходный документ
+        :param page: Номер страницы
+        :param text: Текст записи
+        :return: Неотрицательный 63-битный идентификатор
+        """
+        digest = hashlib.sha256(json.dumps([source, page, text], ensure_ascii=False).encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big") & 0x7FFFFFFFFFFFFFFF
+
+    def make_rows(self, vectors: np.ndarray | list[list[float]], texts: list[str], source: str = "",
+                  page: int = 0, doc_type: str = "", period: str = "") -> list[dict]:
+        """
+        Формирование записей для вставки
+        :param vectors: Матрица или список векторов
+        :param texts: Список соответствующих текстов
+        :param source: Исходный документ
+        :param page: Номер страницы
+        :param doc_type: Тип отчета
+        :param period: Отчетный период
+        :return: Список записей коллекции
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).tolist()
+        return [{"id": self.make_id(source, page, texts[i]), "vector": vectors[i], "text": texts[i],
+                 "source": source, "page": page, "doc_type": doc_type, "period": period}
                 for i in range(len(vectors))]
 
-        return self.client.insert(
+    def upsert_rows(self, rows: list[dict]) -> int:
+        """
+        Пакетная вставка или замена записей
+        :param rows: Записи, сформированные make_rows
+        :return: Количество записанных записей
+        """
+        self._ensure_collection()
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            with span("milvus.upsert", rows=len(batch)):
+                self.client.upsert(
+                    collection_name=self.collection_name,
+                    data=batch
+                )
+            MILVUS_ROWS.inc(len(batch), operation="upsert")
+        return len(rows)
+
+    def insert_data(self, vectors: np.ndarray | list[list[float]], texts: list[str], source: str = "",
+                    page: int = 0, doc_type: str = "", period: str = ""):
+        """
+        Вставка данных в коллекцию (существующие записи с теми же идентификаторами заменяются)
+        :param vectors: Матрица или список векторов
+        :param texts: Список соответствующих текстов
+        :param source: Исходный документ
+        :param page: Номер страницы
+        :param doc_type: Тип отчета
+        :param period: Отчетный период
+        """
+        return self.upsert_rows(self.make_rows(vectors, texts, source, page, doc_type, period))
+
+    def delete_by_source(self, source: str):
+        """
+        Удаление всех записей исходного документа
+        :param source: Исходный документ
+        """
+        self._ensure_collection()
+        with span("milvus.delete"):
+            return self.client.delete(
+                collection_name=self.collection_name,
+                filter=f"source == {json.dumps(source, ensure_ascii=False)}"
+            )
+
+    def iter_rows(self, batch_size: int = 1000):
+        """
+        Обход всех записей коллекции без векторов (для построения внешних индексов)
+        :param batch_size: Количество записей, читаемых за один запрос
+        :return: Генератор записей с идентификатором и скалярными полями
+        """
+        self._ensure_collection()
+        iterator = self.client.query_iterator(
             collection_name=self.collection_name,
-            data=data
+            batch_size=batch_size,
+            filter="",
+            output_fields=["id", *self.SCALAR_FIELDS]
         )
+        try:
+            while True:
+                batch = iterator.next()
+                if not batch:
+                    break
+                yield from batch
+        finally:
+            iterator.close()
+
+    @staticmethod
+    def _build_filter(filters: dict | None) -> str:
+        """
+        Построение выражения фильтра Milvus
+        :param filters: Значения скалярных полей; список означает "одно из"
+        :return: Выражение фильтра или пустая строка
+        """
+        conditions = []
+        for field, value in (filters or {}).items():
+            if isinstance(value, (list, tuple, set)):
+                conditions.append(f"{field} in {json.dumps(list(value), ensure_ascii=False)}")
+            else:
+                conditions.append(f"{field} == {json.dumps(value, ensure_ascii=False)}")
+        return " and ".join(conditions)
 
-    def search(self, query_vector: list[list[float]], limit: int = 10) -> list[list[dict]]:
+    def search(self, query_vector: np.ndarray | list[list[float]], limit: int = 10,
+               filters: dict | None = None) -> list[list[dict]]:
         """
         Поиск похожих документов
         :param query_vector: Векторное представление запроса
         :param limit: Максимальное количество результатов
+        :param filters: Фильтр по скалярным полям, например {"period": ["2022-Q2", "2022-H1"]}
         :return: Список найденных документов
         """
-        return self.client.search(
-            collection_name=self.collection_name,
-            data=query_vector,
-            limit=limit,
-            output_fields=["text"]
-        )
+        self._ensure_collection()
+        with span("milvus.search", limit=limit):
+            return self.client.search(
+                collection_name=self.collection_name,
+                data=np.asarray(query_vector, dtype=np.float32).tolist(),
+                limit=limit,
+                filter=self._build_filter(filters),
+                output_fields=list(self.SCALAR_FIELDS)
+            )
+
+    def published_version(self) -> str | None:
+        """Записи Milvus не публикуются снимками - версии нет (интерфейс MmapVectorStore)"""
+        return None
+
+    def flush(self):
+        """Записи Milvus видны поиску сразу после upsert - публиковать нечего (интерфейс MmapVectorStore)"""
+        return None
 
     def drop(self):
         """Удаление коллекции"""
+        self._collection_ready = False
         return self.client.drop_collection(self.collection_name)
@@ -0,0 +1,450 @@
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from Instrumentation import REGISTRY, span
+from MilvusService import MilvusService
+
+VECTOR_ROWS = REGISTRY.counter("aidoc_vector_rows_total", "Записи, переданные во встроенное векторное хранилище",
+                               ("operation",))
+VECTOR_SNAPSHOT_ROWS = REGISTRY.gauge("aidoc_vector_snapshot_rows", "Количество записей в опубликованном снимке")
+
+
+class _Snapshot:
+    """
+    Опубликованный снимок хранилища: векторы в отображаемом в память файле (только чтение),
+    идентификаторы и скалярные поля записей
+    """
+    def __init__(self, name: str, path: Path | None, dimension: int):
+        """
+        Открытие снимка
+        :param name: Имя снимка (None в path - пустой снимок)
+        :param path: Каталог снимка
+        :param dimension: Размерность векторов
+        """
+        self.name = name
+        self.scales = None
+        if path is None:
+            self.ids = np.empty(0, dtype=np.int64)
+            self.vectors = np.empty((0, dimension), dtype=np.float32)
+            self.rows = []
+        else:
+            self.ids = np.load(path / "ids.npy")
+            self.vectors = np.load(path / "vectors.npy", mmap_mode="r")
+            if (path / "scales.npy").exists():
+                self.scales = np.load(path / "scales.npy")
+            with open(path / "rows.json", encoding="utf-8") as file:
+                self.rows = json.load(file)
+        self._columns = {}
+        self._positions = None
+        self._lock = threading.Lock()
+
+    @property
+    def quantized(self) -> bool:
+        """Векторы хранятся в int8 с масштабом на строку"""
+        return self.scales is not None
+
+    def column(self, field: str) -> np.ndarray:
+        """Значения скалярного поля всех записей (для фильтров)"""
+        with self._lock:
+            if field not in self._columns:
+                self._columns[field] = np.array([row[field] for row in self.rows], dtype=object)
+            return self._columns[field]
+
+    def positions(self) -> dict[int, int]:
+        """Позиция записи по идентификатору"""
+        with self._lock:
+            if self._positions is None:
+                self._positions = {row_id: index for index, row_id in enumerate(self.ids.tolist())}
+            return self._positions
+
+    def dequantize(self, index: slice | np.ndarray) -> np.ndarray:
+        """Векторы записей в float32"""
+        block = np.asarray(self.vectors[index], dtype=np.float32)
+        return block * self.scales[index, None] if self.quantized else block
+
+
+class MmapVectorStore:
+    """
+    Встроенное векторное хранилище с точным поиском: нормированные векторы float32 (или int8
+    с масштабом на строку) лежат в файле .npy, который отображается в память только для чтения,
+    поэтому несколько воркеров uvicorn разделяют одни и те же страницы без копий.
+    Поиск - пакетное умножение матриц NumPy блоками строк с отбором top-k (косинусная близость,
+    как у коллекции Milvus). Интерфейс совпадает с MilvusService.
+
+    Запись идет через промежуточную область (staging): upsert_rows, delete_by_source и drop
+    дописываются в журнал на диске и не видны поиску до flush(). flush() собирает новый снимок
+    в отдельном каталоге и публикует его атомарной заменой файла CURRENT (os.replace), поэтому
+    переиндексация не прерывает читателей: они продолжают искать по прежнему снимку и
+    переключаются на новый при следующем запросе. Журнал переживает перезапуск процесса,
+    так что страницы, отмеченные в контрольных точках загрузки, не теряются до публикации.
+    Запись в журнал и публикация выполняются под блокировкой файла (fcntl.flock), поэтому загрузки,
+    запущенные в разных воркерах uvicorn, не перемешивают журнал; смещения векторов в журнале
+    определяются по размеру файла, а не по счетчику процесса.
+    """
+    SCALAR_FIELDS = MilvusService.SCALAR_FIELDS
+    # Записи становятся видны поиску только после flush()
+    STAGED_WRITES = True
+
+    make_id = staticmethod(MilvusService.make_id)
+    make_rows = MilvusService.make_rows
+
+    def __init__(self, path: str, dimension: int = 1024, quantize: bool = False, search_block_rows: int = 16384,
+                 keep_snapshots: int = 2):
+        """
+        Инициализация хранилища
+        :param path: Каталог хранилища (снимки, журнал записи и указатель CURRENT)
+        :param dimension: Размерность векторов
+        :param quantize: Хранить векторы в int8 (в 4 раза меньше памяти ценой небольшой погрешности оценок)
+        :param search_block_rows: Количество строк матрицы, обрабатываемых за одно умножение при поиске
+        :param keep_snapshots: Количество хранимых снимков, включая текущий (прежние удаляются при публикации)
+        """
+        self.path = Path(path)
+        self.dimension = dimension
+        self.quantize = quantize
+        self.search_block_rows = search_block_rows
+        self.keep_snapshots = max(1, keep_snapshots)
+
+        self._snapshots_dir = self.path / "snapshots"
+        self._staging_dir = self.path / "staging"
+        self._current_file = self.path / "CURRENT"
+        self._lock_file = self.path / "write.lock"
+        self._snapshots_dir.mkdir(parents=True, exist_ok=True)
+        self._staging_dir.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._snapshot = None
+        self._current_stat = None
+
+    # Чтение
+
+    def _read_current(self) -> tuple[str | None, tuple | None]:
+        """Имя опубликованного снимка и отметка файла CURRENT (для проверки смены снимка)"""
+        try:
+            stat = os.stat(self._current_file)
+        except FileNotFoundError:
+            return None, None
+        return self._current_file.read_text(encoding="utf-8").strip() or None, (stat.st_ino, stat.st_mtime_ns)
+
+    def _current(self) -> _Snapshot:
+        """
+        Текущий опубликованный снимок; если другой процесс опубликовал новый - открывается он
+        :return: Снимок
+        """
+        with self._lock:
+            try:
+                stat = os.stat(self._current_file)
+                marker = (stat.st_ino, stat.st_mtime_ns)
+            except FileNotFoundError:
+                marker = None
+            if self._snapshot is None or marker != self._current_stat:
+                name, self._current_stat = self._read_current()
+                path = self._snapshots_dir / name if name else None
+                self._snapshot = _Snapshot(name, path, self.dimension)
+                VECTOR_SNAPSHOT_ROWS.set(len(self._snapshot.ids))
+            return self._snapshot
+
+    def published_version(self) -> str | None:
+        """Имя опубликованного снимка (меняется при каждой публикации)"""
+        return self._current().name
+
+    def _candidates(self, snapshot: _Snapshot, filters: dict | None) -> np.ndarray | None:
+        """
+        Позиции записей, подходящих под фильтр
+        :param snapshot: Снимок
+        :param filters: Значения скалярных полей; список означает "одно из"
+        :return: Массив позиций или None, если фильтра нет
+        """
+        if not filters:
+            return None
+        mask = np.ones(len(snapshot.ids), dtype=bool)
+        for field, value in filters.items():
+            values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+            mask &= np.isin(snapshot.column(field), np.array(values, dtype=object))
+        return np.flatnonzero(mask)
+
+    def _normalize(self, vectors: np.ndarray | list[list[float]]) -> np.ndarray:
+        """Векторы единичной длины (косинусная близость сводится к скалярному произведению)"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1)
+
+    def search(self, query_vector: np.ndarray | list[list[float]], limit: int = 10,
+               filters: dict | None = None) -> list[list[dict]]:
+        """
+        Точный поиск похожих записей
+        :param query_vector: Векторы запросов
+        :param limit: Максимальное количество результатов на запрос
+        :param filters: Фильтр по скалярным полям, например {"period": ["2022-Q2", "2022-H1"]}
+        :return: Результат в формате MilvusService.search (distance - косинусная близость)
+        """
+        snapshot = self._current()
+        queries = self._normalize(query_vector)
+        candidates = self._candidates(snapshot, filters)
+        total = len(snapshot.ids) if candidates is None else len(candidates)
+
+        with span("vector.search", limit=limit, rows=total):
+            best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+            best_positions = np.empty((len(queries), 0), dtype=np.int64)
+            for start in range(0, total, self.search_block_rows):
+                stop = min(start + self.search_block_rows, total)
+                positions = np.arange(start, stop) if candidates is None else candidates[start:stop]
+                index = slice(start, stop) if candidates is None else positions
+                block = np.asarray(snapshot.vectors[index])
+                if snapshot.quantized:
+                    scores = (queries @ block.T.astype(np.float32)) * snapshot.scales[index]
+                else:
+                    scores = queries @ block.T
+                # Объединяем лучшие результаты блока с уже найденными и оставляем top-k
+                scores = np.concatenate([best_scores, scores], axis=1)
+                positions = np.concatenate([best_positions, np.broadcast_to(positions, (len(queries), len(positions)))], axis=1)
+                if scores.shape[1] > limit:
+                    top = np.argpartition(-scores, limit - 1, axis=1)[:, :limit]
+                    scores = np.take_along_axis(scores, top, axis=1)
+                    positions = np.take_along_axis(positions, top, axis=1)
+                best_scores, best_positions = scores, positions
+
+        results = []
+        for scores, positions in zip(best_scores, best_positions):
+            order = np.argsort(-scores)
+            results.append([{"id": int(snapshot.ids[position]), "distance": float(scores[rank]),
+                             "entity": {field: snapshot.rows[position][field] for field in self.SCALAR_FIELDS}}
+                            for rank, position in ((rank, positions[rank]) for rank in order)])
+        return results
+
+    def iter_rows(self, batch_size: int = 1000):
+        """
+        Обход всех записей опубликованного снимка без векторов
+        :param batch_size: Не используется (записи снимка уже в памяти); параметр для совместимости с MilvusService
+        :return: Генератор записей с идентификатором и скалярными полями
+        """
+        snapshot = self._current()
+        for row_id, row in zip(snapshot.ids.tolist(), snapshot.rows):
+            yield {"id": row_id, **row}
+
+    # Запись
+
+    @contextmanager
+    def _write_lock(self):
+        """Исключительная блокировка записи для потоков процесса и для других процессов с тем же каталогом"""
+        with self._lock, open(self._lock_file, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _staged_vector_count(self) -> int:
+        """Количество векторов в журнале промежуточной области (векторы журнала лежат в staging/vectors.f32)"""
+        vectors_file = self._staging_dir / "vectors.f32"
+        if not vectors_file.exists():
+            return 0
+        return vectors_file.stat().st_size // (4 * self.dimension)
+
+    def _stage(self, operation: dict, vectors: np.ndarray | None = None):
+        """
+        Добавление операции в журнал промежуточной области
+        :param operation: Операция (upsert, delete_source, drop)
+        :param vectors: Векторы записей операции upsert
+        """
+        with self._write_lock():
+            if vectors is not None:
+                # Журнал могли дополнить другие процессы - смещение определяется по файлу
+                operation["offset"] = self._staged_vector_count()
+                with open(self._staging_dir / "vectors.f32", "ab") as file:
+                    # Недописанный при сбое вектор отбрасывается, чтобы не сдвинуть следующие
+                    file.truncate(operation["offset"] * 4 * self.dimension)
+                    file.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            with open(self._staging_dir / "ops.jsonl", "a", encoding="utf-8") as file:
+                file.write(json.dumps(operation, ensure_ascii=False) + "\n")
+
+    def upsert_rows(self, rows: list[dict]) -> int:
+        """
+        Вставка или замена записей (видны поиску после flush)
+        :param rows: Записи, сформированные make_rows
+        :return: Количество записанных записей
+        """
+        if not rows:
+            return 0
+        vectors = self._normalize([row["vector"] for row in rows])
+        scalars = [{"id": row["id"], **{field: row[field] for field in self.SCALAR_FIELDS}} for row in rows]
+        self._stage({"op": "upsert", "rows": scalars}, vectors)
+        VECTOR_ROWS.inc(len(rows), operation="upsert")
+        return len(rows)
+
+    def insert_data(self, vectors: np.ndarray | list[list[float]], texts: list[str], source: str = "",
+                    page: int = 0, doc_type: str = "", period: str = ""):
+        """
+        Вставка данных (существующие записи с теми же идентификаторами заменяются; видны после flush)
+        :param vectors: Матрица или список векторов
+        :param texts: Список соответствующих текстов
+        :param source: Исходный документ
+        :param page: Номер страницы
+        :param doc_type: Тип отчета
+        :param period: Отчетный период
+        """
+        return self.upsert_rows(self.make_rows(vectors, texts, source, page, doc_type, period))
+
+    def delete_by_source(self, source: str):
+        """
+        Удаление всех записей исходного документа (после flush)
+        :param source: Исходный документ
+        """
+        self._stage({"op": "delete_source", "source": source})
+
+    def drop(self):
+        """Удаление всех записей (после flush; до публикации поиск идет по прежнему снимку)"""
+        self._stage({"op": "drop"})
+
+    def _staged_operations(self) -> list[dict]:
+        """Операции журнала; недописанная последняя строка (сбой во время записи) отбрасывается"""
+        ops_file = self._staging_dir / "ops.jsonl"
+        if not ops_file.exists():
+            return []
+        operations = []
+        with open(ops_file, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    operations.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+        return operations
+
+    def _write_snapshot(self, directory: Path, snapshot: _Snapshot, keep: np.ndarray, staged: np.ndarray,
+                        new_rows: list[dict], new_offsets: list[int]):
+        """
+        Запись нового снимка: сохраненные записи прежнего снимка и записи журнала
+        :param directory: Каталог нового снимка
+        :param snapshot: Прежний снимок
+        :param keep: Позиции сохраняемых записей прежнего снимка
+        :param staged: Векторы журнала
+        :param new_rows: Новые записи (идентификатор и скалярные поля)
+        :param new_offsets: Позиции векторов новых записей в журнале
+        """
+        count = len(keep) + len(new_rows)
+        vectors = np.lib.format.open_memmap(directory / "vectors.npy", mode="w+",
+                                            dtype=np.int8 if self.quantize else np.float32,
+                                            shape=(count, self.dimension))
+        scales = np.empty(count, dtype=np.float32) if self.quantize else None
+
+        def store(target: slice, block: np.ndarray):
+            if self.quantize:
+                # Симметричное квантование строки: максимум модуля переходит в 127
+                scale = np.abs(block).max(axis=1) / 127
+                scale[scale == 0] = 1
+                vectors[target] = np.round(block / scale[:, None]).astype(np.int8)
+                scales[target] = scale
+            else:
+                vectors[target] = block
+
+        for start in range(0, len(keep), self.search_block_rows):
+            positions = keep[start:start + self.search_block_rows]
+            target = slice(start, start + len(positions))
+            if snapshot.quantized == self.quantize:
+                # Формат не изменился - копируем без повторного квантования
+                vectors[target] = snapshot.vectors[positions]
+                if self.quantize:
+                    scales[target] = snapshot.scales[positions]
+            else:
+                store(target, snapshot.dequantize(positions))
+        for start in range(0, len(new_rows), self.search_block_rows):
+            offsets = new_offsets[start:start + self.search_block_rows]
+            store(slice(len(keep) + start, len(keep) + start + len(offsets)), staged[offsets])
+        vectors.flush()
+        del vectors
+
+        ids = np.concatenate([snapshot.ids[keep], np.array([row["id"] for row in new_rows], dtype=np.int64)])
+        np.save(directory / "ids.npy", ids)
+        if scales is not None:
+            np.save(directory / "scales.npy", scales)
+        rows = [snapshot.rows[position] for position in keep.tolist()]
+        rows += [{field: row[field] for field in self.SCALAR_FIELDS} for row in new_rows]
+        with open(directory / "rows.json", "w", encoding="utf-8") as file:
+            json.dump(rows, file, ensure_ascii=False)
+        with open(directory / "meta.json", "w", encoding="utf-8") as file:
+            json.dump({"count": count, "dimension": self.dimension, "quantized": self.quantize,
+                       "created": time.time()}, file)
+
+    def flush(self) -> str | None:
+        """
+        Публикация записей журнала: сборка нового снимка и атомарная замена CURRENT
+        :return: Имя опубликованного снимка или None, если публиковать нечего
+        """
+        with self._write_lock():
+            operations = self._staged_operations()
+            if not operations:
+                return None
+
+            with span("vector.publish", operations=len(operations)) as attributes:
+                snapshot = self._current()
+                vectors_file = self._staging_dir / "vectors.f32"
+                staged = np.fromfile(vectors_file, dtype=np.float32) \
+                    if vectors_file.exists() else np.empty(0, dtype=np.float32)
+                staged = staged[:len(staged) - len(staged) % self.dimension].reshape(-1, self.dimension)
+
+                # Применяем операции журнала по порядку: маска сохраняемых записей снимка и новые записи
+                keep = np.ones(len(snapshot.ids), dtype=bool)
+                new = {}
+                for operation in operations:
+                    if operation["op"] == "drop":
+                        keep[:] = False
+                        new.clear()
+                    elif operation["op"] == "delete_source":
+                        keep &= snapshot.column("source") != operation["source"]
+                        new = {row_id: item for row_id, item in new.items() if item[0]["source"] != operation["source"]}
+                    elif operation["op"] == "upsert":
+                        positions = snapshot.positions()
+                        for offset, row in enumerate(operation["rows"], start=operation["offset"]):
+                            if offset >= len(staged):
+                                break
+                            if row["id"] in positions:
+                                keep[positions[row["id"]]] = False
+                            new.pop(row["id"], None)
+                            new[row["id"]] = (row, offset)
+
+                # Имена снимков упорядочены по времени публикации (по ним удаляются устаревшие)
+                name = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+                temp_dir = self._snapshots_dir / f".tmp-{name}"
+                temp_dir.mkdir()
+                try:
+                    self._write_snapshot(temp_dir, snapshot, np.flatnonzero(keep), staged,
+                                         [row for row, _ in new.values()], [offset for _, offset in new.values()])
+                    os.rename(temp_dir, self._snapshots_dir / name)
+                except BaseException:
+                    shutil.rmtree(temp_dir, ignore_errors=True)
+                    raise
+
+                # Атомарная публикация: читатели видят либо прежний, либо новый снимок целиком
+                temp_current = self.path / f".CURRENT-{name}"
+                with open(temp_current, "w", encoding="utf-8") as file:
+                    file.write(name)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(temp_current, self._current_file)
+                attributes["rows"] = int(keep.sum()) + len(new)
+
+            # Журнал применен - очищаем его и удаляем устаревшие снимки
+            for staged_file in ("ops.jsonl", "vectors.f32"):
+                (self._staging_dir / staged_file).unlink(missing_ok=True)
+            self._remove_old_snapshots(name)
+            self._current()
+            return name
+
+    def _remove_old_snapshots(self, current: str):
+        """
+        Удаление снимков сверх keep_snapshots. Читатели в других процессах, еще открывшие
+        удаленный снимок, продолжают работать с ним: отображенные файлы остаются доступны до закрытия
+        """
+        names = sorted(path.name for path in self._snapshots_dir.iterdir()
+                       if path.is_dir() and not path.name.startswith("."))
+        for name in names[:-self.keep_snapshots]:
+            if name != current:
+                shutil.rmtree(self._snapshots_dir / name, ignore_errors=True)
@@ -0,0 +1,167 @@
+import re
+import threading
+from typing import Iterable, Iterator
+
+from Instrumentation import REGISTRY
+
+TRIAGE_PAGES = REGISTRY.counter("aidoc_triage_pages_total", "Страницы по решению предварительного отбора", ("decision",))
+TRIAGE_CALLS_AVOIDED = REGISTRY.counter("aidoc_triage_calls_avoided_total",
+                                        "Запросы к LLaMA, которых удалось избежать (пропуск и объединение страниц)")
+
+# Решения по странице
+SKIP = "skip"      # Страница без ценных данных, в модель не отправляется
+SINGLE = "single"  # Отдельный запрос
+PACK = "pack"      # Короткая страница, объединяется с другими в один запрос
+
+# Числа-показатели: с разделителями разрядов, дробные, проценты и многозначные.
+# Годы и короткие числа (номера страниц, пунктов) не учитываются
+_NUMBER = re.compile(r"(?<![\w.,])\(?-?\d{1,3}(?:[ \u00a0]\d{3})+(?:[.,]\d+)?\)?|\d+[.,]\d+|\d+\s?%|\d{4,}")
+_YEAR = re.compile(r"(?:19|20)\d{2}")
+# Основы слов финансовой отчетности и деятельности компании (в нижнем регистре)
+FINANCIAL_KEYWORDS = (
+    "выручк", "прибыл", "убыт", "доход", "расход", "себестоимост", "актив", "обязательств", "капитал",
+    "денежн", "задолженност", "налог", "дивиденд", "инвестиц", "кредит", "займ", "заем", "амортизац",
+    "oibda", "ebitda", "рентабельност", "маржинальн", "абонент", "приобретени", "баланс", "запас",
+    "основные средства", "финансовые вложения", "резерв", "revenue", "profit", "income", "assets", "cash"
+)
+
+
+class PageTriage:
+    """
+    Дешевый локальный отбор страниц перед извлечением метрик моделью.
+    Ценность страницы оценивается по плотности чисел, финансовым ключевым словам и
+    табличной структуре (строки с колонками, разделенными табуляцией, и числами).
+    Страницы без ценности (обложки, аудиторские заключения, подписи, пустые страницы OCR)
+    пропускаются, короткие ценные страницы объединяются по несколько в один запрос.
+    """
+    def __init__(self, min_score: float = 0.15, min_chars: int = 40, pack_chars: int = 1500,
+                 pack_budget: int = 4000, max_pages_per_request: int = 4):
+        """
+        Инициализация отбора
+        :param min_score: Минимальная оценка ценности страницы (0..1), ниже - страница пропускается
+        :param min_chars: Минимальное количество непробельных символов страницы
+        :param pack_chars: Страницы не длиннее этого объединяются с другими короткими страницами
+        :param pack_budget: Максимальный суммарный объем текста объединенного запроса в символах
+        :param max_pages_per_request: Максимальное количество страниц в объединенном запросе
+        """
+        self.min_score = min_score
+        self.min_chars = min_chars
+        self.pack_chars = pack_chars
+        self.pack_budget = pack_budget
+        self.max_pages_per_request = max(1, max_pages_per_request)
+
+        # Метрики
+        self.pages = 0
+        self.skipped = 0
+        self.packed = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def features(text: str) -> dict:
+        """
+        Признаки страницы
+        :param text: Текст страницы
+        :return: Количество непробельных символов, чисел-показателей, ключевых слов и табличных строк
+        """
+        lowered = text.lower()
+        numbers = [number for number in _NUMBER.findall(text) if not _YEAR.fullmatch(number.strip("()-"))]
+        table_rows = 0
+        for line in text.splitlines():
+            cells = [cell for cell in line.split("\t") if cell.strip()]
+            if len(cells) >= 2 and any(char.isdigit() for char in cells[-1]) and any(char.isalpha() for char in line):
+                table_rows += 1
+        return {
+            "chars": sum(1 for char in text if not char.isspace()),
+            "numbers": len(numbers),
+            "keywords": sum(1 for keyword in FINANCIAL_KEYWORDS if keyword in lowered),
+            "table_rows": table_rows
+        }
+
+    def score(self, text: str) -> float:
+        """
+        Оценка ценности страницы для извлечения метрик
+        :param text: Текст страницы
+        :return: Оценка от 0 (нечего извлекать) до 1
+        """
+        features = self.features(text)
+        if features["chars"] < self.min_chars:
+            return 0.0
+        return round(0.4 * min(features["numbers"] / 20, 1.0)
+                     + 0.3 * min(features["keywords"] / 4, 1.0)
+                     + 0.3 * min(features["table_rows"] / 5, 1.0), 3)
+
+    def decide(self, text: str) -> str:
+        """
+        Решение по странице
+        :param text: Текст страницы
+        :return: SKIP, SINGLE или PACK
+        """
+        if self.score(text) < self.min_score:
+            return SKIP
+        return PACK if len(text) <= self.pack_chars and self.max_pages_per_request > 1 else SINGLE
+
+    def _count(self, decision: str, pages: int):
+        """Учет группы страниц, отправляемой (или не отправляемой) в модель"""
+        with self._lock:
+            self.pages += pages
+            if decision == SKIP:
+                self.skipped += pages
+            else:
+                self.requests += 1
+                self.packed += pages if pages > 1 else 0
+        TRIAGE_PAGES.inc(pages, decision=decision)
+        TRIAGE_CALLS_AVOIDED.inc(pages if decision == SKIP else pages - 1)
+
+    def _groups(self, pages: Iterable[tuple[int, str]]) -> Iterator[tuple[str, list[tuple[int, str]]]]:
+        """
+        Разбиение страниц на группы запросов без учета в метриках
+        :param pages: Пары (номер страницы, текст)
+        :return: Генератор (решение, страницы группы)
+        """
+        pack, pack_size = [], 0
+        for page, text in pages:
+            decision = self.decide(text)
+            if decision != PACK:
+                yield decision, [(page, text)]
+                continue
+            if pack and (pack_size + len(text) > self.pack_budget or len(pack) >= self.max_pages_per_request):
+                yield PACK if len(pack) > 1 else SINGLE, pack
+                pack, pack_size = [], 0
+            pack.append((page, text))
+            pack_size += len(text)
+        if pack:
+            yield PACK if len(pack) > 1 else SINGLE, pack
+
+    def plan(self, pages: Iterable[tuple[int, str]]) -> Iterator[tuple[str, list[tuple[int, str]]]]:
+        """
+        Потоковое разбиение страниц документа на группы запросов
+        :param pages: Пары (номер страницы, текст)
+        :return: Генератор (решение, страницы группы): SKIP - одна пропускаемая страница,
+                 SINGLE - одна страница или PACK - несколько коротких страниц в одном запросе
+        """
+        for decision, group in self._groups(pages):
+            self._count(decision, len(group))
+            yield decision, group
+
+    def count_requests(self, pages: Iterable[tuple[int, str]]) -> int:
+        """
+        Количество запросов к модели для страниц (для оценки объема работ, без учета в метриках)
+        :param pages: Пары (номер страницы, текст)
+        :return: Число запросов после пропуска и объединения страниц
+        """
+        return sum(1 for decision, _ in self._groups(pages) if decision != SKIP)
+
+    def stats(self) -> dict:
+        """
+        Метрики отбора
+        :return: Количество страниц, пропущенных и объединенных страниц, запросов и сэкономленных запросов
+        """
+        with self._lock:
+            return {
+                "pages": self.pages,
+                "skipped": self.skipped,
+                "packed": self.packed,
+                "requests": self.requests,
+                "calls_avoided": self.pages - self.requests
+            }
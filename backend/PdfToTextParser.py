@@ -1,70 +1,318 @@
 import pytesseract
+import pymupdf
 from pdf2image import convert_from_path
-import re
-from datetime import datetime
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Iterator
+from DiskCache import DiskCache
+from Instrumentation import REGISTRY, SIZE_BUCKETS
+from LayoutEngine import LayoutEngine
+import hashlib
+import multiprocessing
 import os
+import time
+
+
+# Версия алгоритма извлечения текста; входит в ключ кэша страниц
+PARSER_VERSION = "4"
+
+
+# Восстановление строк и колонок таблиц по координатам слов (общее для OCR и текстового слоя)
+_LAYOUT = LayoutEngine()
+
+
+# Воркеры OCR запускаются без fork: в процессе сервера работают потоки (клиент Milvus, задания загрузки,
+# пакетирование эмбеддингов), и копия процесса с захваченными ими блокировками может зависнуть
+_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+
+# Источники текста страницы
+SOURCE_TEXT = "text"  # Текстовый слой PDF
+SOURCE_OCR = "ocr"    # Распознавание Tesseract
+
+PAGES = REGISTRY.counter("aidoc_parser_pages_total", "Извлеченные страницы по источнику текста", ("source",))
+TEXT_LAYER_SECONDS = REGISTRY.histogram("aidoc_parser_text_layer_seconds", "Чтение текстового слоя одной страницы")
+OCR_PAGE_SECONDS = REGISTRY.histogram("aidoc_parser_ocr_page_seconds", "Растеризация и OCR одной страницы (в воркере)")
+OCR_TASK_PAGES = REGISTRY.histogram("aidoc_parser_ocr_task_pages", "Количество страниц в задаче OCR", buckets=SIZE_BUCKETS)
+
+
+def _ocr_page_range(file_path: str, first_page: int, last_page: int, dpi: int, lang: str) -> list[tuple[str, float]]:
+    """
+    Растеризация и OCR диапазона страниц (выполняется в процессе-воркере)
+    :param file_path: Путь к PDF файлу
+    :param first_page: Номер первой страницы диапазона (с 1)
+    :param last_page: Номер последней страницы диапазона (включительно)
+    :param dpi: Разрешение растеризации
+    :param lang: Языки Tesseract
+    :return: Список пар (текст страницы, время обработки страницы в секундах). Метрики воркера
+             не видны основному процессу, поэтому время возвращается вместе с текстом
+    """
+    started = time.perf_counter()
+    # Растеризуем только нужный диапазон, а не весь документ
+    pages = convert_from_path(file_path, dpi=dpi, first_page=first_page, last_page=last_page)
+    # Растеризация выполняется одним вызовом, ее время делим между страницами поровну
+    rasterize_share = (time.perf_counter() - started) / max(len(pages), 1)
+
+    pages_text = []
+    for page_image in pages:
+        started = time.perf_counter()
+        # Получаем данные OCR с координатами для каждого слова
+        data = pytesseract.image_to_data(page_image, lang=lang, output_type=pytesseract.Output.DICT)
+        text = PdfToTextParser.build_page_text(data)
+        # Освобождаем изображение сразу после распознавания
+        page_image.close()
+        pages_text.append((text, rasterize_share + time.perf_counter() - started))
+
+    return pages_text
 
 
 class PdfToTextParser:
     """
-    Класс для преобразования PDF документов в текст с использованием OCR (Optical Character Recognition).
-    Использует библиотеки pdf2image для конвертации PDF в изображения и pytesseract для OCR.
+    Класс для преобразования PDF документов в текст.
+    Если у страницы есть текстовый слой, слова и их координаты читаются напрямую через PyMuPDF.
+    Сканированные страницы распознаются OCR (pdf2image + pytesseract): растеризуются лениво
+    диапазонами и обрабатываются в пуле процессов.
     """
+    def __init__(self, dpi: int = 300, workers: int | None = None, lang: str = 'rus+eng',
+                 pages_per_task: int = 2, mode: str = "hybrid", min_text_chars: int = 20,
+                 cache: DiskCache | None = None):
+        """
+        Инициализация парсера
+        :param dpi: Разрешение растеризации страниц
+        :param workers: Количество процессов OCR (по умолчанию - число CPU)
+        :param lang: Языки распознавания Tesseract
+        :param pages_per_task: Количество страниц, растеризуемых одной задачей воркера
+        :param mode: "hybrid" - текстовый слой с OCR для сканов, "ocr" - только OCR
+        :param min_text_chars: Минимальное число символов текстового слоя, при котором OCR не нужен
+        :param cache: Кэш распознанных страниц (None - без кэширования)
+        """
+        if mode not in ("hybrid", "ocr"):
+            raise ValueError(f"Неизвестный режим парсера: {mode}")
+        self.dpi = dpi
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.lang = lang
+        self.pages_per_task = max(1, pages_per_task)
+        self.mode = mode
+        self.min_text_chars = min_text_chars
+        self.cache = cache
+        # Источник текста каждой страницы последнего документа (SOURCE_TEXT / SOURCE_OCR)
+        self.page_sources = []
+
+    @staticmethod
+    def build_page_text(data: dict) -> str:
+        """
+        Восстановление текста страницы с сохранением структуры по данным OCR
+        :param data: Результат pytesseract.image_to_data в формате словаря
+        :return: Текст страницы, колонки таблиц разделены табуляцией
+        """
+        return _LAYOUT.build_text(data)
+
+    def _text_layer_page(self, page: pymupdf.Page) -> str | None:
+        """
+        Извлечение текста страницы из текстового слоя
+        :param page: Страница PyMuPDF
+        :return: Текст страницы в формате OCR или None, если страницу нужно распознавать
+        """
+        words = page.get_text("words")
+        chars = sum(len(w[4].strip()) for w in words)
+        if chars < self.min_text_chars:
+            return None
+
+        # Страница-скан с небольшим текстовым слоем (штамп, номер страницы) - отдаем в OCR
+        page_area = abs(page.rect) or 1
+        image_area = sum(abs(pymupdf.Rect(info["bbox"]) & page.rect) for info in page.get_image_info())
+        if image_area / page_area > 0.5 and chars < 10 * self.min_text_chars:
+            return None
+
+        # Переводим координаты из пунктов PDF в пиксели растра, чтобы пороги совпадали с OCR
+        scale = self.dpi / 72
+        data = {"text": [], "left": [], "top": [], "width": [], "height": []}
+        for x0, y0, x1, y1, word, *_ in words:
+            data["text"].append(word)
+            data["left"].append(int(x0 * scale))
+            data["top"].append(int(y0 * scale))
+            data["width"].append(int((x1 - x0) * scale))
+            data["height"].append(int((y1 - y0) * scale))
+
+        return self.build_page_text(data)
+
+    @staticmethod
+    def file_hash(file_path: str) -> str:
+        """
+        Хеш содержимого файла
+        :param file_path: Путь к файлу
+        :return: SHA-256 в шестнадцатеричном виде
+        """
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _page_cache_key(self, content_hash: str, page_number: int) -> str:
+        """
+        Ключ кэша распознанной страницы
+        :param content_hash: Хеш содержимого PDF файла
+        :param page_number: Номер страницы (с 1)
+        :return: Ключ кэша
+        """
+        return DiskCache.make_key("page", content_hash, page_number, self.dpi, self.lang, PARSER_VERSION)
+
+    def _plan_pages(self, document: pymupdf.Document, content_hash: str | None) -> Iterator[tuple]:
+        """
+        Разбиение документа на задачи: готовые страницы и диапазоны страниц для OCR
+        :param document: Открытый документ PyMuPDF
+        :param content_hash: Хеш содержимого документа для кэша страниц
+        :return: Генератор ("ready", текст, источник) или ("ocr", первая страница, последняя страница)
+        """
+        ocr_run = []
+        for page in document:
+            text = None
+            if self.mode == "hybrid":
+                with TEXT_LAYER_SECONDS.time():
+                    text = self._text_layer_page(page)
+            source = SOURCE_TEXT
+            if text is not None:
+                PAGES.inc(source=SOURCE_TEXT)
+            elif self.cache is not None:
+                cached = self.cache.get(self._page_cache_key(content_hash, page.number + 1))
+                if cached is not None:
+                    text, source = cached.decode("utf-8"), SOURCE_OCR
+                    PAGES.inc(source="ocr_cache")
+            if text is None:
+                ocr_run.append(page.number + 1)
+                if len(ocr_run) < self.pages_per_task:
+                    continue
+            if ocr_run:
+                yield "ocr", ocr_run[0], ocr_run[-1]
+                ocr_run = []
+            if text is not None:
+                yield "ready", text, source
+        if ocr_run:
+            yield "ocr", ocr_run[0], ocr_run[-1]
+
+    def page_count(self, file_path: str) -> int:
+        """
+        Количество страниц в PDF документе
+        :param file_path: Путь к PDF файлу
+        :return: Число страниц
+        """
+        with pymupdf.open(file_path) as document:
+            return document.page_count
+
+    def estimate_work(self, file_path: str) -> dict:
+        """
+        Оценка объема работы по документу без распознавания
+        :param file_path: Путь к PDF файлу
+        :return: Число страниц всего, с текстовым слоем, требующих OCR и уже распознанных (в кэше)
+        """
+        content_hash = self.file_hash(file_path) if self.cache is not None else None
+        estimate = {"pages": 0, "text_pages": 0, "ocr_pages": 0, "cached_ocr_pages": 0}
+        with pymupdf.open(file_path) as document:
+            for page in document:
+                estimate["pages"] += 1
+                if self.mode == "hybrid" and self._text_layer_page(page) is not None:
+                    estimate["text_pages"] += 1
+                elif content_hash and self.cache.contains(self._page_cache_key(content_hash, page.number + 1)):
+                    estimate["cached_ocr_pages"] += 1
+                else:
+                    estimate["ocr_pages"] += 1
+        return estimate
+
+    def iter_known_pages(self, file_path: str) -> Iterator[tuple[int, str | None]]:
+        """
+        Тексты страниц, доступные без распознавания: текстовый слой и кэш OCR
+        :param file_path: Путь к PDF файлу
+        :return: Генератор (номер страницы с 1, текст или None, если страницу нужно распознавать)
+        """
+        content_hash = self.file_hash(file_path) if self.cache is not None else None
+        with pymupdf.open(file_path) as document:
+            for page in document:
+                text = self._text_layer_page(page) if self.mode == "hybrid" else None
+                if text is None and content_hash:
+                    cached = self.cache.get(self._page_cache_key(content_hash, page.number + 1))
+                    text = cached.decode("utf-8") if cached is not None else None
+                yield page.number + 1, text
+
+    def iter_pages_with_sources(self, file_path: str) -> Iterator[tuple[str, str]]:
+        """
+        Потоковое извлечение страниц документа в исходном порядке.
+        Одновременно в работе не больше 2 * workers задач, поэтому пиковая память
+        зависит от числа воркеров, а не от размера документа.
+        :param file_path: Путь к PDF файлу
+        :return: Генератор пар (текст страницы, источник текста)
+        """
+        executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_MP_CONTEXT) if self.workers > 1 else None
+
+        def submit(first_page, last_page):
+            OCR_TASK_PAGES.observe(last_page - first_page + 1)
+            if executor is not None:
+                return executor.submit(_ocr_page_range, file_path, first_page, last_page, self.dpi, self.lang)
+            # Однопроцессный режим - без накладных расходов на пул
+            future = Future()
+            future.set_result(_ocr_page_range(file_path, first_page, last_page, self.dpi, self.lang))
+            return future
+
+        try:
+            content_hash = self.file_hash(file_path) if self.cache is not None else None
+            with pymupdf.open(file_path) as document:
+                tasks = self._plan_pages(document, content_hash)
+                pending = deque()
+
+                def fill():
+                    # Ограничиваем количество одновременно обрабатываемых задач
+                    while len(pending) < 2 * self.workers:
+                        task = next(tasks, None)
+                        if task is None:
+                            return
+                        if task[0] == "ocr":
+                            pending.append((task[1], submit(task[1], task[2])))
+                        else:
+                            pending.append((None, [(task[1], task[2])]))
+
+                fill()
+                while pending:
+                    # Забираем результаты строго по порядку и сразу планируем следующие задачи
+                    first_page, result = pending.popleft()
+                    if first_page is None:
+                        pages = result
+                    else:
+                        pages = []
+                        for text, seconds in result.result():
+                            OCR_PAGE_SECONDS.observe(seconds)
+                            PAGES.inc(source=SOURCE_OCR)
+                            pages.append((text, SOURCE_OCR))
+                        # Сохраняем распознанные страницы в кэш
+                        if self.cache is not None:
+                            for offset, (text, _) in enumerate(pages):
+                                self.cache.set(self._page_cache_key(content_hash, first_page + offset),
+                                               text.encode("utf-8"))
+                    fill()
+                    yield from pages
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def iter_pages(self, file_path: str) -> Iterator[str]:
+        """
+        Потоковое извлечение текстов страниц документа в исходном порядке
+        :param file_path: Путь к PDF файлу
+        :return: Генератор текстов страниц
+        """
+        for text, _ in self.iter_pages_with_sources(file_path):
+            yield text
+
     def parse_pdf_to_text(self, file_path: str) -> list[str]:
         """
-        Преобразование PDF документа в текст с сохранением структуры
+        Преобразование PDF документа в текст с сохранением структуры.
+        Источник текста каждой страницы сохраняется в self.page_sources
         :param file_path: Путь к PDF файлу
         :return: Список текстов страниц с сохранением форматирования
         """
-        result_text = ""
         pages_text = []
-        
-        # Конвертируем PDF в изображения с высоким разрешением для лучшего распознавания
-        pages = convert_from_path(file_path, dpi=300)
-
-        # Обрабатываем каждую страницу
-        for page_num, page_image in enumerate(pages):
-            # Получаем данные OCR с координатами для каждого слова
-            data = pytesseract.image_to_data(page_image, lang='rus+eng', output_type=pytesseract.Output.DICT)
-
-            # Словарь для хранения строк с учетом их расположения
-            lines = {}
-
-            # Группируем слова по строкам на основе их Y-координат
-            for i in range(len(data['text'])):
-                word = data['text'][i]
-                if word.strip():  # Пропускаем пустые слова
-                    x, y = data['left'][i], data['top'][i]
-                    width, height = data['width'][i], data['height'][i]
-                    
-                    # Округляем Y-координату для группировки слов в строки
-                    line_y = round(y / 10) * 10
-                    
-                    if line_y not in lines:
-                        lines[line_y] = []
-                    lines[line_y].append((x, word))
-
-            # Формируем текст с сохранением структуры таблиц
-            extracted_text = ""
-            for y, words in sorted(lines.items()):
-                line_text = ""
-                # Сортируем слова по X-координате для правильного порядка в строке
-                words = sorted(words, key=lambda w: w[0])
-                prev_x = None
-
-                for x, word in words:
-                    # Добавляем табуляцию при большом промежутке между словами
-                    if prev_x is not None and x - prev_x > 50:
-                        line_text += "\t"
-                    line_text += word + " "
-                    # Обновляем позицию конца предыдущего слова
-                    prev_x = x + len(word) * 5
-
-                extracted_text += line_text.strip() + "\n"
-
-            # Добавляем разметку страницы в общий текст
-            result_text += f"\n--- Page {page_num + 1} ---\n" + extracted_text
-            # Сохраняем текст страницы отдельно
-            pages_text.append(extracted_text)
-
-        return pages_text
\ No newline at end of file
+        self.page_sources = []
+        for text, source in self.iter_pages_with_sources(file_path):
+            pages_text.append(text)
+            self.page_sources.append(source)
+        return pages_text
@@ -0,0 +1,132 @@
+import re
+
+# Отчетные периоды приводятся к единому виду:
+#   "2022"    - год
+#   "2022-Q2" - квартал
+#   "2022-H1" - первое полугодие
+#   "2022-9M" - девять месяцев
+# Дата "по состоянию на" соответствует периоду, который на нее заканчивается.
+
+_MONTHS = {
+    "январ": 1, "феврал": 2, "март": 3, "апрел": 4, "ма": 5, "июн": 6,
+    "июл": 7, "август": 8, "сентябр": 9, "октябр": 10, "ноябр": 11, "декабр": 12
+}
+
+# Период, заканчивающийся в конце месяца
+_PERIOD_BY_MONTH_END = {3: "Q1", 6: "H1", 9: "9M", 12: ""}
+
+_ORDINALS = {
+    "1": 1, "i": 1, "перв": 1,
+    "2": 2, "ii": 2, "втор": 2,
+    "3": 3, "iii": 3, "трет": 3,
+    "4": 4, "iv": 4, "четверт": 4
+}
+
+_YEAR = re.compile(r"(?<!\d)(19\d{2}|20\d{2})(?!\d)")
+_QUARTER = re.compile(r"(?<![\w-])(1|2|3|4|i{1,3}|iv|перв\w*|втор\w*|трет\w*|четверт\w*)(?:-?[а-я]{0,3})?\s*(?:квартал\w*|кв\.)", re.I)
+_QUARTER_SHORT = re.compile(r"(?<!\w)(?:q([1-4])|([1-4])q)(?!\w)", re.I)
+_HALF = re.compile(r"(?:(?<!\w)(?:1|i|перв\w*)(?:-?[а-я]{0,3})?\s*полугоди\w*|(?:6|шест\w*)\s*месяц\w*|(?<!\w)h1(?!\w))", re.I)
+_NINE_MONTHS = re.compile(r"(?:(?<!\d)9|девят\w*)\s*месяц\w*|(?<!\w)9m(?!\w)", re.I)
+_THREE_MONTHS = re.compile(r"(?:(?<!\d)3|тр(?:и|ех|ёх))\s*месяц\w*", re.I)
+_DATE_WORDS = re.compile(r"(?<!\d)(\d{1,2})\s+([а-я]+)\s+(19\d{2}|20\d{2})", re.I)
+_DATE_DIGITS = re.compile(r"(?<!\d)(\d{1,2})\.(\d{1,2})\.(19\d{2}|20\d{2})(?!\d)")
+
+
+def _month_number(word: str) -> int | None:
+    """Номер месяца по русскому названию в любом падеже"""
+    word = word.lower()
+    for stem, number in sorted(_MONTHS.items(), key=lambda item: -len(item[0])):
+        if word.startswith(stem):
+            return number
+    return None
+
+
+def parse_period(text: str) -> str:
+    """
+    Определение отчетного периода по тексту (тип отчета, запрос пользователя)
+    :param text: Текст, например "ОТЧЕТ О ФИНАНСОВЫХ РЕЗУЛЬТАТАХ за 1-е полугодие 2021 года"
+    :return: Период в едином виде ("2021-H1") или пустая строка, если год не найден
+    """
+    years = _YEAR.findall(text)
+    if not years:
+        return ""
+    # В сравнительной отчетности ("2013 и 2012 годов") отчетным считается последний год
+    year = max(years)
+
+    match = _QUARTER_SHORT.search(text)
+    if match:
+        return f"{year}-Q{match.group(1) or match.group(2)}"
+    match = _QUARTER.search(text)
+    if match:
+        word = match.group(1).lower()
+        for prefix, number in _ORDINALS.items():
+            if word == prefix or (len(prefix) > 3 and word.startswith(prefix)):
+                return f"{year}-Q{number}"
+    if _HALF.search(text):
+        return f"{year}-H1"
+    if _NINE_MONTHS.search(text):
+        return f"{year}-9M"
+    if _THREE_MONTHS.search(text):
+        return f"{year}-Q1"
+
+    # Отчетность "по состоянию на" дату
+    for match in _DATE_WORDS.finditer(text):
+        month = _month_number(match.group(2))
+        if month in _PERIOD_BY_MONTH_END and match.group(3) == year:
+            suffix = _PERIOD_BY_MONTH_END[month]
+            return f"{year}-{suffix}" if suffix else year
+    for match in _DATE_DIGITS.finditer(text):
+        month = int(match.group(2))
+        if month in _PERIOD_BY_MONTH_END and match.group(3) == year:
+            suffix = _PERIOD_BY_MONTH_END[month]
+            return f"{year}-{suffix}" if suffix else year
+
+    return year
+
+
+# Периоды, данные которых отвечают на вопрос о периоде запроса: показатели квартала
+# входят в отчетность за полугодие, девять месяцев и год, которые на него заканчиваются
+_COVERING_PERIODS = {"Q1": ["Q1"], "Q2": ["Q2", "H1"], "Q3": ["Q3", "9M"], "Q4": ["Q4", ""],
+                     "H1": ["H1", "Q2"], "9M": ["9M", "Q3"]}
+_ALL_SUFFIXES = ["", "Q1", "Q2", "Q3", "Q4", "H1", "9M"]
+
+
+def expand_period(period: str) -> list[str]:
+    """
+    Периоды отчетности, в которых искать данные за период запроса
+    :param period: Период в едином виде, например "2022-Q2"
+    :return: Список периодов, например ["2022-Q2", "2022-H1"]; для года - все периоды этого года
+    """
+    if not period:
+        return []
+    year, _, suffix = period.partition("-")
+    suffixes = _COVERING_PERIODS.get(suffix, [suffix]) if suffix else _ALL_SUFFIXES
+    return [f"{year}-{item}" if item else year for item in suffixes]
+
+
+def query_periods(text: str) -> list[str]:
+    """
+    Периоды отчетности для запроса пользователя. Если в запросе несколько лет
+    ("с Q1 2020 по Q3 2022"), возвращаются все периоды лет диапазона
+    :param text: Текст запроса
+    :return: Список периодов или пустой список, если период не указан
+    """
+    years = sorted(set(_YEAR.findall(text)))
+    if len(years) > 1:
+        return [period for year in range(int(years[0]), int(years[-1]) + 1)
+                for period in expand_period(str(year))]
+    return expand_period(parse_period(text))
+
+
+# Порядок периодов внутри года: по дате окончания, при равной дате - более короткий период раньше
+_SUFFIX_ORDER = {"Q1": 1, "Q2": 2, "H1": 3, "Q3": 4, "9M": 5, "Q4": 6, "": 7}
+
+
+def period_sort_key(period: str) -> tuple[str, int]:
+    """
+    Ключ сортировки периодов в хронологическом порядке
+    :param period: Период в едином виде
+    :return: Ключ (год, порядок периода в году)
+    """
+    year, _, suffix = period.partition("-")
+    return year, _SUFFIX_ORDER.get(suffix, 0)
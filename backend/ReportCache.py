@@ -0,0 +1,245 @@
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+from DiskCache import DiskCache
+from HybridRetriever import report_kinds
+from Instrumentation import REGISTRY
+from Periods import query_periods
+
+REPORT_CACHE = REGISTRY.counter("aidoc_report_cache_total", "Обращения к кэшу отчетов по результату", ("result",))
+REPORT_CACHE_EVICTIONS = REGISTRY.counter("aidoc_report_cache_evictions_total", "Вытесненные записи кэша отчетов",
+                                          ("reason",))
+REPORT_CACHE_ENTRIES = REGISTRY.gauge("aidoc_report_cache_entries", "Количество записей кэша отчетов")
+
+
+class ReportCache:
+    """
+    Семантический кэш сгенерированных отчетов.
+    Запись хранит эмбеддинги поискового и основного промптов, ответ модели и статистику контекста.
+    Повторный запрос с теми же текстами находится по хешу без эмбеддингов, близкий по смыслу -
+    по косинусной близости обоих промптов не ниже порога. Периоды и виды отчетности, упомянутые
+    в промптах, должны совпадать точно: эмбеддинги запросов за Q2 и Q3 почти не отличаются,
+    а контекст и ответ для них разные.
+    Ключ включает отпечаток содержимого векторной БД: поколение кэша (файл-маркер, который
+    увеличивается после каждой загрузки, изменившей индекс) и опубликованный снимок хранилища.
+    При смене отпечатка кэш очищается - в том числе в других воркерах, которые видят маркер на диске.
+    Записи хранятся в памяти процесса с вытеснением LRU и ограничением времени жизни.
+    """
+    def __init__(self, path: str, max_entries: int = 256, ttl: float | None = 24 * 3600, threshold: float = 0.97,
+                 store_version: Callable[[], str | None] | None = None):
+        """
+        Инициализация кэша
+        :param path: Каталог кэша (файл-маркер поколения, общий для всех воркеров)
+        :param max_entries: Максимальное количество записей (вытесняются давно не использованные)
+        :param ttl: Время жизни записи в секундах (None - без ограничения)
+        :param threshold: Минимальная косинусная близость промптов для повторного использования ответа
+        :param store_version: Функция, возвращающая опубликованный снимок векторной БД (None - без снимков)
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.store_version = store_version
+        self._generation_file = self.path / "generation"
+
+        # Метрики
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        self._entries = OrderedDict()  # ключ текстов -> запись
+        self._matrix = None            # эмбеддинги записей (поисковый и основной промпт подряд) для сравнения
+        self._matrix_keys = []
+        self._matrix_scopes = []
+        self._fingerprint = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(search_prompt: str, prompt: str) -> str:
+        """Ключ точного совпадения текстов запроса"""
+        return DiskCache.make_key("report", search_prompt, prompt)
+
+    @staticmethod
+    def scope(search_prompt: str, prompt: str) -> tuple:
+        """
+        Периоды и виды отчетности, упомянутые в промптах (должны совпадать у запроса и записи)
+        :param search_prompt: Промпт для поиска данных
+        :param prompt: Основной промпт
+        :return: Кортеж периодов и видов отчетности обоих промптов
+        """
+        return tuple((tuple(query_periods(text)), tuple(sorted(report_kinds(text)))) for text in (search_prompt, prompt))
+
+    def _generation(self) -> str:
+        """Поколение кэша (меняется при invalidate в любом процессе)"""
+        try:
+            return self._generation_file.read_text(encoding="utf-8").strip()
+        except FileNotFoundError:
+            return "0"
+
+    def fingerprint(self) -> str:
+        """
+        Отпечаток содержимого векторной БД
+        :return: Поколение кэша и опубликованный снимок хранилища
+        """
+        version = self.store_version() if self.store_version is not None else None
+        return f"{self._generation()}:{version or ''}"
+
+    def invalidate(self):
+        """Сброс кэша во всех процессах (после загрузки, изменившей индекс)"""
+        generation = str(int(self._generation() or 0) + 1)
+        temp_file = self.path / f".generation-{generation}-{time.monotonic_ns()}"
+        temp_file.write_text(generation, encoding="utf-8")
+        temp_file.replace(self._generation_file)
+        with self._lock:
+            self._clear("invalidated")
+
+    def _clear(self, reason: str):
+        """Удаление всех записей (вызывается под блокировкой)"""
+        if self._entries:
+            REPORT_CACHE_EVICTIONS.inc(len(self._entries), reason=reason)
+            self.evictions += len(self._entries)
+            self.invalidations += 1
+        self._entries.clear()
+        self._matrix = None
+        REPORT_CACHE_ENTRIES.set(0)
+
+    def _check_fingerprint(self) -> str:
+        """Очистка записей, если содержимое векторной БД изменилось (вызывается под блокировкой)"""
+        fingerprint = self.fingerprint()
+        if fingerprint != self._fingerprint:
+            self._clear("invalidated")
+            self._fingerprint = fingerprint
+        return fingerprint
+
+    def _expire(self):
+        """Удаление записей с истекшим временем жизни (вызывается под блокировкой)"""
+        if self.ttl is None:
+            return
+        deadline = time.time() - self.ttl
+        expired = [key for key, entry in self._entries.items() if entry["created"] < deadline]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+            self.evictions += len(expired)
+            REPORT_CACHE_EVICTIONS.inc(len(expired), reason="ttl")
+            REPORT_CACHE_ENTRIES.set(len(self._entries))
+
+    def _hit(self, key: str, result: str) -> dict:
+        """Учет попадания и перенос записи в конец очереди LRU (вызывается под блокировкой)"""
+        self._entries.move_to_end(key)
+        self.hits += 1
+        if result == "similar":
+            self.similar_hits += 1
+        REPORT_CACHE.inc(result=result)
+        return self._entries[key]
+
+    def get(self, search_prompt: str, prompt: str) -> dict | None:
+        """
+        Поиск отчета по точному совпадению текстов (без эмбеддингов)
+        :param search_prompt: Промпт для поиска данных
+        :param prompt: Основной промпт
+        :return: Запись кэша (reply, context) или None
+        """
+        key = self.make_key(search_prompt, prompt)
+        with self._lock:
+            self._check_fingerprint()
+            self._expire()
+            if key in self._entries:
+                return self._hit(key, "exact")
+        return None
+
+    def find(self, vectors: np.ndarray, search_prompt: str, prompt: str) -> tuple[dict | None, float]:
+        """
+        Поиск отчета по близости промптов среди записей с теми же периодами и видами отчетности
+        :param vectors: Эмбеддинги поискового и основного промптов (две строки)
+        :param search_prompt: Промпт для поиска данных
+        :param prompt: Основной промпт
+        :return: Запись кэша или None и наименьшая из двух близостей к лучшей подходящей записи
+        """
+        scope = self.scope(search_prompt, prompt)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        with self._lock:
+            self._check_fingerprint()
+            self._expire()
+            if self._entries:
+                if self._matrix is None:
+                    self._matrix_keys = list(self._entries)
+                    self._matrix = np.stack([self._entries[key]["vectors"] for key in self._matrix_keys])
+                    self._matrix_scopes = [self._entries[key]["scope"] for key in self._matrix_keys]
+                # Близость записи - худшая из близостей поискового и основного промптов
+                similarity = np.einsum("npd,pd->np", self._matrix, vectors).min(axis=1)
+                # Записи за другие периоды или виды отчетности не рассматриваются, как бы близки они ни были
+                similarity[[entry_scope != scope for entry_scope in self._matrix_scopes]] = -1.0
+                best = int(np.argmax(similarity))
+                if similarity[best] >= self.threshold:
+                    return self._hit(self._matrix_keys[best], "similar"), float(similarity[best])
+                best_similarity = max(float(similarity[best]), 0.0)
+            else:
+                best_similarity = 0.0
+            self.misses += 1
+        REPORT_CACHE.inc(result="miss")
+        return None, best_similarity
+
+    def count_bypass(self):
+        """Учет запроса, выполненного без кэша по просьбе пользователя"""
+        REPORT_CACHE.inc(result="bypass")
+
+    def fingerprint_snapshot(self) -> str:
+        """Отпечаток на момент начала генерации (передается в put, чтобы не сохранить устаревший ответ)"""
+        with self._lock:
+            return self._check_fingerprint()
+
+    def put(self, search_prompt: str, prompt: str, vectors: np.ndarray, reply: str, context: dict,
+            fingerprint: str):
+        """
+        Сохранение отчета
+        :param search_prompt: Промпт для поиска данных
+        :param prompt: Основной промпт
+        :param vectors: Эмбеддинги поискового и основного промптов
+        :param reply: Ответ модели
+        :param context: Статистика контекста
+        :param fingerprint: Отпечаток БД на момент поиска данных; если БД с тех пор изменилась - отчет не сохраняется
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        key = self.make_key(search_prompt, prompt)
+        with self._lock:
+            if self._check_fingerprint() != fingerprint:
+                return
+            self._entries[key] = {"reply": reply, "context": context, "vectors": vectors,
+                                  "scope": self.scope(search_prompt, prompt), "created": time.time()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+                REPORT_CACHE_EVICTIONS.inc(reason="lru")
+            self._matrix = None
+            REPORT_CACHE_ENTRIES.set(len(self._entries))
+
+    def stats(self) -> dict:
+        """
+        Метрики кэша
+        :return: Количество записей, попаданий (в том числе по близости), промахов, вытеснений и доля попаданий
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "threshold": self.threshold
+            }
@@ -0,0 +1,276 @@
+import abc
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# Строки страницы вида "Выручка 2110 99 340 114 87 120 532": название, код строки и первое число
+_METRIC_LINE = re.compile(r"^\s*([А-Яа-яЁё][^\d]{2,}?)\s+\d{4}\s+(\(?-?\d{1,3}(?:[ \u00a0]\d{3}){0,2}\)?)(?!\d)")
+_PAGE_MARKER = re.compile(r"^=== Страница (\d+) ===$", re.M)
+_REPORT_TITLE = re.compile(r"(?:бухгалтерский баланс|отч[её]т о [^\n]+?)[^\n]*?(?:19|20)\d{2}[^\n]*", re.I)
+
+
+class _FakeServer(abc.ABC):
+    """
+    Основа локальной заглушки HTTP сервиса: задержка ответа с разбросом,
+    доля ответов 503 и детерминированный генератор случайных чисел
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, seed: int = 0):
+        """
+        Инициализация заглушки
+        :param host: Адрес для прослушивания
+        :param port: Порт (0 - любой свободный)
+        :param latency: Базовая задержка ответа в секундах
+        :param jitter: Максимальный случайный разброс задержки в секундах
+        :param error_rate: Доля запросов, на которые отвечаем 503
+        :param seed: Начальное значение генератора (одинаковые запуски дают одинаковые ответы и ошибки)
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """Базовый URL заглушки"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        """
+        Запуск заглушки в фоновом потоке
+        :return: Базовый URL
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        """Остановка заглушки"""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _admit(self) -> bool:
+        """
+        Учет запроса, задержка и решение об ошибке
+        :return: True, если запрос нужно обработать, False - ответить 503
+        """
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        time.sleep(delay)
+        return not failed
+
+    def stats(self) -> dict:
+        """Количество запросов и ответов 503"""
+        with self._lock:
+            return {"requests": self.requests, "errors": self.errors}
+
+    @abc.abstractmethod
+    def handle(self, request: BaseHTTPRequestHandler, payload: dict):
+        """
+        Обработка запроса, прошедшего задержку и отбор ошибок
+        :param request: Обработчик HTTP запроса для отправки ответа
+        :param payload: Тело запроса в JSON
+        """
+
+    def _handler_class(self):
+        """Класс обработчика HTTP запросов, привязанный к заглушке"""
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not service._admit():
+                    send_body(self, 503, b"", "text/plain")
+                    return
+                service.handle(self, payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def send_body(request: BaseHTTPRequestHandler, status: int, body: bytes, content_type: str = "application/json"):
+    """
+    Отправка ответа целиком
+    :param request: Обработчик запроса
+    :param status: Код ответа
+    :param body: Тело ответа
+    :param content_type: Тип содержимого
+    """
+    request.send_response(status)
+    request.send_header("Content-Type", content_type)
+    request.send_header("Content-Length", str(len(body)))
+    request.end_headers()
+    request.wfile.write(body)
+
+
+class FakeLlamaServer(_FakeServer):
+    """
+    Заглушка эндпоинта генерации LLaMA с тем же форматом ответов:
+    - запрос метаданных (схема с report_type) - заголовок отчета с первой страницы;
+    - запрос метрик (схема с metrics) - строки "Название: число тыс. руб." из текста страницы;
+    - запрос метрик нескольких страниц (схема с pages) - то же для каждой страницы после "=== Страница N ===";
+    - запрос без схемы - текст отчета, при "stream": true - событиями Server-Sent Events.
+    Ответы зависят только от запроса, поэтому повторные прогоны сравнимы.
+    """
+    def __init__(self, *args, token_latency: float = 0.002, report_tokens: int = 200, max_metrics: int = 30, **kwargs):
+        """
+        Инициализация заглушки
+        :param token_latency: Время генерации одного токена отчета в секундах
+        :param report_tokens: Количество токенов в отчете
+        :param max_metrics: Максимальное количество метрик в ответе для одной страницы
+        """
+        super().__init__(*args, **kwargs)
+        self.token_latency = token_latency
+        self.report_tokens = report_tokens
+        self.max_metrics = max_metrics
+
+    @staticmethod
+    def _page_text(prompt: str) -> str:
+        """Текст страницы - часть промпта после инструкции, с пробелами вместо табуляций"""
+        return re.sub(r"[ \t]+", " ", prompt.split("6. ТОЛЬКО важные аналитические данные", 1)[-1])
+
+    def metadata(self, prompt: str) -> dict:
+        """Ответ на запрос метаданных"""
+        match = _REPORT_TITLE.search(self._page_text(prompt))
+        return {"report_type": match.group(0).strip() if match else ""}
+
+    def metrics(self, prompt: str) -> dict:
+        """Ответ на запрос метрик страницы"""
+        return {"metrics": self._metrics(self._page_text(prompt))}
+
+    def pages(self, prompt: str) -> dict:
+        """Ответ на запрос метрик нескольких страниц"""
+        parts = _PAGE_MARKER.split(self._page_text(prompt))
+        return {"pages": [{"page": int(number), "metrics": self._metrics(text)}
+                          for number, text in zip(parts[1::2], parts[2::2])]}
+
+    def _metrics(self, text: str) -> list[dict]:
+        """Метрики из строк текста страницы"""
+        metrics = []
+        for line in text.splitlines():
+            match = _METRIC_LINE.match(line)
+            if match:
+                name = re.sub(r"\s+", " ", match.group(1)).strip()
+                metrics.append({"value": f"{name}: {match.group(2)} тыс. руб."})
+            if len(metrics) >= self.max_metrics:
+                break
+        return metrics
+
+    def report_tokens_for(self, prompt: str, max_tokens: int) -> list[str]:
+        """Токены отчета, детерминированные по промпту"""
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        words = ["Отчет", "по", "запросу", digest[:8] + ":"] + [f"показатель_{digest[i % 64]}{i}" for i in range(self.report_tokens)]
+        return [word + " " for word in words[:min(max_tokens, len(words))]]
+
+    def handle(self, request: BaseHTTPRequestHandler, payload: dict):
+        prompt = payload.get("prompt", "")
+        schema = json.dumps(payload.get("schema", {}))
+        if '"pages"' in schema:
+            body = json.dumps(json.dumps(self.pages(prompt), ensure_ascii=False))
+            send_body(request, 200, body.encode("utf-8"))
+            return
+        if "report_type" in schema:
+            body = json.dumps(json.dumps(self.metadata(prompt), ensure_ascii=False))
+            send_body(request, 200, body.encode("utf-8"))
+            return
+        if "metrics" in schema:
+            body = json.dumps(json.dumps(self.metrics(prompt), ensure_ascii=False))
+            send_body(request, 200, body.encode("utf-8"))
+            return
+
+        tokens = self.report_tokens_for(prompt, payload.get("max_tokens", 5000))
+        if not payload.get("stream"):
+            time.sleep(self.token_latency * len(tokens))
+            send_body(request, 200, json.dumps("".join(tokens), ensure_ascii=False).encode("utf-8"))
+            return
+
+        request.send_response(200)
+        request.send_header("Content-Type", "text/event-stream")
+        request.send_header("Transfer-Encoding", "chunked")
+        request.end_headers()
+        for token in tokens + [None]:
+            if token is None:
+                chunk = b"data: [DONE]\n\n"
+            else:
+                time.sleep(self.token_latency)
+                chunk = f"data: {json.dumps({'token': token}, ensure_ascii=False)}\n\n".encode("utf-8")
+            request.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            request.wfile.flush()
+        request.wfile.write(b"0\r\n\r\n")
+
+
+class FakeEmbedderServer(_FakeServer):
+    """
+    Заглушка сервиса эмбеддингов: нормированные векторы, детерминированные по тексту
+    """
+    def __init__(self, *args, dimension: int = 1024, text_latency: float = 0.0, **kwargs):
+        """
+        Инициализация заглушки
+        :param dimension: Размерность векторов
+        :param text_latency: Дополнительная задержка на каждый текст пакета в секундах
+        """
+        super().__init__(*args, **kwargs)
+        self.dimension = dimension
+        self.text_latency = text_latency
+
+    def vector(self, text: str) -> list[float]:
+        """Вектор текста"""
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+        vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).round(6).tolist()
+
+    def handle(self, request: BaseHTTPRequestHandler, payload: dict):
+        texts = payload.get("inputs", [])
+        time.sleep(self.text_latency * len(texts))
+        send_body(request, 200, json.dumps([self.vector(text) for text in texts]).encode("utf-8"))
+
+
+def main():
+    """Запуск заглушек отдельным процессом (например, для ручной проверки сервера)"""
+    parser = argparse.ArgumentParser(description="Локальные заглушки LLaMA и сервиса эмбеддингов")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--llama-port", type=int, default=8001)
+    parser.add_argument("--embedder-port", type=int, default=8002)
+    parser.add_argument("--latency", type=float, default=0.2, help="Задержка ответа LLaMA в секундах")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 503 от LLaMA")
+    parser.add_argument("--token-latency", type=float, default=0.002)
+    parser.add_argument("--embedder-latency", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    llama = FakeLlamaServer(args.host, args.llama_port, latency=args.latency, error_rate=args.error_rate,
+                            token_latency=args.token_latency, seed=args.seed)
+    embedder = FakeEmbedderServer(args.host, args.embedder_port, latency=args.embedder_latency, seed=args.seed)
+    print(f"LLAMA_ENDPOINT={llama.start()}/generate")
+    print(f"EMBEDDER_URL={embedder.start()}/embed")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        llama.stop()
+        embedder.stop()
+
+
+if __name__ == "__main__":
+    main()
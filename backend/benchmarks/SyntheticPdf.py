@@ -0,0 +1,115 @@
+import random
+from pathlib import Path
+
+import pymupdf
+
+# Строки финансовой отчетности с кодами строк; значения генерируются случайно
+METRIC_NAMES = [
+    ("Нематериальные активы", "1110"), ("Основные средства", "1150"), ("Финансовые вложения", "1170"),
+    ("Отложенные налоговые активы", "1180"), ("Запасы", "1210"), ("Дебиторская задолженность", "1230"),
+    ("Денежные средства и денежные эквиваленты", "1250"), ("Уставный капитал", "1310"),
+    ("Нераспределенная прибыль", "1370"), ("Заемные средства", "1410"), ("Кредиторская задолженность", "1520"),
+    ("Выручка", "2110"), ("Себестоимость продаж", "2120"), ("Валовая прибыль", "2100"),
+    ("Коммерческие расходы", "2210"), ("Управленческие расходы", "2220"), ("Прибыль от продаж", "2200"),
+    ("Проценты к получению", "2320"), ("Проценты к уплате", "2330"), ("Прочие доходы", "2340"),
+    ("Прочие расходы", "2350"), ("Прибыль до налогообложения", "2300"), ("Текущий налог на прибыль", "2410"),
+    ("Чистая прибыль", "2400")
+]
+# Даты окончания периодов и заголовки отчетов для них
+PERIODS = [("31 марта", "31.03"), ("30 июня", "30.06"), ("30 сентября", "30.09"), ("31 декабря", "31.12")]
+TITLES = ["Бухгалтерский баланс на {date} {year} года",
+          "Отчет о финансовых результатах за период, закончившийся {date} {year} года"]
+# Текст без показателей (примечания, аудиторское заключение)
+FILLER = ("Настоящая бухгалтерская отчетность подготовлена в соответствии с правилами, "
+          "действующими в Российской Федерации. Руководство несет ответственность за ее достоверность.")
+
+
+def _format_number(value: int) -> str:
+    """Число с разделителями разрядов, как в отчетности"""
+    text = f"{abs(value):,}".replace(",", " ")
+    return f"({text})" if value < 0 else text
+
+
+def make_report_pdf(path: str | Path, pages: int = 5, year: int = 2022, quarter: int = 2,
+                    scanned: bool = False, seed: int = 0, dpi: int = 150) -> Path:
+    """
+    Создание синтетического финансового отчета
+    :param path: Путь к создаваемому PDF файлу
+    :param pages: Количество страниц
+    :param year: Отчетный год
+    :param quarter: Квартал окончания отчетного периода (1-4)
+    :param scanned: Сохранить страницы изображениями без текстового слоя (как скан)
+    :param seed: Начальное значение генератора значений
+    :param dpi: Разрешение изображений скана
+    :return: Путь к файлу
+    """
+    rng = random.Random(seed)
+    font = pymupdf.Font("cjk")  # Встроенный шрифт PyMuPDF с кириллицей
+    date_words, date_digits = PERIODS[quarter - 1]
+    title = rng.choice(TITLES).format(date=date_words, year=year)
+
+    document = pymupdf.open()
+    for page_number in range(pages):
+        page = document.new_page(width=595, height=842)
+        writer = pymupdf.TextWriter(page.rect)
+        y = 60
+        if page_number == 0:
+            writer.append((50, y), title, font=font, fontsize=13)
+            y += 30
+        if page_number % 4 == 3:
+            # Каждая четвертая страница - текст без показателей
+            for line in range(0, len(FILLER), 80):
+                writer.append((50, y), FILLER[line:line + 80], font=font, fontsize=10)
+                y += 16
+        else:
+            writer.append((50, y), "Показатель", font=font, fontsize=10)
+            writer.append((330, y), "Код", font=font, fontsize=10)
+            writer.append((390, y), f"На {date_digits}.{year}", font=font, fontsize=10)
+            writer.append((480, y), f"На 31.12.{year - 1}", font=font, fontsize=10)
+            y += 20
+            for name, code in rng.sample(METRIC_NAMES, 12):
+                writer.append((50, y), name, font=font, fontsize=10)
+                writer.append((330, y), code, font=font, fontsize=10)
+                writer.append((390, y), _format_number(rng.randint(-10 ** 7, 10 ** 9)), font=font, fontsize=10)
+                writer.append((480, y), _format_number(rng.randint(-10 ** 7, 10 ** 9)), font=font, fontsize=10)
+                y += 18
+        writer.write_text(page)
+
+    if scanned:
+        # Скан: каждая страница заменяется изображением без текстового слоя
+        image_document = pymupdf.open()
+        for page in document:
+            image_page = image_document.new_page(width=page.rect.width, height=page.rect.height)
+            image_page.insert_image(image_page.rect, pixmap=page.get_pixmap(dpi=dpi, colorspace=pymupdf.csGRAY))
+        document.close()
+        document = image_document
+    else:
+        document.subset_fonts()
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    document.save(path, garbage=3, deflate=True)
+    document.close()
+    return path
+
+
+def make_corpus(directory: str | Path, documents: int = 4, pages: int = 5, scanned_ratio: float = 0.0,
+                seed: int = 0) -> list[Path]:
+    """
+    Создание набора синтетических отчетов за разные периоды
+    :param directory: Каталог для PDF файлов
+    :param documents: Количество документов
+    :param pages: Количество страниц в документе
+    :param scanned_ratio: Доля документов-сканов
+    :param seed: Начальное значение генератора
+    :return: Пути к созданным файлам
+    """
+    scanned_count = round(documents * scanned_ratio)
+    paths = []
+    for index in range(documents):
+        year, quarter = 2020 + index // 4, index % 4 + 1
+        scanned = index >= documents - scanned_count
+        name = f"report_{year}_q{quarter}{'_scan' if scanned else ''}_{index}.pdf"
+        paths.append(make_report_pdf(Path(directory) / name, pages=pages, year=year, quarter=quarter,
+                                     scanned=scanned, seed=seed + index))
+    return paths
@@ -0,0 +1,417 @@
+"""
+Набор бенчмарков без доступа к сети: локальные заглушки LLaMA и сервиса эмбеддингов,
+синтетические PDF отчеты, микробенчмарки стадий и нагрузочные тесты /load и /report.
+
+Запуск из каталога backend:
+    python -m benchmarks --suite all --output results.json
+    python -m benchmarks --suite parser embedder --documents 8 --pages 10
+
+Результат - JSON со страницами/текстами в секунду, перцентилями задержек (p50/p95/p99)
+и пиковым потреблением памяти (RSS) процесса бенчмарка и сервера.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+from benchmarks.FakeServices import FakeEmbedderServer, FakeLlamaServer
+from benchmarks.SyntheticPdf import make_corpus
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+SUITES = ["parser", "extractor", "embedder", "vector", "load", "report"]
+
+
+def percentiles(values: list[float]) -> dict:
+    """
+    Перцентили задержек в миллисекундах
+    :param values: Задержки в секундах
+    :return: Словарь p50, p95, p99, max и количество измерений
+    """
+    if not values:
+        return {"count": 0}
+    array = np.asarray(values) * 1000
+    return {"count": len(values), "p50_ms": round(float(np.percentile(array, 50)), 2),
+            "p95_ms": round(float(np.percentile(array, 95)), 2),
+            "p99_ms": round(float(np.percentile(array, 99)), 2), "max_ms": round(float(array.max()), 2)}
+
+
+def peak_rss_mb() -> float:
+    """Пиковое потребление памяти текущим процессом в МБ"""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def process_peak_rss_mb(pid: int) -> float | None:
+    """Пиковое потребление памяти другим процессом в МБ (Linux, /proc/<pid>/status)"""
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def ocr_available() -> bool:
+    """Установлены ли tesseract и poppler, необходимые для OCR сканов"""
+    return shutil.which("tesseract") is not None and shutil.which("pdftoppm") is not None
+
+
+def bench_parser(corpus: list[Path], args) -> dict:
+    """Разбор PDF: страницы в секунду и задержка получения страницы отдельно для текстового слоя и OCR"""
+    from PdfToTextParser import PdfToTextParser, SOURCE_OCR
+
+    results = {}
+    text_files = [path for path in corpus if "_scan" not in path.name]
+    scanned_files = [path for path in corpus if "_scan" in path.name]
+    for name, files in (("text_layer", text_files), ("ocr", scanned_files)):
+        if not files:
+            continue
+        if name == "ocr" and not ocr_available():
+            results[name] = {"skipped": "tesseract или poppler не установлены"}
+            continue
+        parser = PdfToTextParser(workers=args.ocr_workers, cache=None)
+        latencies, ocr_pages = [], 0
+        started = time.perf_counter()
+        for path in files:
+            previous = time.perf_counter()
+            for _, source in parser.iter_pages_with_sources(str(path)):
+                now = time.perf_counter()
+                latencies.append(now - previous)
+                previous = now
+                ocr_pages += source == SOURCE_OCR
+        elapsed = time.perf_counter() - started
+        results[name] = {"files": len(files), "pages": len(latencies), "ocr_pages": ocr_pages,
+                         "seconds": round(elapsed, 3), "pages_per_second": round(len(latencies) / elapsed, 2),
+                         "page_latency": percentiles(latencies)}
+    return results
+
+
+def bench_extractor(corpus: list[Path], llama_url: str, args) -> dict:
+    """
+    Извлечение метрик через клиент LLaMA: страницы в секунду, задержки и повторы запросов.
+    Прогон выполняется без отбора страниц (каждая страница - отдельный запрос) и с отбором
+    """
+    from LlamaClient import LlamaClient
+    from MetricExtractor import MetricsExtractor
+    from PageTriage import PageTriage
+    from PdfToTextParser import PdfToTextParser
+
+    parser = PdfToTextParser(cache=None)
+    documents = [parser.parse_pdf_to_text(str(path)) for path in corpus if "_scan" not in path.name]
+    results = {}
+    for mode, triage in (("all_pages", None), ("triage", PageTriage())):
+        client = LlamaClient(llama_url, max_in_flight=args.llm_concurrency, backoff_base=0.05, backoff_max=1)
+        extractor = MetricsExtractor(llama_url, parser=parser, client=client, triage=triage)
+
+        pages, metrics = 0, 0
+        started = time.perf_counter()
+        for pages_text in documents:
+            result = extractor.extract_metrics_from_all_pages(pages_text)
+            pages += len(pages_text)
+            metrics += sum(len(page["metrics"]) for page in result["pages"])
+        elapsed = time.perf_counter() - started
+        results[mode] = {"documents": len(documents), "pages": pages, "metrics": metrics, "seconds": round(elapsed, 3),
+                         "pages_per_second": round(pages / elapsed, 2) if elapsed else None, "client": client.stats()}
+        if triage is not None:
+            results[mode]["triage"] = triage.stats()
+    return results
+
+
+def bench_embedder(embedder_url: str, args) -> dict:
+    """Получение эмбеддингов из нескольких потоков: тексты в секунду, задержка вызова, средний размер пакета"""
+    from EmbedderService import EmbedderService
+
+    service = EmbedderService(embedder_url)
+    # Четверть текстов повторяется - как одинаковые метрики на разных страницах
+    unique = [f"Бухгалтерский баланс на 30 июня 2022 года: Показатель {i}: {i * 7919} тыс. руб."
+              for i in range(args.embedder_texts * 3 // 4)]
+    texts = unique + unique[:args.embedder_texts - len(unique)]
+    chunks = [texts[i:i + 20] for i in range(0, len(texts), 20)]
+    latencies = []
+
+    def call(chunk):
+        started = time.perf_counter()
+        service.get_embeddings(chunk)
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.embedder_threads) as executor:
+        list(executor.map(call, chunks))
+    elapsed = time.perf_counter() - started
+    return {"texts": len(texts), "seconds": round(elapsed, 3), "texts_per_second": round(len(texts) / elapsed, 2),
+            "call_latency": percentiles(latencies), "service": service.stats()}
+
+
+def _bench_store(store, vectors: np.ndarray, texts: list[str], queries: np.ndarray, exact: np.ndarray) -> dict:
+    """Вставка, публикация и поиск в одном хранилище; recall@10 - доля точных соседей в выдаче"""
+    started = time.perf_counter()
+    for start in range(0, len(vectors), 100):
+        store.insert_data(vectors[start:start + 100], texts[start:start + 100], source=f"doc_{start // 500}.pdf",
+                          page=start // 100, doc_type="Отчет", period=str(2020 + start % 4))
+    store.flush()
+    insert_seconds = time.perf_counter() - started
+
+    latencies, found = [], 0
+    ids = [store.make_id(f"doc_{i // 500}.pdf", i // 100, text) for i, text in enumerate(texts)]
+    for query, expected in zip(queries, exact):
+        started = time.perf_counter()
+        hits = store.search(query[None, :], limit=10)[0]
+        latencies.append(time.perf_counter() - started)
+        found += len({hit["id"] for hit in hits} & {ids[index] for index in expected})
+    store.drop()
+    store.flush()
+    return {"insert_seconds": round(insert_seconds, 3), "rows_per_second": round(len(vectors) / insert_seconds, 2),
+            "search_latency": percentiles(latencies), "recall_at_10": round(found / (10 * len(queries)), 4)}
+
+
+def bench_vector_store(work_dir: Path, args) -> dict:
+    """Векторные хранилища (Milvus Lite, отображаемый файл float32 и int8): скорость вставки, задержка и точность поиска"""
+    from MilvusService import MilvusService
+    from MmapVectorStore import MmapVectorStore
+
+    dimension = 1024
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((args.vector_rows, dimension)).astype(np.float32)
+    texts = [f"Отчет за {2020 + i % 4} год: Показатель {i}: {i} тыс. руб." for i in range(args.vector_rows)]
+    queries = rng.standard_normal((args.vector_queries, dimension)).astype(np.float32)
+    # Точные соседи по косинусной близости - эталон для recall
+    normed = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    exact = np.argsort(-(queries @ normed.T), axis=1)[:, :10]
+
+    stores = {
+        "milvus": lambda: MilvusService(str(work_dir / "bench_vectors.db"), "bench_collection", dimension=dimension),
+        "mmap": lambda: MmapVectorStore(str(work_dir / "bench_mmap"), dimension=dimension),
+        "mmap_int8": lambda: MmapVectorStore(str(work_dir / "bench_mmap_int8"), dimension=dimension, quantize=True)
+    }
+    return {"rows": args.vector_rows,
+            **{name: _bench_store(create(), vectors, texts, queries, exact) for name, create in stores.items()}}
+
+
+class ServerProcess:
+    """
+    Сервер приложения (uvicorn) в отдельном процессе с рабочим каталогом бенчмарка
+    и адресами заглушек в переменных окружения
+    """
+    def __init__(self, work_dir: Path, llama_url: str, embedder_url: str):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            self.port = probe.getsockname()[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        # Каталог БД, как в репозитории (Milvus Lite не создает его сам)
+        (work_dir / "db").mkdir(exist_ok=True)
+        env = {**os.environ, "LLAMA_ENDPOINT": llama_url, "EMBEDDER_URL": embedder_url,
+               "PYTHONPATH": str(BACKEND_DIR) + os.pathsep + os.environ.get("PYTHONPATH", "")}
+        self.log = open(work_dir / "server.log", "w", encoding="utf-8")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "Controller:app", "--host", "127.0.0.1", "--port", str(self.port),
+             "--log-level", "warning"],
+            cwd=work_dir, env=env, stdout=self.log, stderr=subprocess.STDOUT
+        )
+        deadline = time.time() + 120
+        while time.time() < deadline:
+            try:
+                httpx.get(f"{self.url}/jobs", timeout=1)
+                return
+            except httpx.TransportError:
+                if self.process.poll() is not None:
+                    break
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"Сервер не запустился, см. {work_dir / 'server.log'}")
+
+    def peak_rss_mb(self) -> float | None:
+        """Пиковое потребление памяти сервером"""
+        return process_peak_rss_mb(self.process.pid)
+
+    def stop(self):
+        """Остановка сервера"""
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+
+def bench_load(server: ServerProcess) -> dict:
+    """Полная загрузка корпуса через /load и повторная инкрементальная загрузка без изменений"""
+    results = {}
+    with httpx.Client(base_url=server.url, timeout=60) as client:
+        for name, params in (("full", {"incremental": "false"}), ("incremental_noop", {"incremental": "true"})):
+            started = time.perf_counter()
+            job_id = client.post("/load", params=params).json()["job_id"]
+            while True:
+                job = client.get(f"/jobs/{job_id}").json()
+                if job["status"] not in ("queued", "running"):
+                    break
+                time.sleep(0.1)
+            elapsed = time.perf_counter() - started
+            pages = job["progress"].get("pages_total", 0)
+            results[name] = {"status": job["status"], "pages": pages, "seconds": round(elapsed, 3),
+                             "pages_per_second": round(pages / elapsed, 2) if pages else None,
+                             "failed": (job["result"] or {}).get("failed"),
+                             "triage": (job["result"] or {}).get("triage"),
+                             "stages": {stage: {key: values[key] for key in ("items_in", "utilization", "items_per_second")}
+                                        for stage, values in job["progress"].get("stages", {}).items()}}
+    return results
+
+
+async def _report_requests(server: ServerProcess, requests_count: int, concurrency: int, stream: bool,
+                           use_cache: bool = False) -> dict:
+    """
+    Параллельные запросы /report: задержка полного ответа и (при потоковой передаче) первого токена.
+    Без use_cache запросы идут мимо кэша отчетов, чтобы измерялись поиск и генерация
+    """
+    prompts = ["выручка за Q2 2022", "чистая прибыль за 2021 год", "баланс на 30 сентября 2020",
+               "основные средства 9 месяцев 2021", "дебиторская задолженность 2023"]
+    slots = asyncio.Semaphore(concurrency)
+    latencies, first_token, errors = [], [], 0
+
+    async def one(client: httpx.AsyncClient, index: int):
+        nonlocal errors
+        payload = {"milvus_prompt": prompts[index % len(prompts)], "prompt": "Составь отчет: ", "stream": stream,
+                   "bypass_cache": not use_cache}
+        async with slots:
+            started = time.perf_counter()
+            try:
+                if not stream:
+                    response = await client.post("/report", json=payload)
+                    response.raise_for_status()
+                else:
+                    async with client.stream("POST", "/report", json=payload) as response:
+                        response.raise_for_status()
+                        first = None
+                        async for line in response.aiter_lines():
+                            if first is None and line.startswith("data:") and '"token"' in line:
+                                first = time.perf_counter() - started
+                        if first is not None:
+                            first_token.append(first)
+            except httpx.HTTPError:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(base_url=server.url, timeout=120,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        await asyncio.gather(*(one(client, index) for index in range(requests_count)))
+    elapsed = time.perf_counter() - started
+    result = {"requests": requests_count, "concurrency": concurrency, "errors": errors, "seconds": round(elapsed, 3),
+              "requests_per_second": round(requests_count / elapsed, 2), "latency": percentiles(latencies)}
+    if stream:
+        result["time_to_first_token"] = percentiles(first_token)
+    return result
+
+
+def bench_report(server: ServerProcess, args) -> dict:
+    """Нагрузочный тест /report: обычные и потоковые ответы, повторные запросы через кэш отчетов"""
+    results = {
+        "non_streaming": asyncio.run(_report_requests(server, args.report_requests, args.report_concurrency, False)),
+        "streaming": asyncio.run(_report_requests(server, args.report_requests, args.report_concurrency, True)),
+        # Повторяющиеся промпты дашборда: после первых ответов запросы обслуживает кэш отчетов
+        "cached": asyncio.run(_report_requests(server, args.report_requests, args.report_concurrency, False, True))
+    }
+    results["cache"] = httpx.get(f"{server.url}/report/cache", timeout=10).json()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки загрузки документов и генерации отчетов")
+    parser.add_argument("--suite", nargs="+", default=["all"], choices=SUITES + ["all"])
+    parser.add_argument("--output", help="Файл для сохранения результатов (по умолчанию - только stdout)")
+    parser.add_argument("--work-dir", help="Рабочий каталог (по умолчанию - временный, удаляется после запуска)")
+    parser.add_argument("--documents", type=int, default=4, help="Количество синтетических документов")
+    parser.add_argument("--pages", type=int, default=6, help="Страниц в документе")
+    parser.add_argument("--scanned-ratio", type=float, default=0.0, help="Доля документов-сканов (нужен OCR)")
+    parser.add_argument("--ocr-workers", type=int, default=None)
+    parser.add_argument("--llama-latency", type=float, default=0.05, help="Задержка ответа заглушки LLaMA, с")
+    parser.add_argument("--llama-jitter", type=float, default=0.02)
+    parser.add_argument("--llama-error-rate", type=float, default=0.05, help="Доля ответов 503 от LLaMA")
+    parser.add_argument("--token-latency", type=float, default=0.002, help="Время генерации токена отчета, с")
+    parser.add_argument("--embedder-latency", type=float, default=0.01, help="Задержка ответа заглушки эмбеддингов, с")
+    parser.add_argument("--llm-concurrency", type=int, default=8)
+    parser.add_argument("--embedder-texts", type=int, default=2000)
+    parser.add_argument("--embedder-threads", type=int, default=8)
+    parser.add_argument("--vector-rows", type=int, default=5000)
+    parser.add_argument("--vector-queries", type=int, default=200)
+    parser.add_argument("--report-requests", type=int, default=50)
+    parser.add_argument("--report-concurrency", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    suites = SUITES if "all" in args.suite else args.suite
+
+    work_dir = Path(args.work_dir) if args.work_dir else Path(tempfile.mkdtemp(prefix="aidoc-bench-"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    llama = FakeLlamaServer(latency=args.llama_latency, jitter=args.llama_jitter, error_rate=args.llama_error_rate,
+                            token_latency=args.token_latency, seed=args.seed)
+    embedder = FakeEmbedderServer(latency=args.embedder_latency, seed=args.seed)
+    llama_url = llama.start() + "/generate"
+    embedder_url = embedder.start() + "/embed"
+
+    report = {
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpu_count": os.cpu_count(), "ocr_available": ocr_available()},
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "work_dir")},
+        "results": {}
+    }
+    # Служебный вывод модулей (прогресс обработки страниц) не должен смешиваться с JSON результатом
+    with redirect_stdout(sys.stderr):
+        run_suites(report, suites, work_dir, llama, embedder, llama_url, embedder_url, args)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+
+
+def run_suites(report: dict, suites: list[str], work_dir: Path, llama: FakeLlamaServer, embedder: FakeEmbedderServer,
+               llama_url: str, embedder_url: str, args):
+    """Выполнение выбранных наборов бенчмарков с записью результатов в report"""
+    try:
+        corpus = make_corpus(work_dir / "samples", args.documents, args.pages, args.scanned_ratio, args.seed)
+        if "parser" in suites:
+            report["results"]["parser"] = bench_parser(corpus, args)
+        if "extractor" in suites:
+            report["results"]["extractor"] = bench_extractor(corpus, llama_url, args)
+        if "embedder" in suites:
+            report["results"]["embedder"] = bench_embedder(embedder_url, args)
+        if "vector" in suites:
+            report["results"]["vector_store"] = bench_vector_store(work_dir, args)
+        if "load" in suites or "report" in suites:
+            server = ServerProcess(work_dir, llama_url, embedder_url)
+            try:
+                # /report без загруженных данных не измеряет поиск - корпус загружается в любом случае
+                report["results"]["load"] = bench_load(server)
+                if "report" in suites:
+                    report["results"]["report"] = bench_report(server, args)
+                report["results"]["server_peak_rss_mb"] = server.peak_rss_mb()
+            finally:
+                server.stop()
+        report["results"]["fake_services"] = {"llama": llama.stats(), "embedder": embedder.stats()}
+        report["results"]["peak_rss_mb"] = peak_rss_mb()
+    finally:
+        llama.stop()
+        embedder.stop()
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    # Модули backend импортируются как верхнеуровневые, как в Controller.py
+    sys.path.insert(0, str(BACKEND_DIR))
+    main()
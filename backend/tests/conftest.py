@@ -0,0 +1,37 @@
+import importlib
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from benchmarks.FakeServices import FakeEmbedderServer, FakeLlamaServer
+from benchmarks.SyntheticPdf import make_corpus
+
+
+@pytest.fixture(scope="session")
+def controller(tmp_path_factory):
+    """
+    Модуль Controller с рабочим каталогом во временной папке: синтетический корпус в samples,
+    локальные заглушки LLaMA и эмбеддингов, встроенное векторное хранилище
+    """
+    work_dir = tmp_path_factory.mktemp("app")
+    make_corpus(work_dir / "samples", documents=2, pages=4)
+    (work_dir / "db").mkdir()
+    llama, embedder = FakeLlamaServer(), FakeEmbedderServer()
+    previous_dir = os.getcwd()
+    os.chdir(work_dir)
+    patch = pytest.MonkeyPatch()
+    patch.setenv("LLAMA_ENDPOINT", llama.start() + "/generate")
+    patch.setenv("EMBEDDER_URL", embedder.start() + "/embed")
+    patch.setenv("VECTOR_STORE", "mmap")
+    try:
+        yield importlib.import_module("Controller")
+    finally:
+        patch.undo()
+        os.chdir(previous_dir)
+        llama.stop()
+        embedder.stop()
@@ -0,0 +1,22 @@
+from ContextBuilder import ContextBuilder
+
+
+def hit(text: str, period: str, score: float, doc_type: str = "Бухгалтерский баланс") -> dict:
+    """Запись результата поиска в формате MilvusService.search"""
+    return {"id": hash((text, period)), "distance": score,
+            "entity": {"text": f"{doc_type}: {text}", "doc_type": doc_type, "period": period, "source": "report.pdf"}}
+
+
+def test_duplicates_within_period_are_merged():
+    context, stats = ContextBuilder().build([[hit("Запасы: 1 200 тыс. руб.", "2022-Q1", 0.9),
+                                              hit("Запасы: 1200 тыс. руб.", "2022-Q1", 0.8)]])
+    assert stats["duplicates"] == 1
+    assert context.count("Запасы") == 1
+
+
+def test_same_value_in_different_periods_is_kept():
+    context, stats = ContextBuilder().build([[hit("Запасы: 1 200 тыс. руб.", "2022-Q1", 0.9),
+                                              hit("Запасы: 1 200 тыс. руб.", "2022-Q2", 0.8)]])
+    assert stats["duplicates"] == 0
+    assert "[2022-Q1]" in context and "[2022-Q2]" in context
+    assert context.count("Запасы") == 2
@@ -0,0 +1,63 @@
+import os
+import time
+
+import pytest
+
+from DiskCache import DiskCache
+
+
+def age(cache: DiskCache, key: str, accessed: float, written: float):
+    """Установка времени последнего чтения и записи файла записи (секунд назад)"""
+    now = time.time()
+    os.utime(cache._path(key), (now - accessed, now - written))
+
+
+def test_expired_entry_is_not_returned(tmp_path):
+    cache = DiskCache(str(tmp_path), ttl=60)
+    cache.set("report", b"value")
+    assert cache.contains("report")
+
+    age(cache, "report", accessed=0, written=120)
+    assert not cache.contains("report")
+    assert cache.get("report") is None
+    assert not cache._path("report").exists()
+    assert cache.stats()["expired"] == 1
+
+
+def test_least_recently_read_entries_are_evicted(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=300)
+    for key in ("a", "b", "c"):
+        cache.set(key, b"x" * 100)
+    age(cache, "a", accessed=10, written=300)
+    age(cache, "b", accessed=100, written=200)
+    age(cache, "c", accessed=50, written=100)
+
+    # Превышение лимита: удаляются записи, которые дольше всего не читали, до 90% лимита
+    cache.set("d", b"x" * 100)
+    assert [key for key in "abcd" if cache.contains(key)] == ["a", "d"]
+    assert cache.stats()["evictions"] == 2
+    assert cache.stats()["size_bytes"] == 200
+
+
+def test_read_updates_access_time_but_not_write_time(tmp_path):
+    cache = DiskCache(str(tmp_path), ttl=3600)
+    cache.set("a", b"value")
+    age(cache, "a", accessed=1000, written=1000)
+
+    assert cache.get("a") == b"value"
+    stat = cache._path("a").stat()
+    assert time.time() - stat.st_atime < 10
+    assert time.time() - stat.st_mtime == pytest.approx(1000, abs=10)
+
+
+def test_overwrite_is_atomic(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    cache.set("a", b"old")
+    cache.set("a", b"new")
+    assert cache.get("a") == b"new"
+
+    # Сбой во время записи оставляет прежнее значение и не оставляет временных файлов
+    with pytest.raises(TypeError):
+        cache.set("a", "не байты")
+    assert cache.get("a") == b"new"
+    assert [path.name for path in cache._path("a").parent.iterdir()] == ["a"]
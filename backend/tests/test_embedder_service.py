@@ -0,0 +1,51 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from EmbedderService import EmbedderService
+
+
+class _FailingCache:
+    """Дисковый кэш, запись в который завершается ошибкой (например, диск заполнен)"""
+    def get(self, key: str):
+        return None
+
+    def set(self, key: str, value: bytes):
+        raise OSError(28, "No space left on device")
+
+
+def test_short_api_response_fails_every_waiting_call(monkeypatch):
+    service = EmbedderService("http://embedder/embed", result_timeout=5)
+    # Сервер вернул меньше эмбеддингов, чем было отправлено текстов
+    monkeypatch.setattr(service.session, "post", lambda *args, **kwargs: type(
+        "Response", (), {"status_code": 200, "json": lambda self: [[1.0, 0.0]], "text": ""})())
+
+    with pytest.raises(Exception, match="вместо 3"):
+        service.get_embeddings(["выручка", "прибыль", "активы"])
+
+
+def test_cache_write_error_fails_every_waiting_call(monkeypatch):
+    service = EmbedderService("http://embedder/embed", cache=_FailingCache(), result_timeout=5)
+    monkeypatch.setattr(service, "_request", lambda texts: np.ones((len(texts), 2), dtype=np.float32))
+
+    with pytest.raises(OSError):
+        service.get_embeddings(["выручка", "прибыль"])
+    # Неудачные тексты не остаются "в полете" и могут быть запрошены повторно
+    assert service._in_flight == {}
+
+
+def test_async_client_is_closed_on_shutdown():
+    service = EmbedderService("http://embedder/embed")
+
+    async def serve():
+        http_client = service._get_async_client()
+        assert service._get_async_client() is http_client
+        await service.aclose()
+        return http_client
+
+    first = asyncio.run(serve())
+    assert first.is_closed
+    # Новый цикл событий получает новый клиент, а не закрытый
+    second = asyncio.run(serve())
+    assert second is not first and second.is_closed and service._async_clients == {}
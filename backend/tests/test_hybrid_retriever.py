@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from HybridRetriever import HybridRetriever, report_kinds
+from MmapVectorStore import MmapVectorStore
+from Periods import expand_period, parse_period, query_periods
+
+BALANCE_Q2 = "Бухгалтерский баланс за 2 квартал 2022 года"
+INCOME_Q2 = "Отчет о финансовых результатах за 2 квартал 2022 года"
+INCOME_2021 = "Отчет о финансовых результатах за 2021 год"
+
+
+@pytest.mark.parametrize("text, period", [
+    ("ОТЧЕТ О ФИНАНСОВЫХ РЕЗУЛЬТАТАХ за 1-е полугодие 2021 года", "2021-H1"),
+    ("Отчет за 2 квартал 2022", "2022-Q2"),
+    ("III квартал 2019", "2019-Q3"),
+    ("выручка Q3 2022", "2022-Q3"),
+    ("за 9 месяцев 2021 года", "2021-9M"),
+    ("за три месяца 2020", "2020-Q1"),
+    ("Бухгалтерский баланс на 31 декабря 2022 г.", "2022"),
+    ("Бухгалтерский баланс на 30 июня 2021 г.", "2021-H1"),
+    ("Бухгалтерский баланс на 30.09.2022", "2022-9M"),
+    ("за 2013 и 2012 годы", "2013"),
+    ("без указания года", ""),
+])
+def test_parse_period(text, period):
+    assert parse_period(text) == period
+
+
+def test_query_periods_include_covering_reports():
+    assert expand_period("2022-Q2") == ["2022-Q2", "2022-H1"]
+    assert expand_period("2022-Q4") == ["2022-Q4", "2022"]
+    assert query_periods("выручка за 2 квартал 2022") == ["2022-Q2", "2022-H1"]
+    # Диапазон лет - все периоды каждого года
+    periods = query_periods("с Q1 2020 по Q3 2021")
+    assert periods[0] == "2020" and periods[-1] == "2021-9M" and len(periods) == 14
+    assert query_periods("выручка") == []
+
+
+def make_retriever(tmp_path, records: list[tuple[str, str, list[float]]]) -> HybridRetriever:
+    """Гибридный поиск по хранилищу с записями (тип отчета, текст метрики, вектор)"""
+    store = MmapVectorStore(str(tmp_path), dimension=4)
+    retriever = HybridRetriever(store)
+    for index, (doc_type, text, vector) in enumerate(records):
+        retriever.upsert_rows(retriever.make_rows([vector], [f"{doc_type}: {text}"], source="report.pdf",
+                                                  page=index + 1, doc_type=doc_type, period=parse_period(doc_type)))
+    retriever.flush()
+    return retriever
+
+
+def test_query_filters_use_known_periods_and_report_kinds(tmp_path):
+    retriever = make_retriever(tmp_path, [
+        (BALANCE_Q2, "Запасы 1 200", [1, 0, 0, 0]),
+        (INCOME_Q2, "Выручка 5 000", [0, 1, 0, 0]),
+        (INCOME_2021, "Выручка 4 000", [0, 0, 1, 0]),
+    ])
+    assert report_kinds(INCOME_Q2) == {"income"}
+
+    assert retriever.query_filters("выручка за 2 квартал 2022") == {"period": ["2022-Q2"]}
+    assert retriever.query_filters("отчет о финансовых результатах за 2 квартал 2022") == \
+        {"period": ["2022-Q2"], "doc_type": [INCOME_Q2]}
+    # Условие, которому не соответствует ни одна запись, не применяется
+    assert retriever.query_filters("выручка за 2019 год") == {}
+
+    hits = retriever.search("выручка за 2021 год", [[0, 1, 1, 0]], limit=5)[0]
+    assert [hit["entity"]["text"] for hit in hits] == [f"{INCOME_2021}: Выручка 4 000"]
+
+
+def test_reciprocal_rank_fusion_prefers_records_found_by_both_searches(tmp_path):
+    retriever = make_retriever(tmp_path, [
+        (INCOME_Q2, "Чистая прибыль 900", [1, 0, 0, 0]),             # первая по вектору, нет в BM25
+        (INCOME_Q2, "Выручка 5 000", [0.9, 0.43, 0, 0]),             # вторая в обоих списках
+        (INCOME_Q2, "Выручка выручка от продаж 7 000", [-1, 0, 0, 0]),  # первая в BM25, последняя по вектору
+        *[(INCOME_Q2, f"Расходы {index}", [0.5, 0, 0.8, 0.2 * index]) for index in range(4)],
+    ])
+
+    hits = retriever.search("выручка", [[1, 0, 0, 0]], limit=3, filters={})[0]
+    assert [hit["entity"]["text"].split(": ")[1] for hit in hits] == \
+        ["Выручка 5 000", "Выручка выручка от продаж 7 000", "Чистая прибыль 900"]
+    assert hits[0]["distance"] == pytest.approx(2 / 62)
@@ -0,0 +1,64 @@
+import os
+
+from IngestManifest import IngestManifest
+from PdfToTextParser import PdfToTextParser
+
+VERSIONS = {"parser": "4", "prompt": "1"}
+
+
+def corpus(directory, **contents) -> dict:
+    """Файлы корпуса с заданным содержимым"""
+    directory.mkdir(exist_ok=True)
+    paths = {}
+    for name, content in contents.items():
+        paths[name] = directory / f"{name}.pdf"
+        paths[name].write_bytes(content)
+    return paths
+
+
+def recorded(tmp_path, files: dict, versions: dict = VERSIONS) -> IngestManifest:
+    """Манифест, в который записаны файлы, прочитанный заново с диска"""
+    manifest = IngestManifest(str(tmp_path / "manifest.json"), versions)
+    for path in files.values():
+        manifest.record(path)
+    manifest.save()
+    return IngestManifest(str(tmp_path / "manifest.json"), versions)
+
+
+def test_plan_detects_added_changed_unchanged_and_removed(tmp_path):
+    files = corpus(tmp_path / "samples", a=b"A", b=b"B", c=b"C")
+    manifest = recorded(tmp_path, files)
+
+    files["b"].write_bytes(b"B2")
+    files["c"].unlink()
+    files.update(corpus(tmp_path / "samples", d=b"D"))
+    plan = manifest.plan([path for path in files.values() if path.exists()])
+    assert plan == {"added": [files["d"]], "changed": [files["b"]], "unchanged": [files["a"]], "removed": ["c.pdf"]}
+
+
+def test_touched_file_with_same_content_is_unchanged(tmp_path):
+    files = corpus(tmp_path / "samples", a=b"A")
+    manifest = recorded(tmp_path, files)
+
+    stat = files["a"].stat()
+    os.utime(files["a"], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert manifest.plan([files["a"]])["unchanged"] == [files["a"]]
+
+
+def test_hash_is_reused_when_size_and_mtime_match(tmp_path, monkeypatch):
+    files = corpus(tmp_path / "samples", a=b"A")
+    manifest = recorded(tmp_path, files)
+
+    def fail(file_path):
+        raise AssertionError("хеш не должен пересчитываться")
+
+    monkeypatch.setattr(PdfToTextParser, "file_hash", staticmethod(fail))
+    assert manifest.plan([files["a"]])["unchanged"] == [files["a"]]
+
+
+def test_new_processing_version_marks_files_changed(tmp_path):
+    files = corpus(tmp_path / "samples", a=b"A")
+    recorded(tmp_path, files)
+
+    manifest = IngestManifest(str(tmp_path / "manifest.json"), {**VERSIONS, "parser": "5"})
+    assert manifest.plan([files["a"]])["changed"] == [files["a"]]
@@ -0,0 +1,105 @@
+import logging
+import threading
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from IngestManifest import IngestManifest
+from IngestionJobs import IngestionJob
+from IngestionPipeline import IngestionPipeline
+from PageTriage import PageTriage
+
+
+def run_job(controller, incremental: bool) -> dict:
+    """Выполнение задания загрузки в текущем потоке"""
+    job = IngestionJob(uuid.uuid4().hex, {"bypass_llm_cache": False, "incremental": incremental, "triage": True},
+                       Path("db/jobs"))
+    return controller.run_load_job(job)
+
+
+def stored_pages(controller) -> set[tuple[str, int]]:
+    """Страницы документов, записи которых есть в векторной БД"""
+    return {(row["source"], row["page"]) for row in controller.vector_store.iter_rows()}
+
+
+def test_full_reload_ignores_stale_checkpoints(controller):
+    assert run_job(controller, incremental=False)["failed"] == []
+    expected = stored_pages(controller)
+    assert expected
+
+    # Контрольные точки, оставшиеся от прерванного задания: все страницы первого документа отмечены готовыми
+    source = sorted(expected)[0][0]
+    content_hash = controller.pdf_parser.file_hash(f"samples/{source}")
+    controller.ingest_checkpoint.append(content_hash, [{"page": page, "doc_type": "Отчет", "metrics": 1}
+                                                       for document, page in expected if document == source])
+
+    assert run_job(controller, incremental=False)["failed"] == []
+    assert stored_pages(controller) == expected
+
+
+def test_dry_run_estimate_accounts_for_triage(controller):
+    files = sorted(Path("samples").glob("*.pdf"))
+    estimate = IngestManifest.estimate(files, controller.pdf_parser, PageTriage())
+    assert estimate["llm_calls_max"] == estimate["pages"] + len(files)
+
+    # Оценка совпадает с числом запросов извлечения метрик при загрузке и запросом метаданных на документ
+    result = run_job(controller, incremental=False)
+    assert estimate["llm_calls"] == result["triage"]["requests"] + len(files)
+    assert estimate["llm_calls"] < estimate["llm_calls_max"]
+
+
+class _FailingStore:
+    """Векторная БД, в которой вставка всегда завершается ошибкой"""
+    def make_rows(self, vectors, texts, source="", page=0, doc_type="", period=""):
+        return [{"id": index, "text": text, "source": source, "page": page} for index, text in enumerate(texts)]
+
+    def upsert_rows(self, rows):
+        raise RuntimeError("БД недоступна")
+
+    def delete_by_source(self, source):
+        pass
+
+    def flush(self):
+        pass
+
+
+def failing_pipeline(insert_batch_size: int) -> IngestionPipeline:
+    """Конвейер с заглушками сервисов: по одной странице с одной метрикой на документ, вставка в БД не удается"""
+    parser = SimpleNamespace(file_hash=lambda path: Path(path).name,
+                             iter_pages=lambda path: iter(["Бухгалтерский баланс на 31 декабря 2022 г."]))
+    extractor = SimpleNamespace(
+        client=SimpleNamespace(max_in_flight=1), logger=logging.getLogger("test"), triage=None,
+        extract_metadata=lambda first_page: {"report_type": "Бухгалтерский баланс 2022"},
+        extract_metrics_from_pages=lambda pages: {page: {"metrics": [{"value": "Запасы: 1 200"}]} for page, _ in pages})
+    embedder = SimpleNamespace(get_embeddings=lambda texts: np.zeros((len(texts), 2), dtype=np.float32))
+    return IngestionPipeline(parser, extractor, embedder, _FailingStore(),
+                             workers={"parse": 1, "extract": 1, "embed": 1, "insert": 1},
+                             insert_batch_size=insert_batch_size)
+
+
+@pytest.mark.parametrize("insert_batch_size", [2, 1000])
+def test_failed_insert_marks_every_buffered_document(insert_batch_size):
+    pipeline = failing_pipeline(insert_batch_size)
+
+    # Записи обоих документов попадают в один пакет вставки (при вставке второго или в конце загрузки)
+    pipeline.run([Path("A.pdf"), Path("B.pdf")])
+    assert pipeline.failed_sources == {"A.pdf", "B.pdf"}
+
+
+def test_progress_is_read_while_pipeline_runs(tmp_path):
+    job = IngestionJob("job", {}, tmp_path)
+    job.pages_total = 20
+    job.pipeline = failing_pipeline(insert_batch_size=2)
+    runner = threading.Thread(target=job.pipeline.run, args=([Path(f"{index}.pdf") for index in range(20)],))
+    runner.start()
+    # Прогресс читается из другого потока, пока потоки конвейера меняют счетчики
+    while runner.is_alive():
+        job.progress()
+    runner.join()
+
+    progress = job.progress()
+    assert progress["pages_done"] == 20
+    assert progress["failed_sources"] == sorted(f"{index}.pdf" for index in range(20))
@@ -0,0 +1,30 @@
+from LayoutEngine import LayoutEngine
+
+
+def page_data(words: list[tuple[str, int, int, int, int]]) -> dict:
+    """Слова (текст, left, top, width, height) в формате pytesseract.Output.DICT"""
+    return {name: [word[index] for word in words]
+            for index, name in enumerate(("text", "left", "top", "width", "height"))}
+
+
+def table_words() -> list[tuple[str, int, int, int, int]]:
+    """Таблица из четырех строк: название показателя и значения за два периода"""
+    words = []
+    for row, (name, first, second) in enumerate([("Выручка", 100, 200), ("Прибыль", 10, 20),
+                                                 ("Активы", 5, 16), ("Итого", 115, 236)]):
+        top = 100 + row * 50
+        words += [(name, 40, top, 120, 20), (str(first), 300, top, 40, 20), (str(second), 420, top, 40, 20)]
+    return words
+
+
+def test_table_columns_are_separated_by_tabs():
+    text = LayoutEngine().build_text(page_data(table_words()))
+    assert text.splitlines() == ["Выручка\t100\t200", "Прибыль\t10\t20", "Активы\t5\t16", "Итого\t115\t236"]
+
+
+def test_vertical_rule_does_not_merge_rows():
+    # Вертикальная линия рамки таблицы, распознанная как слово высотой во всю таблицу
+    text = LayoutEngine().build_text(page_data([("|", 10, 90, 4, 220)] + table_words()))
+    lines = text.splitlines()
+    assert len(lines) == 4
+    assert lines[1:] == ["Прибыль\t10\t20", "Активы\t5\t16", "Итого\t115\t236"]
@@ -0,0 +1,151 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+
+from LlamaClient import LLM_IN_FLIGHT, InFlightLimit, LlamaClient
+
+
+class _BrokenStream(httpx.AsyncByteStream):
+    """Тело ответа, которое обрывается после нескольких фрагментов"""
+    def __init__(self, chunks: list[bytes]):
+        self.chunks = chunks
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+        raise httpx.ReadError("connection reset")
+
+
+def test_stream_is_not_retried_after_first_chunk():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, headers={"content-type": "text/plain"}, stream=_BrokenStream([b"A", b"B"]))
+
+    client = LlamaClient("http://llama/generate", backoff_base=0.0, async_transport=httpx.MockTransport(handler))
+    received = []
+
+    async def consume():
+        async for chunk in client.astream({"prompt": "отчет"}):
+            received.append(chunk)
+
+    with pytest.raises(httpx.ReadError):
+        asyncio.run(consume())
+    assert received == ["A", "B"]
+    assert len(requests) == 1
+
+
+def test_stream_is_retried_before_first_chunk():
+    responses = iter([httpx.Response(503), httpx.Response(200, headers={"content-type": "text/plain"}, text="AB")])
+    client = LlamaClient("http://llama/generate", backoff_base=0.0,
+                         async_transport=httpx.MockTransport(lambda request: next(responses)))
+
+    async def consume():
+        return [chunk async for chunk in client.astream({"prompt": "отчет"})]
+
+    assert "".join(asyncio.run(consume())) == "AB"
+
+
+def test_rate_limit_applies_to_async_requests():
+    client = LlamaClient("http://llama/generate", rate_limit=20,
+                         async_transport=httpx.MockTransport(lambda request: httpx.Response(200, json="ok")))
+
+    async def send(count: int):
+        await asyncio.gather(*(client.apost({"prompt": "отчет"}) for _ in range(count)))
+
+    started = time.monotonic()
+    # 20 запросов проходят сразу (емкость корзины), остальные 10 - со скоростью 20 в секунду
+    asyncio.run(send(30))
+    assert time.monotonic() - started >= 0.45
+
+
+def test_in_flight_limit_is_shared_by_threads_and_coroutines():
+    limit = InFlightLimit(2)
+    peak = []
+    release = threading.Event()
+
+    def hold():
+        with limit:
+            peak.append(limit.active)
+            release.wait()
+
+    threads = [threading.Thread(target=hold) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    while limit.active < 2:
+        time.sleep(0.001)
+
+    async def generate():
+        async def one():
+            async with limit:
+                peak.append(limit.active)
+                await asyncio.sleep(0.01)
+
+        tasks = asyncio.gather(*(one() for _ in range(4)))
+        await asyncio.sleep(0.05)
+        # Слоты заняты синхронными запросами - корутины ждут, не блокируя цикл событий
+        assert limit.active == 2 and len(peak) == 2
+        release.set()
+        await tasks
+
+    asyncio.run(generate())
+    for thread in threads:
+        thread.join()
+    assert len(peak) == 6 and max(peak) <= 2 and limit.active == 0
+
+
+def test_async_client_is_closed_on_shutdown():
+    client = LlamaClient("http://llama/generate",
+                         async_transport=httpx.MockTransport(lambda request: httpx.Response(200, json="ok")))
+
+    async def serve():
+        await client.apost({"prompt": "отчет"})
+        http_client = client._get_async_client()
+        await client.aclose()
+        return http_client
+
+    first = asyncio.run(serve())
+    assert first.is_closed
+    # Новый цикл событий получает новый клиент, а не закрытый
+    second = asyncio.run(serve())
+    assert second is not first and second.is_closed
+
+
+def test_in_flight_gauge_is_restored_after_cancel_and_errors():
+    started = asyncio.Event()
+
+    async def hanging(request: httpx.Request) -> httpx.Response:
+        started.set()
+        await asyncio.sleep(60)
+
+    def failing(request: httpx.Request) -> httpx.Response:
+        raise ValueError("ошибка транспорта")
+
+    async def cancel_request():
+        client = LlamaClient("http://llama/generate", async_transport=httpx.MockTransport(hanging))
+        task = asyncio.create_task(client.apost({"prompt": "отчет"}))
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return client
+
+    async def consume_stream(client: LlamaClient):
+        return [chunk async for chunk in client.astream({"prompt": "отчет"})]
+
+    before = LLM_IN_FLIGHT.value()
+    client = asyncio.run(cancel_request())
+    assert client._slots.active == 0
+
+    # Ошибки, не относящиеся к сети, не повторяются, но тоже освобождают показатель и учитываются в задержках
+    client = LlamaClient("http://llama/generate", async_transport=httpx.MockTransport(failing))
+    with pytest.raises(ValueError):
+        asyncio.run(client.apost({"prompt": "отчет"}))
+    with pytest.raises(ValueError):
+        asyncio.run(consume_stream(client))
+    assert LLM_IN_FLIGHT.value() == before
+    assert len(client._latencies) == 2
@@ -0,0 +1,30 @@
+import pytest
+
+from MetricStore import parse_metric
+
+
+@pytest.mark.parametrize("text, value, unit", [
+    ("Выручка: 99 340 114 тыс. руб.", 99_340_114e3, "тыс. руб."),
+    ("Выручка: 99340114 тыс. руб.", 99_340_114e3, "тыс. руб."),
+    ("Чистая прибыль: 1,234 млрд руб.", 1.234e9, "млрд руб."),
+    ("Рентабельность: 12,5%", 12.5, "%"),
+    ("Выручка: 1,234,567 тыс. руб.", 1_234_567e3, "тыс. руб."),
+    ("Выручка: 1,234.5 млн руб.", 1_234.5e6, "млн руб."),
+    ("Убыток: (1 200,5) тыс. руб.", -1_200.5e3, "тыс. руб."),
+    ("Выручка, млн руб.: 150", 150e6, ""),
+    ("Запасы на 31.12.2022: 1 200 тыс. руб.", 1_200e3, "тыс. руб."),
+])
+def test_parse_metric_value(text, value, unit):
+    metric = parse_metric(text)
+    assert metric["value"] == pytest.approx(value)
+    assert metric["unit"] == unit
+
+
+@pytest.mark.parametrize("text", [
+    "Дата: 31.12.2022",
+    "Отчетная дата: 31.12.22",
+    "Выручка",
+    ": 100",
+])
+def test_parse_metric_without_value(text):
+    assert parse_metric(text) is None
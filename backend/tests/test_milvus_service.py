@@ -0,0 +1,44 @@
+import pytest
+
+from MilvusService import MilvusService
+
+
+def test_record_id_depends_only_on_source_page_and_text():
+    record_id = MilvusService.make_id("report.pdf", 3, "Выручка: 5 000")
+    # Идентификатор не зависит от процесса и запуска (в отличие от hash()), иначе повторная загрузка дублирует записи
+    assert record_id == 3627608860176578140
+    assert 0 <= record_id < 2 ** 63
+    assert len({record_id, MilvusService.make_id("report.pdf", 4, "Выручка: 5 000"),
+                MilvusService.make_id("other.pdf", 3, "Выручка: 5 000"),
+                MilvusService.make_id("report.pdf", 3, "Выручка: 5 001")}) == 4
+
+
+@pytest.mark.parametrize("filters, expression", [
+    (None, ""),
+    ({}, ""),
+    ({"period": "2022"}, 'period == "2022"'),
+    ({"page": 3}, "page == 3"),
+    ({"period": ["2022-Q2", "2022-H1"], "doc_type": "Бухгалтерский баланс"},
+     'period in ["2022-Q2", "2022-H1"] and doc_type == "Бухгалтерский баланс"'),
+    ({"doc_type": 'Баланс ПАО "Ромашка"'}, 'doc_type == "Баланс ПАО \\"Ромашка\\""'),
+])
+def test_filter_expression(filters, expression):
+    assert MilvusService._build_filter(filters) == expression
+
+
+def test_reload_replaces_records_and_filters_apply(tmp_path):
+    service = MilvusService(str(tmp_path / "milvus.db"), "metrics", dimension=4)
+    rows = service.make_rows([[1, 0, 0, 0], [0, 1, 0, 0]], ["Выручка: 5 000", "Запасы: 1 200"], source="a.pdf",
+                             page=1, doc_type='Баланс ПАО "Ромашка"', period="2022-Q2")
+    service.upsert_rows(rows)
+    service.upsert_rows(rows)
+    service.upsert_rows(service.make_rows([[0, 0, 1, 0]], ["Выручка: 4 000"], source="b.pdf", page=1,
+                                          doc_type="Отчет о финансовых результатах", period="2021"))
+    assert len(list(service.iter_rows())) == 3
+
+    hits = service.search([[1, 0, 0, 0]], limit=10, filters={"period": ["2022-Q2", "2022-H1"],
+                                                             "doc_type": 'Баланс ПАО "Ромашка"'})[0]
+    assert sorted(hit["entity"]["text"] for hit in hits) == ["Выручка: 5 000", "Запасы: 1 200"]
+
+    service.delete_by_source("a.pdf")
+    assert [row["source"] for row in service.iter_rows()] == ["b.pdf"]
@@ -0,0 +1,89 @@
+import multiprocessing
+
+import numpy as np
+
+from MmapVectorStore import MmapVectorStore
+
+DIMENSION = 4
+
+
+def rows(store: MmapVectorStore, source: str, count: int, first: int = 0) -> list[dict]:
+    """Записи документа; вектор записи i - единичный вектор по оси i % DIMENSION, умноженный на (i + 1)"""
+    vectors = [np.eye(DIMENSION)[index % DIMENSION] * (index + 1) for index in range(first, first + count)]
+    return store.make_rows(vectors, [f"{source}: метрика {index}" for index in range(first, first + count)],
+                           source=source, page=1, doc_type="Бухгалтерский баланс", period="2022")
+
+
+def stored_vectors(store: MmapVectorStore) -> dict[str, np.ndarray]:
+    """Векторы опубликованного снимка по текстам записей"""
+    snapshot = store._current()
+    return {row["text"]: snapshot.dequantize(slice(position, position + 1))[0]
+            for position, row in enumerate(snapshot.rows)}
+
+
+def test_staged_rows_are_published_by_flush(tmp_path):
+    store = MmapVectorStore(str(tmp_path), dimension=DIMENSION)
+    store.upsert_rows(rows(store, "A.pdf", 3))
+    assert store.published_version() is None
+    assert list(store.iter_rows()) == []
+
+    first = store.flush()
+    assert store.published_version() == first
+    assert len(list(store.iter_rows())) == 3
+    assert store.flush() is None
+
+    # Читатель другого процесса держит прежний снимок и переключается на новый после публикации
+    reader = MmapVectorStore(str(tmp_path), dimension=DIMENSION)
+    old_snapshot = reader._current()
+    store.delete_by_source("A.pdf")
+    store.upsert_rows(rows(store, "B.pdf", 2))
+    assert reader.published_version() == first
+
+    second = store.flush()
+    assert second != first
+    assert len(old_snapshot.rows) == 3
+    assert reader.published_version() == second
+    assert {row["source"] for row in reader.iter_rows()} == {"B.pdf"}
+    hits = reader.search([np.eye(DIMENSION)[1]], limit=1)[0]
+    assert hits[0]["entity"]["text"] == "B.pdf: метрика 1"
+
+
+def test_writers_in_different_processes_share_the_journal(tmp_path):
+    # Два экземпляра хранилища - как два воркера uvicorn: журнал дополняется попеременно
+    first = MmapVectorStore(str(tmp_path), dimension=DIMENSION)
+    second = MmapVectorStore(str(tmp_path), dimension=DIMENSION)
+    first.upsert_rows(rows(first, "A.pdf", 2))
+    second.upsert_rows(rows(second, "B.pdf", 3))
+    first.upsert_rows(rows(first, "A.pdf", 2, first=2))
+    second.flush()
+
+    vectors = stored_vectors(first)
+    assert len(vectors) == 7
+    for text, vector in vectors.items():
+        index = int(text.rsplit(" ", 1)[1])
+        np.testing.assert_allclose(vector, np.eye(DIMENSION)[index % DIMENSION])
+
+
+def _stage_rows(path: str, source: str, batches: int):
+    """Запись журнала в отдельном процессе"""
+    store = MmapVectorStore(path, dimension=DIMENSION)
+    for batch in range(batches):
+        store.upsert_rows(rows(store, source, 5, first=batch * 5))
+
+
+def test_concurrent_processes_do_not_corrupt_the_journal(tmp_path):
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_stage_rows, args=(str(tmp_path), source, 40)) for source in ("A.pdf", "B.pdf")]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    store = MmapVectorStore(str(tmp_path), dimension=DIMENSION)
+    store.flush()
+    vectors = stored_vectors(store)
+    assert len(vectors) == 400
+    for text, vector in vectors.items():
+        index = int(text.rsplit(" ", 1)[1])
+        np.testing.assert_allclose(vector, np.eye(DIMENSION)[index % DIMENSION])
@@ -0,0 +1,40 @@
+import numpy as np
+
+from ReportCache import ReportCache
+
+PROMPT = "Составь отчет о выручке"
+
+
+def put(cache: ReportCache, search_prompt: str, vectors: np.ndarray, reply: str):
+    """Сохранение отчета с текущим отпечатком БД"""
+    cache.put(search_prompt, PROMPT, vectors, reply, {}, cache.fingerprint_snapshot())
+
+
+def test_similar_prompt_is_served_from_cache(tmp_path):
+    cache = ReportCache(str(tmp_path))
+    vectors = np.array([[1.0, 0.0], [0.0, 1.0]])
+    put(cache, "выручка за Q2 2022", vectors, "отчет за Q2")
+
+    entry, similarity = cache.find(vectors + 0.01, "Выручка за 2 квартал 2022 года", PROMPT)
+    assert entry["reply"] == "отчет за Q2"
+    assert similarity >= cache.threshold
+
+
+def test_other_period_is_not_served_from_cache(tmp_path):
+    cache = ReportCache(str(tmp_path))
+    vectors = np.array([[1.0, 0.0], [0.0, 1.0]])
+    put(cache, "выручка за Q2 2022", vectors, "отчет за Q2")
+
+    # Эмбеддинги совпадают, промпты отличаются только периодом
+    entry, _ = cache.find(vectors, "выручка за Q3 2022", PROMPT)
+    assert entry is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_other_report_kind_is_not_served_from_cache(tmp_path):
+    cache = ReportCache(str(tmp_path))
+    vectors = np.array([[1.0, 0.0], [0.0, 1.0]])
+    put(cache, "бухгалтерский баланс за 2022", vectors, "баланс")
+
+    entry, _ = cache.find(vectors, "отчет о движении денежных средств за 2022", PROMPT)
+    assert entry is None